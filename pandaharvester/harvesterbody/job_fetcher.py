@@ -15,6 +15,9 @@ from pandaharvester.harvestermisc.info_utils import PandaQueuesDict
 # logger
 _logger = core_utils.setup_logger("job_fetcher")
 
+# metrics of fetch cycles
+metrics_registry = core_utils.MetricsRegistry()
+
 
 # class to fetch jobs
 class JobFetcher(AgentBase):
@@ -32,6 +35,7 @@ class JobFetcher(AgentBase):
         while True:
             mainLog = self.make_logger(_logger, f"id={self.get_pid()}", method_name="run")
             mainLog.debug("getting number of jobs to be fetched")
+            sw_cycle = core_utils.get_stopwatch()
             # get number of jobs to be fetched
             nJobsPerQueue = self.dbProxy.get_num_jobs_to_fetch(harvester_config.jobfetcher.nQueues, harvester_config.jobfetcher.lookupTime)
             mainLog.debug(f"got {len(nJobsPerQueue)} queues")
@@ -39,7 +43,9 @@ class JobFetcher(AgentBase):
             # get up to date queue configuration
             pandaQueueDict = PandaQueuesDict()
 
-            # loop over all queues
+            # loop over all queues to make getJob requests
+            queueConfigList = []
+            argsList = []
             for queueName, nJobs in iteritems(nJobsPerQueue):
                 # check queue
                 if not self.queueConfigMapper.has_queue(queueName):
@@ -64,19 +70,31 @@ class JobFetcher(AgentBase):
                 choice_list = core_utils.make_choice_list(pdpm=pdpm, default=default_prodSourceLabel)
                 prodSourceLabel = random.choice(choice_list)
                 tmpLog.debug(f"getting {nJobs} jobs for prodSourceLabel {prodSourceLabel}")
-                sw = core_utils.get_stopwatch()
-                jobs, errStr = self.communicator.get_jobs(siteName, self.nodeName, prodSourceLabel, self.nodeName, nJobs, queueConfig.getJobCriteria)
-                tmpLog.info(f"got {len(jobs)} jobs with {errStr} {sw.get_elapsed_time()}")
-                # convert to JobSpec
+                queueConfigList.append((queueName, queueConfig))
+                argsList.append((siteName, self.nodeName, prodSourceLabel, self.nodeName, nJobs, queueConfig.getJobCriteria))
+
+            # get jobs for all queues in bulk
+            sw = core_utils.get_stopwatch()
+            jobsList = self.communicator.get_jobs_for_queues(argsList) if argsList else []
+            fetch_time = sw.get_elapsed_time_in_sec(precise=True)
+            mainLog.debug(f"getJob for {len(argsList)} queues {sw.get_elapsed_time()}")
+
+            # convert to JobSpec
+            sw_startconvert = core_utils.get_stopwatch()
+            jobSpecs = []
+            fileStatMap = dict()
+            nErrors = 0
+            for (queueName, queueConfig), (jobs, errStr) in zip(queueConfigList, jobsList):
+                tmpLog = self.make_logger(_logger, f"queueName={queueName}", method_name="run")
+                tmpLog.info(f"got {len(jobs)} jobs with {errStr}")
+                if errStr != "OK":
+                    nErrors += 1
                 if len(jobs) > 0:
                     # get extractor plugin
                     if hasattr(queueConfig, "extractor"):
                         extractorCore = self.pluginFactory.get_plugin(queueConfig.extractor)
                     else:
                         extractorCore = None
-                    jobSpecs = []
-                    fileStatMap = dict()
-                    sw_startconvert = core_utils.get_stopwatch()
                     for job in jobs:
                         timeNow = datetime.datetime.utcnow()
                         jobSpec = JobSpec()
@@ -121,12 +139,21 @@ class JobFetcher(AgentBase):
                                 jobSpec.add_in_file(fileSpec)
                         jobSpec.trigger_propagation()
                         jobSpecs.append(jobSpec)
-                    # insert to DB
-                    tmpLog.debug(f"Converting of {len(jobs)} jobs {sw_startconvert.get_elapsed_time()}")
-                    sw_insertdb = core_utils.get_stopwatch()
-                    self.dbProxy.insert_jobs(jobSpecs)
-                    tmpLog.debug(f"Insert of {len(jobSpecs)} jobs {sw_insertdb.get_elapsed_time()}")
-            mainLog.debug("done")
+            # insert to DB in one transaction
+            if len(jobSpecs) > 0:
+                mainLog.debug(f"Converting of {len(jobSpecs)} jobs {sw_startconvert.get_elapsed_time()}")
+                sw_insertdb = core_utils.get_stopwatch()
+                self.dbProxy.insert_jobs(jobSpecs)
+                mainLog.debug(f"Insert of {len(jobSpecs)} jobs {sw_insertdb.get_elapsed_time()}")
+            # metrics of the cycle
+            if len(argsList) > 0:
+                metrics_registry.observe("cycle", "fetch_time", fetch_time)
+                metrics_registry.observe("cycle", "total_time", sw_cycle.get_elapsed_time_in_sec(precise=True))
+                metrics_registry.increment("cycle", "n_cycles")
+                metrics_registry.increment("cycle", "n_queues", len(argsList))
+                metrics_registry.increment("cycle", "n_errors", nErrors)
+                metrics_registry.increment("cycle", "n_jobs", len(jobSpecs))
+            mainLog.debug(f"done with {len(jobSpecs)} jobs for {len(argsList)} queues {sw_cycle.get_elapsed_time()}")
             # check if being terminated
             if self.terminated(harvester_config.jobfetcher.sleepTime):
                 mainLog.debug("terminated")
@@ -83,7 +83,8 @@ class Monitor(AgentBase):
         monitor_fifo = self.monitor_fifo
         sleepTime = (fifoSleepTimeMilli / 1000.0) if monitor_fifo.enabled else harvester_config.monitor.sleepTime
         adjusted_sleepTime = sleepTime
-        if monitor_fifo.enabled:
+        if monitor_fifo.enabled and not monitor_fifo.is_sharded():
+            # shards are restored when claimed
             monitor_fifo.restore()
         while True:
             sw_main = core_utils.get_stopwatch()
@@ -138,7 +139,7 @@ class Monitor(AgentBase):
                 n_loops_hit = 0
                 last_fifo_cycle_timestamp = time.time()
                 to_break = False
-                obj_dequeued_id_list = []
+                obj_dequeued_id_dict = collections.defaultdict(list)
                 obj_to_enqueue_dict = collections.defaultdict(lambda: [[], 0, 0])
                 obj_to_enqueue_to_head_dict = collections.defaultdict(lambda: [[], 0, 0])
                 remaining_obj_to_enqueue_dict = {}
@@ -174,12 +175,21 @@ class Monitor(AgentBase):
                         self.monitor_event_disposer(event_lifetime=eventBasedEventLifetime, max_events=eventBasedRemoveMaxEvents)
                         last_event_dispose_timestamp = time.time()
                 if to_run_fifo_check:
-                    # run with workers from FIFO
+                    # run with workers from FIFO shards claimed by this node
+                    fifo_shard_list = monitor_fifo.claim_shards(harvester_config.monitor.lockInterval)
+                    last_shard_claim_timestamp = time.time()
+                    if not fifo_shard_list:
+                        mainLog.debug("no FIFO shard claimed")
                     while time.time() < last_fifo_cycle_timestamp + fifoCheckDuration:
                         sw.reset()
                         n_loops += 1
+                        # renew claims before they expire, since fifoCheckDuration can be longer than lockInterval
+                        if time.time() > last_shard_claim_timestamp + harvester_config.monitor.lockInterval / 2:
+                            fifo_shard_list = monitor_fifo.claim_shards(harvester_config.monitor.lockInterval)
+                            last_shard_claim_timestamp = time.time()
+                        fifo_shard, retVal, overhead_time = None, False, None
                         try:
-                            retVal, overhead_time = monitor_fifo.to_check_workers()
+                            fifo_shard, retVal, overhead_time = monitor_fifo.to_check_workers_in_shards(fifo_shard_list)
                         except Exception as e:
                             mainLog.error(f"failed to check workers from FIFO: {e}")
                         if overhead_time is not None:
@@ -188,7 +198,7 @@ class Monitor(AgentBase):
                         if retVal:
                             # check fifo size
                             try:
-                                fifo_size = monitor_fifo.size()
+                                fifo_size = fifo_shard.size()
                                 mainLog.debug(f"FIFO size is {fifo_size}")
                             except Exception as e:
                                 mainLog.error(f"failed to get size of FIFO: {e}")
@@ -196,7 +206,7 @@ class Monitor(AgentBase):
                                 continue
                             mainLog.debug("starting run with FIFO")
                             try:
-                                obj_gotten = monitor_fifo.get(timeout=1, protective=fifoProtectiveDequeue)
+                                obj_gotten = fifo_shard.get(timeout=1, protective=fifoProtectiveDequeue)
                             except Exception as errStr:
                                 mainLog.error(f"failed to get object from FIFO: {errStr}")
                                 time.sleep(2)
@@ -205,7 +215,7 @@ class Monitor(AgentBase):
                                 if obj_gotten is not None:
                                     sw_fifo = core_utils.get_stopwatch()
                                     if fifoProtectiveDequeue:
-                                        obj_dequeued_id_list.append(obj_gotten.id)
+                                        obj_dequeued_id_dict[fifo_shard].append(obj_gotten.id)
                                     queueName, workSpecsList = obj_gotten.item
                                     mainLog.debug(f"got a chunk of {len(workSpecsList)} workers of {queueName} from FIFO" + sw.get_elapsed_time())
                                     sw.reset()
@@ -279,35 +289,40 @@ class Monitor(AgentBase):
                 sw.reset()
                 n_chunk_put = 0
                 mainLog.debug("putting worker chunks to FIFO")
+                obj_score_list = []
                 for _dct in (obj_to_enqueue_dict, remaining_obj_to_enqueue_dict):
                     for (queueName, configID), obj_to_enqueue in iteritems(_dct):
-                        try:
-                            workSpecsToEnqueue, timeNow_timestamp, fifoCheckInterval = obj_to_enqueue
-                            if workSpecsToEnqueue:
-                                score = fifoCheckInterval + timeNow_timestamp
-                                monitor_fifo.put((queueName, workSpecsToEnqueue), score)
-                                n_chunk_put += 1
-                                mainLog.info(f"put a chunk of {len(workSpecsToEnqueue)} workers of {queueName} to FIFO with score {score}")
-                        except Exception as errStr:
-                            mainLog.error(f"failed to put object from FIFO: {errStr}")
+                        workSpecsToEnqueue, timeNow_timestamp, fifoCheckInterval = obj_to_enqueue
+                        if workSpecsToEnqueue:
+                            score = fifoCheckInterval + timeNow_timestamp
+                            obj_score_list.append(((queueName, workSpecsToEnqueue), score))
+                            mainLog.info(f"put a chunk of {len(workSpecsToEnqueue)} workers of {queueName} to FIFO with score {score}")
+                try:
+                    if obj_score_list:
+                        n_chunk_put += monitor_fifo.putmany(obj_score_list)
+                except Exception as errStr:
+                    mainLog.error(f"failed to put objects to FIFO: {errStr}")
                 mainLog.debug("putting worker chunks to FIFO head")
+                obj_score_list = []
                 for _dct in (obj_to_enqueue_to_head_dict, remaining_obj_to_enqueue_to_head_dict):
                     for (queueName, configID), obj_to_enqueue_to_head in iteritems(_dct):
-                        try:
-                            workSpecsToEnqueueToHead, timeNow_timestamp, fifoCheckInterval = obj_to_enqueue_to_head
-                            if workSpecsToEnqueueToHead:
-                                score = fifoCheckInterval + timeNow_timestamp - 2**32
-                                monitor_fifo.put((queueName, workSpecsToEnqueueToHead), score)
-                                n_chunk_put += 1
-                                mainLog.info(f"put a chunk of {len(workSpecsToEnqueueToHead)} workers of {queueName} to FIFO with score {score}")
-                        except Exception as errStr:
-                            mainLog.error(f"failed to put object from FIFO head: {errStr}")
+                        workSpecsToEnqueueToHead, timeNow_timestamp, fifoCheckInterval = obj_to_enqueue_to_head
+                        if workSpecsToEnqueueToHead:
+                            score = fifoCheckInterval + timeNow_timestamp - 2**32
+                            obj_score_list.append(((queueName, workSpecsToEnqueueToHead), score))
+                            mainLog.info(f"put a chunk of {len(workSpecsToEnqueueToHead)} workers of {queueName} to FIFO head with score {score}")
+                try:
+                    if obj_score_list:
+                        n_chunk_put += monitor_fifo.putmany(obj_score_list)
+                except Exception as errStr:
+                    mainLog.error(f"failed to put objects to FIFO head: {errStr}")
                 # delete protective dequeued objects
-                if fifoProtectiveDequeue and len(obj_dequeued_id_list) > 0:
-                    try:
-                        monitor_fifo.delete(ids=obj_dequeued_id_list)
-                    except Exception as e:
-                        mainLog.error(f"failed to delete object from FIFO: {e}")
+                if fifoProtectiveDequeue:
+                    for fifo_shard, obj_dequeued_id_list in iteritems(obj_dequeued_id_dict):
+                        try:
+                            fifo_shard.delete(ids=obj_dequeued_id_list)
+                        except Exception as e:
+                            mainLog.error(f"failed to delete object from FIFO: {e}")
                 mainLog.debug(f"put {n_chunk_put} worker chunks into FIFO" + sw.get_elapsed_time())
                 # adjust adjusted_sleepTime
                 if n_chunk_peeked_stat > 0 and sum_overhead_time_stat > sleepTime:
@@ -9,10 +9,11 @@ try:
 except Exception:
     import subprocess
 
+from pandaharvester.harvesterbody import job_fetcher
 from pandaharvester.harvesterbody.agent_base import AgentBase
 from pandaharvester.harvesterbody.cred_manager import CredManager
 from pandaharvester.harvesterconfig import harvester_config
-from pandaharvester.harvestercore import core_utils
+from pandaharvester.harvestercore import core_utils, db_proxy_pool, fifos
 from pandaharvester.harvestercore.db_proxy_pool import DBProxyPool as DBProxy
 from pandaharvester.harvestercore.queue_config_mapper import QueueConfigMapper
 from pandaharvester.harvestercore.service_metrics_spec import ServiceMetricSpec
@@ -170,6 +171,18 @@ class ServiceMonitor(AgentBase):
 
             _logger.debug(f"Got cert validities: {service_metrics['cert_lifetime']}")
 
+            # get metrics of DB connection pool since the last cycle
+            service_metrics["db_pool"] = db_proxy_pool.metrics_registry.get_dict(reset=True)
+            _logger.debug(f"Got metrics of DB connection pool for {len(service_metrics['db_pool'])} methods")
+
+            # get metrics of FIFOs since the last cycle
+            service_metrics["fifo"] = fifos.fifo_metrics_registry.get_dict(reset=True)
+            _logger.debug(f"Got metrics of {len(service_metrics['fifo'])} FIFOs")
+
+            # get metrics of job fetch cycles since the last cycle
+            service_metrics["job_fetcher"] = job_fetcher.metrics_registry.get_dict(reset=True)
+            _logger.debug(f"Got metrics of job fetcher {service_metrics['job_fetcher']}")
+
             service_metrics_spec = ServiceMetricSpec(service_metrics)
             self.db_proxy.insert_service_metrics(service_metrics_spec)
 
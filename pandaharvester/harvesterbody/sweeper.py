@@ -1,4 +1,8 @@
+import datetime
+import gzip
+import json
 import os
+import time
 
 try:
     from os import walk
@@ -10,6 +14,7 @@ from pandaharvester.harvesterbody.agent_base import AgentBase
 from pandaharvester.harvesterconfig import harvester_config
 from pandaharvester.harvestercore import core_utils
 from pandaharvester.harvestercore.command_spec import CommandSpec
+from pandaharvester.harvestercore.db_proxy import jobTableName, workTableName
 from pandaharvester.harvestercore.db_proxy_pool import DBProxyPool as DBProxy
 from pandaharvester.harvestercore.plugin_factory import PluginFactory
 
@@ -54,6 +59,102 @@ class Sweeper(AgentBase):
             tmp_log.debug(f"will kill {n_to_kill} workers with {command_spec.params}")
         tmp_log.debug(f"done handling {command_string} commands took {stopwatch.get_elapsed_time()}s")
 
+    # clean up workers
+    def clean_up_workers(self, workers_for_cleanup, main_log):
+        sw = core_utils.get_stopwatch()
+        for queue_name, configIdWorkSpecList in iteritems(workers_for_cleanup):
+            for configID, workspec_list in iteritems(configIdWorkSpecList):
+                # get sweeper
+                if not self.queueConfigMapper.has_queue(queue_name, configID):
+                    main_log.error(f"queue config for {queue_name}/{configID} not found")
+                    continue
+                queue_config = self.queueConfigMapper.get_queue(queue_name, configID)
+                sweeper_core = self.pluginFactory.get_plugin(queue_config.sweeper)
+                messenger = self.pluginFactory.get_plugin(queue_config.messenger)
+                sw.reset()
+                n_workers = len(workspec_list)
+                # make sure workers to clean up are all terminated
+                main_log.debug("making sure workers to clean up are all terminated")
+                try:
+                    # try bulk method
+                    tmp_list = sweeper_core.kill_workers(workspec_list)
+                except AttributeError:
+                    # fall back to single-worker method
+                    for workspec in workspec_list:
+                        tmp_log = self.make_logger(_logger, f"workerID={workspec.workerID}", method_name="run")
+                        try:
+                            tmp_stat, tmp_out = sweeper_core.kill_worker(workspec)
+                        except Exception:
+                            core_utils.dump_error_message(tmp_log)
+                except Exception:
+                    core_utils.dump_error_message(main_log)
+                main_log.debug("made sure workers to clean up are all terminated")
+                # start cleanup
+                for workspec in workspec_list:
+                    tmp_log = self.make_logger(_logger, f"workerID={workspec.workerID}", method_name="run")
+                    try:
+                        tmp_log.debug("start cleaning up one worker")
+                        # sweep worker
+                        tmp_stat, tmp_out = sweeper_core.sweep_worker(workspec)
+                        tmp_log.debug(f"swept_worker with status={tmp_stat} diag={tmp_out}")
+                        tmp_log.debug("start messenger cleanup")
+                        mc_tmp_stat, mc_tmp_out = messenger.clean_up(workspec)
+                        tmp_log.debug(f"messenger cleaned up with status={mc_tmp_stat} diag={mc_tmp_out}")
+                        if tmp_stat:
+                            self.dbProxy.delete_worker(workspec.workerID)
+                    except Exception:
+                        core_utils.dump_error_message(tmp_log)
+                main_log.debug(f"done cleaning up {n_workers} workers" + sw.get_elapsed_time())
+
+    # write rows into a compressed file of JSON lines in the retention directory
+    def write_archive_file(self, table_name, spec_list):
+        time_stamp = datetime.datetime.utcnow().strftime("%Y%m%d_%H%M%S_%f")
+        file_name = os.path.join(harvester_config.sweeper.retentionDir, f"{table_name}_{time_stamp}_{self.get_pid()}.jsonl.gz")
+        with gzip.open(file_name + ".tmp", "wt") as f:
+            for spec in spec_list:
+                f.write(json.dumps({attr[1:]: val for attr, val in spec.values_map().items()}, default=str) + "\n")
+        os.rename(file_name + ".tmp", file_name)
+
+    # archive terminal rows of a table older than timeout in hours, and report reclaimed rows and table size
+    def archive_old_rows(self, table_name, timeout, main_log):
+        retention_mode = getattr(harvester_config.sweeper, "retentionMode", "delete")
+        chunk_size = getattr(harvester_config.sweeper, "retentionChunkSize", 1000)
+        stats_before = self.dbProxy.get_table_stats(table_name)
+        time_start = time.monotonic()
+        n_rows = 0
+        last_key = None
+        while True:
+            # get a chunk
+            tmp_ret = self.dbProxy.get_rows_to_archive(table_name, timeout, chunk_size, retention_mode == "file", last_key)
+            if tmp_ret is None:
+                main_log.error(f"failed to get rows of {table_name} to archive")
+                break
+            key_list, spec_list, last_key = tmp_ret
+            if len(key_list) > 0:
+                # write the chunk into a file before removal
+                if retention_mode == "file":
+                    try:
+                        self.write_archive_file(table_name, spec_list)
+                    except Exception:
+                        core_utils.dump_error_message(main_log)
+                        break
+                n_chunk = self.dbProxy.archive_rows(table_name, timeout, key_list, retention_mode)
+                if n_chunk is None:
+                    main_log.error(f"failed to archive rows of {table_name}")
+                    break
+                n_rows += n_chunk
+            if last_key is None:
+                break
+        duration = time.monotonic() - time_start
+        stats_after = self.dbProxy.get_table_stats(table_name)
+        msg = f"archived {n_rows} rows of {table_name} older than {timeout} hours to {retention_mode} in {duration:.1f} sec ({n_rows / max(duration, 1e-3):.1f} rows/s)"
+        if stats_before is not None and stats_after is not None:
+            msg += f"; {table_name} rows {stats_before['n_rows']} -> {stats_after['n_rows']}"
+            if stats_before["n_bytes"] is not None and stats_after["n_bytes"] is not None:
+                msg += f", size {stats_before['n_bytes'] / 2**20:.1f} -> {stats_after['n_bytes'] / 2**20:.1f} MiB"
+        main_log.debug(msg)
+        return n_rows
+
     # main loop
     def run(self):
         self.lockedBy = f"sweeper-{self.get_pid()}"
@@ -137,68 +238,58 @@ class Sweeper(AgentBase):
                 "missed": keep_missed,
                 "pending": keep_pending,
             }
-            workersForCleanup = self.dbProxy.get_workers_for_cleanup(harvester_config.sweeper.maxWorkers, statusTimeoutMap)
-            main_log.debug(f"got {len(workersForCleanup)} queues for workers cleanup")
-            sw = core_utils.get_stopwatch()
-            for queue_name, configIdWorkSpecList in iteritems(workersForCleanup):
-                for configID, workspec_list in iteritems(configIdWorkSpecList):
-                    # get sweeper
-                    if not self.queueConfigMapper.has_queue(queue_name, configID):
-                        main_log.error(f"queue config for {queue_name}/{configID} not found")
-                        continue
-                    queue_config = self.queueConfigMapper.get_queue(queue_name, configID)
-                    sweeper_core = self.pluginFactory.get_plugin(queue_config.sweeper)
-                    messenger = self.pluginFactory.get_plugin(queue_config.messenger)
-                    sw.reset()
-                    n_workers = len(workspec_list)
-                    # make sure workers to clean up are all terminated
-                    main_log.debug("making sure workers to clean up are all terminated")
-                    try:
-                        # try bulk method
-                        tmp_list = sweeper_core.kill_workers(workspec_list)
-                    except AttributeError:
-                        # fall back to single-worker method
-                        for workspec in workspec_list:
-                            tmp_log = self.make_logger(_logger, f"workerID={workspec.workerID}", method_name="run")
-                            try:
-                                tmp_stat, tmp_out = sweeper_core.kill_worker(workspec)
-                            except Exception:
-                                core_utils.dump_error_message(tmp_log)
-                    except Exception:
-                        core_utils.dump_error_message(main_log)
-                    main_log.debug("made sure workers to clean up are all terminated")
-                    # start cleanup
-                    for workspec in workspec_list:
-                        tmp_log = self.make_logger(_logger, f"workerID={workspec.workerID}", method_name="run")
-                        try:
-                            tmp_log.debug("start cleaning up one worker")
-                            # sweep worker
-                            tmp_stat, tmp_out = sweeper_core.sweep_worker(workspec)
-                            tmp_log.debug(f"swept_worker with status={tmp_stat} diag={tmp_out}")
-                            tmp_log.debug("start messenger cleanup")
-                            mc_tmp_stat, mc_tmp_out = messenger.clean_up(workspec)
-                            tmp_log.debug(f"messenger cleaned up with status={mc_tmp_stat} diag={mc_tmp_out}")
-                            if tmp_stat:
-                                self.dbProxy.delete_worker(workspec.workerID)
-                        except Exception:
-                            core_utils.dump_error_message(tmp_log)
-                    main_log.debug(f"done cleaning up {n_workers} workers" + sw.get_elapsed_time())
+            try:
+                cleanup_batch_size = harvester_config.sweeper.cleanupBatchSize
+            except Exception:
+                cleanup_batch_size = 100
+            # stream workers for cleanup and process them in batches
+            workers_for_cleanup = dict()
+            n_workers_in_batch = 0
+            n_workers_for_cleanup = 0
+            try:
+                for queue_name, configID, workspec in self.dbProxy.iterate_workers_for_cleanup(harvester_config.sweeper.maxWorkers, statusTimeoutMap):
+                    workers_for_cleanup.setdefault(queue_name, dict())
+                    workers_for_cleanup[queue_name].setdefault(configID, [])
+                    workers_for_cleanup[queue_name][configID].append(workspec)
+                    n_workers_in_batch += 1
+                    n_workers_for_cleanup += 1
+                    if n_workers_in_batch >= cleanup_batch_size:
+                        self.clean_up_workers(workers_for_cleanup, main_log)
+                        workers_for_cleanup = dict()
+                        n_workers_in_batch = 0
+                if n_workers_in_batch > 0:
+                    self.clean_up_workers(workers_for_cleanup, main_log)
+            except Exception:
+                core_utils.dump_error_message(main_log)
+            main_log.debug(f"got {n_workers_for_cleanup} workers for cleanup")
             main_log.debug("done all cleanup" + sw_cleanup.get_elapsed_time())
 
             # old-job-deletion stage
             sw_delete = core_utils.get_stopwatch()
-            main_log.debug("delete old jobs")
             jobTimeout = max(statusTimeoutMap.values()) + 1
-            self.dbProxy.delete_old_jobs(jobTimeout)
+            retention_mode = getattr(harvester_config.sweeper, "retentionMode", "delete")
+            if retention_mode == "delete":
+                main_log.debug("delete old jobs")
+                self.dbProxy.delete_old_jobs(jobTimeout)
             # delete orphaned job info
             self.dbProxy.delete_orphaned_job_info()
             main_log.debug("done deletion of old jobs" + sw_delete.get_elapsed_time())
+            # retention stage to archive old jobs and workers in bulk by one thread
+            retention_hours = getattr(harvester_config.sweeper, "retentionHours", None)
+            if retention_mode != "delete" or retention_hours is not None:
+                locked = self.dbProxy.get_process_lock("sweeper_retention", self.get_pid(), harvester_config.sweeper.sleepTime)
+                if locked:
+                    sw_retention = core_utils.get_stopwatch()
+                    if retention_mode != "delete":
+                        self.archive_old_rows(jobTableName, jobTimeout, main_log)
+                    if retention_hours is not None:
+                        self.archive_old_rows(workTableName, retention_hours, main_log)
+                    main_log.debug("done retention" + sw_retention.get_elapsed_time())
             # disk cleanup
             if hasattr(harvester_config.sweeper, "diskCleanUpInterval") and hasattr(harvester_config.sweeper, "diskHighWatermark"):
                 locked = self.dbProxy.get_process_lock("sweeper", self.get_pid(), harvester_config.sweeper.diskCleanUpInterval * 60 * 60)
                 if locked:
                     try:
-                        all_active_files = None
                         for item in harvester_config.sweeper.diskHighWatermark.split(","):
                             # dir name and watermark in GB
                             dir_name, watermark = item.split("|")
@@ -220,9 +311,16 @@ class Sweeper(AgentBase):
                                 main_log.debug(f"skip cleanup {dir_name} due to total_size {total_size // 10 ** 9} GB < watermark {watermark // 10 ** 9} GB")
                             else:
                                 main_log.debug(f"cleanup {dir_name} due to total_size {total_size // 10 ** 9} GB >= watermark {watermark // 10 ** 9} GB")
-                                # get active input files
-                                if all_active_files is None:
-                                    all_active_files = self.dbProxy.get_all_active_input_files()
+                                # get active input files in the dir by streaming all active input files
+                                base_names = set()
+                                for tmp_files in file_dict.values():
+                                    for base_name, full_name, f_size in tmp_files:
+                                        base_names.add(base_name)
+                                all_active_files = set()
+                                for lfn in self.dbProxy.iterate_all_active_input_files():
+                                    if lfn in base_names:
+                                        all_active_files.add(lfn)
+                                del base_names
                                 deleted_size = 0
                                 mtimes = sorted(file_dict.keys())
                                 for mtime in mtimes:
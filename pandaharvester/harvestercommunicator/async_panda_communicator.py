@@ -0,0 +1,153 @@
+"""
+Connection to the PanDA server with asyncio
+
+"""
+
+import asyncio
+import atexit
+import json
+import os
+import ssl
+import threading
+import time
+
+import aiohttp
+from pandaharvester.harvesterconfig import harvester_config
+
+from .panda_communicator import PandaCommunicator
+
+# event loop shared by communicators in the process, running in a dedicated thread
+_loop = None
+_loop_lock = threading.Lock()
+
+# sessions shared by communicators in the process with their creation time, only accessed in the event loop
+_sessions = dict()
+
+
+# get the event loop, starting its thread if needed
+def get_event_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="async_panda_communicator", daemon=True)
+            thread.start()
+            atexit.register(close_sessions)
+        return _loop
+
+
+# close sessions in the event loop at exit
+def close_sessions():
+    async def _close():
+        for session, _ in list(_sessions.values()):
+            await session.close()
+        _sessions.clear()
+
+    asyncio.run_coroutine_threadsafe(_close(), _loop).result(10)
+
+
+# response with the attributes of requests.Response used by PandaCommunicator
+class AsyncResponse(object):
+    # constructor
+    def __init__(self, status_code, headers, content, encoding):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding
+
+    # decoded body
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+    # body decoded from JSON
+    def json(self, **kwargs):
+        return json.loads(self.text, **kwargs)
+
+
+# connection class with asyncio, which can be shared among threads.
+# requests are sent from the event loop in the dedicated thread over a small connection pool, while callers use the same synchronous methods as PandaCommunicator
+class AsyncPandaCommunicator(PandaCommunicator):
+    # True since calls from threads are multiplexed in the event loop
+    thread_safe = True
+
+    # constructor
+    def __init__(self):
+        PandaCommunicator.__init__(self)
+        # max number of connections per endpoint
+        self.connectionPoolSize = getattr(harvester_config.pandacon, "asyncConnectionPoolSize", 10)
+        self.loop = get_event_loop()
+
+    # make SSL context for the cert and verification
+    def make_ssl_context(self, cert, verify):
+        if verify is False:
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        elif isinstance(verify, str) and os.path.isdir(verify):
+            context = ssl.create_default_context(capath=verify)
+        elif isinstance(verify, str):
+            context = ssl.create_default_context(cafile=verify)
+        else:
+            context = ssl.create_default_context()
+        if cert is not None:
+            if isinstance(cert, (tuple, list)):
+                context.load_cert_chain(*cert)
+            else:
+                context.load_cert_chain(cert)
+        return context
+
+    # get session for a cert and verification, which is reused until its lifetime
+    async def get_async_session(self, cert=None, verify=True):
+        timeNow = time.time()
+        session_key = (str(cert), str(verify), self.keepAlive, self.connectionPoolSize)
+        if session_key in _sessions:
+            session, creation_time = _sessions[session_key]
+            if timeNow < creation_time + self.sessionLifetime:
+                return session
+            del _sessions[session_key]
+            # close the old session after requests in flight are done or timed out
+            self.loop.call_later(harvester_config.pandacon.timeout, asyncio.ensure_future, session.close())
+        connector = aiohttp.TCPConnector(
+            ssl=self.make_ssl_context(cert, verify),
+            limit=0,
+            limit_per_host=self.connectionPoolSize,
+            force_close=not self.keepAlive,
+            ttl_dns_cache=self.sessionLifetime,
+        )
+        session = aiohttp.ClientSession(connector=connector)
+        _sessions[session_key] = (session, timeNow)
+        return session
+
+    # POST with session in the event loop, retrying once if a connection was not established.
+    # other connection errors are not retried since the request may have been processed by the server
+    async def async_post(self, url, cert=None, retry=True, data=None, files=None, headers=None, timeout=None, verify=True):
+        if files is not None:
+            # multipart like requests
+            data = aiohttp.FormData()
+            for field_name, (file_name, file_content) in files.items():
+                data.add_field(field_name, file_content, filename=file_name)
+        clientTimeout = aiohttp.ClientTimeout(total=timeout)
+        session = await self.get_async_session(cert, verify)
+        try:
+            async with session.post(url, data=data, headers=headers, timeout=clientTimeout) as res:
+                content = await res.read()
+                return AsyncResponse(res.status, res.headers, content, res.charset)
+        except aiohttp.ClientConnectorError:
+            if not self.keepAlive or not retry:
+                raise
+            async with session.post(url, data=data, headers=headers, timeout=clientTimeout) as res:
+                content = await res.read()
+                return AsyncResponse(res.status, res.headers, content, res.charset)
+
+    # get headers to connect the server
+    def get_headers(self, headers):
+        headers = PandaCommunicator.get_headers(self, headers)
+        # aiohttp advertises encodings which it can decode
+        del headers["Accept-Encoding"]
+        return headers
+
+    # POST from a thread, waiting for the response from the event loop. Concurrency is bounded by the connection pool
+    def session_post(self, url, cert=None, retry=True, **kwargs):
+        future = asyncio.run_coroutine_threadsafe(self.async_post(url, cert=cert, retry=retry, **kwargs), self.loop)
+        return future.result()
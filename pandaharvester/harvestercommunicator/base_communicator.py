@@ -14,6 +14,9 @@ _logger = core_utils.setup_logger("communicator")
 
 # base class for communication with WMS
 class BaseCommunicator(with_metaclass(abc.ABCMeta, object)):
+    # True if an instance can be shared among threads
+    thread_safe = False
+
     # constructor
     def __init__(self):
         pass
@@ -26,6 +29,10 @@ class BaseCommunicator(with_metaclass(abc.ABCMeta, object)):
     def get_jobs(self, site_name, node_name, prod_source_label, computing_element, n_jobs, additional_criteria):
         return [], ""
 
+    # get jobs for multiple queues with a list of arguments of get_jobs. Return a list of (jobs, errStr) in the same order
+    def get_jobs_for_queues(self, args_list):
+        return [self.get_jobs(*args) for args in args_list]
+
     # update jobs
     def update_jobs(self, jobspec_list, id):
         return [{"StatusCode": 0, "ErrorDiag": "", "command": ""}] * len(jobspec_list)
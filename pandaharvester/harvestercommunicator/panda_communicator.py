@@ -10,23 +10,33 @@ try:
 except Exception:
     pass
 import datetime
+import gzip
 import inspect
 import json
 import os
 import pickle
 import sys
+import threading
+import time
 import traceback
 import uuid
 import zlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlparse
 
 # TO BE REMOVED for python2.7
 import requests.packages.urllib3
 from future.utils import iteritems
+from requests.utils import DEFAULT_ACCEPT_ENCODING
 
 try:
     requests.packages.urllib3.disable_warnings()
 except Exception:
     pass
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 from pandacommon.pandautils.net_utils import get_http_adapter_with_random_dns_resolution
 from pandaharvester.harvesterconfig import harvester_config
 from pandaharvester.harvestercore import core_utils
@@ -34,6 +44,37 @@ from pandaharvester.harvestermisc import idds_utils
 
 from .base_communicator import BaseCommunicator
 
+# prefix of names of threads in the executor for concurrent requests
+executor_thread_prefix = "panda_communicator"
+
+
+# check if a request failed since a new connection was not established, so that the request was not sent and can be resent safely
+def is_connection_not_established(exc):
+    reason = getattr(exc.args[0], "reason", None) if exc.args else None
+    return isinstance(reason, requests.packages.urllib3.exceptions.ConnectTimeoutError)
+
+
+# get list of form fields with values encoded like requests, where None values are dropped
+def form_field_list(data):
+    fieldList = []
+    for key, values in iteritems(data):
+        if isinstance(values, (str, bytes)) or not hasattr(values, "__iter__"):
+            values = [values]
+        for value in values:
+            if value is None:
+                continue
+            if not isinstance(value, bytes):
+                value = str(value).encode()
+            fieldList.append((key.encode() if isinstance(key, str) else key, value))
+    return fieldList
+
+
+# check if the server rejected the content encoding of a request
+def is_encoding_rejected(res):
+    if res.status_code == 415:
+        return True
+    return res.status_code == 400 and "encoding" in res.text.lower()
+
 
 # connection class
 class PandaCommunicator(BaseCommunicator):
@@ -53,6 +94,141 @@ class PandaCommunicator(BaseCommunicator):
             self.auth_type = "x509"
         self.auth_token = None
         self.auth_token_last_update = None
+        # keep connections alive with sessions reused across calls
+        self.keepAlive = getattr(harvester_config.pandacon, "keepAlive", True)
+        # lifetime of sessions in sec, to re-resolve DNS randomly for load balancing
+        self.sessionLifetime = getattr(harvester_config.pandacon, "sessionLifetime", 300)
+        # sessions keyed by cert with their creation time
+        self.sessions = dict()
+        # sessions of threads in the executor, which are not shared with the caller since sessions are not thread-safe
+        self.executorSessions = threading.local()
+        # max number of concurrent requests per endpoint like "https://pandaserver.cern.ch:25443" and "default" for others. 1 to be sequential
+        self.maxConcurrentRequests = getattr(harvester_config.pandacon, "maxConcurrentRequests", 1)
+        if not isinstance(self.maxConcurrentRequests, dict):
+            self.maxConcurrentRequests = {"default": self.maxConcurrentRequests}
+        self.endpointSemaphores = dict()
+        self.endpointSemaphoresLock = threading.Lock()
+        self.executor = None
+        # compression of request bodies with "gzip" or "zstd" if they are larger than the threshold in bytes. None to disable
+        self.requestCompression = getattr(harvester_config.pandacon, "requestCompression", None)
+        if self.requestCompression == "zstd" and zstandard is None:
+            self.requestCompression = "gzip"
+        self.compressionThreshold = getattr(harvester_config.pandacon, "compressionThreshold", 65536)
+        # endpoints which did not accept compressed request bodies with the time of failure
+        self.noCompressionEndpoints = dict()
+
+    # get max number of concurrent requests to an endpoint
+    def get_max_concurrency(self, endpoint):
+        return max(int(self.maxConcurrentRequests.get(endpoint, self.maxConcurrentRequests.get("default", 1))), 1)
+
+    # get endpoint of url
+    def get_endpoint(self, url):
+        parsed = urlparse(url)
+        return f"{parsed.scheme}://{parsed.netloc}"
+
+    # get semaphore to bound concurrent requests to the endpoint of url
+    def get_endpoint_semaphore(self, url):
+        endpoint = self.get_endpoint(url)
+        with self.endpointSemaphoresLock:
+            if endpoint not in self.endpointSemaphores:
+                self.endpointSemaphores[endpoint] = threading.BoundedSemaphore(self.get_max_concurrency(endpoint))
+            return self.endpointSemaphores[endpoint]
+
+    # apply function to items with a thread pool if concurrent requests are allowed, keeping the order of results
+    def concurrent_map(self, func, items):
+        items = list(items)
+        max_workers = max(self.get_max_concurrency(endpoint) for endpoint in self.maxConcurrentRequests)
+        if max_workers <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        with self.endpointSemaphoresLock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix=executor_thread_prefix)
+        return list(self.executor.map(func, items))
+
+    # get session for a cert, which is reused until its lifetime if keepAlive
+    def get_session(self, cert=None, renew=False):
+        if not self.keepAlive:
+            return get_http_adapter_with_random_dns_resolution()
+        timeNow = time.time()
+        # threads in the executor use their own sessions, which are discarded together with the threads
+        sessions = self.sessions
+        if threading.current_thread().name.startswith(executor_thread_prefix):
+            if not hasattr(self.executorSessions, "sessions"):
+                self.executorSessions.sessions = dict()
+            sessions = self.executorSessions.sessions
+        session_key = str(cert)
+        if session_key in sessions:
+            session, creation_time = sessions[session_key]
+            if not renew and timeNow < creation_time + self.sessionLifetime:
+                return session
+            del sessions[session_key]
+            session.close()
+        session = get_http_adapter_with_random_dns_resolution()
+        sessions[session_key] = (session, timeNow)
+        return session
+
+    # get headers to connect the server
+    def get_headers(self, headers):
+        if not self.keepAlive:
+            headers["Connection"] = "close"
+        # compressed responses with encodings which can be decoded
+        headers["Accept-Encoding"] = DEFAULT_ACCEPT_ENCODING
+        return headers
+
+    # encode and compress form data if compression is enabled for the endpoint and the data is larger than the threshold.
+    # the size is estimated from raw values so that only bodies to be compressed are encoded here.
+    # return data as it is and None as encoding if not compressed
+    def compress_data(self, url, data):
+        if self.requestCompression is None:
+            return data, None
+        # retry compression after a while since the server may be upgraded
+        endpoint = self.get_endpoint(url)
+        if endpoint in self.noCompressionEndpoints:
+            if time.time() < self.noCompressionEndpoints[endpoint] + 3600:
+                return data, None
+            del self.noCompressionEndpoints[endpoint]
+        fieldList = form_field_list(data)
+        if sum(len(key) + len(value) for key, value in fieldList) < self.compressionThreshold:
+            return data, None
+        body = urlencode(fieldList).encode()
+        if self.requestCompression == "zstd":
+            return zstandard.ZstdCompressor().compress(body), "zstd"
+        return gzip.compress(body, compresslevel=6), "gzip"
+
+    # POST form data with session, compressing the body if possible.
+    # the body is sent again without compression only if the server rejected the encoding, since other errors
+    # may come after the request was processed
+    def post_data(self, url, data, headers, **kwargs):
+        body, contentEncoding = self.compress_data(url, data)
+        if contentEncoding is None:
+            return self.session_post(url, data=data, headers=headers, **kwargs)
+        compressedHeaders = dict(headers)
+        compressedHeaders["Content-Encoding"] = contentEncoding
+        compressedHeaders["Content-Type"] = "application/x-www-form-urlencoded"
+        res = self.session_post(url, data=body, headers=compressedHeaders, **kwargs)
+        if not is_encoding_rejected(res):
+            return res
+        res = self.session_post(url, data=data, headers=headers, **kwargs)
+        # disable compression for the endpoint only when the failure was due to compression
+        if res.status_code == 200:
+            tmpLog = self.make_logger(method_name="post_data")
+            tmpLog.warning(f"disabled {contentEncoding} compression of request bodies for {self.get_endpoint(url)} since it was not accepted")
+            self.noCompressionEndpoints[self.get_endpoint(url)] = time.time()
+        return res
+
+    # POST with session, retrying once with a new session if a connection was not established.
+    # other connection errors are not retried since the request may have been processed by the server.
+    # idle connections closed by the server are replaced by the connection pool before they are used
+    def session_post(self, url, cert=None, retry=True, **kwargs):
+        with self.get_endpoint_semaphore(url):
+            session = self.get_session(cert)
+            try:
+                return session.post(url, cert=cert, **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                if not self.keepAlive or not retry or not is_connection_not_established(e):
+                    raise
+                session = self.get_session(cert, renew=True)
+                return session.post(url, cert=cert, **kwargs)
 
     # renew token
     def renew_token(self):
@@ -81,8 +257,7 @@ class PandaCommunicator(BaseCommunicator):
             url = f"{harvester_config.pandacon.pandaURL}/{path}"
             if self.verbose:
                 tmpLog.debug(f"exec={tmpExec} URL={url} data={str(data)}")
-            session = get_http_adapter_with_random_dns_resolution()
-            res = session.post(url, data=data, headers={"Accept": "application/json", "Connection": "close"}, timeout=harvester_config.pandacon.timeout)
+            res = self.post_data(url, data, self.get_headers({"Accept": "application/json"}), timeout=harvester_config.pandacon.timeout)
             if self.verbose:
                 tmpLog.debug(f"exec={tmpExec} code={res.status_code} return={res.text}")
             if res.status_code == 200:
@@ -110,7 +285,7 @@ class PandaCommunicator(BaseCommunicator):
             url = f"{base_url}/{path}"
             if self.verbose:
                 tmpLog.debug(f"exec={tmpExec} URL={url} data={str(data)}")
-            headers = {"Accept": "application/json", "Connection": "close"}
+            headers = self.get_headers({"Accept": "application/json"})
             if self.auth_type == "oidc":
                 self.renew_token()
                 cert = None
@@ -119,9 +294,8 @@ class PandaCommunicator(BaseCommunicator):
             else:
                 if cert is None:
                     cert = (harvester_config.pandacon.cert_file, harvester_config.pandacon.key_file)
-            session = get_http_adapter_with_random_dns_resolution()
             sw = core_utils.get_stopwatch()
-            res = session.post(url, data=data, headers=headers, timeout=harvester_config.pandacon.timeout, verify=harvester_config.pandacon.ca_cert, cert=cert)
+            res = self.post_data(url, data, headers, timeout=harvester_config.pandacon.timeout, verify=harvester_config.pandacon.ca_cert, cert=cert)
             if self.verbose:
                 tmpLog.debug(f"exec={tmpExec} code={res.status_code} {sw.get_elapsed_time()}. return={res.text}")
             if res.status_code == 200:
@@ -150,19 +324,18 @@ class PandaCommunicator(BaseCommunicator):
             url = f"{base_url}/{path}"
             if self.verbose:
                 tmpLog.debug(f"exec={tmpExec} URL={url} files={files['file'][0]}")
+            headers = self.get_headers(dict())
             if self.auth_type == "oidc":
                 self.renew_token()
                 cert = None
-                headers = dict()
                 headers["Authorization"] = f"Bearer {self.auth_token}"
                 headers["Origin"] = harvester_config.pandacon.auth_origin
             else:
-                headers = None
                 if cert is None:
                     cert = (harvester_config.pandacon.cert_file, harvester_config.pandacon.key_file)
-            session = get_http_adapter_with_random_dns_resolution()
-            res = session.post(
-                url, files=files, headers=headers, timeout=harvester_config.pandacon.timeout, verify=harvester_config.pandacon.ca_cert, cert=cert
+            # no retry since file objects may be partially read
+            res = self.session_post(
+                url, files=files, headers=headers, timeout=harvester_config.pandacon.timeout, verify=harvester_config.pandacon.ca_cert, cert=cert, retry=False
             )
             if self.verbose:
                 tmpLog.debug(f"exec={tmpExec} code={res.status_code} return={res.text}")
@@ -222,14 +395,23 @@ class PandaCommunicator(BaseCommunicator):
                 errStr = core_utils.dump_error_message(tmpLog, tmpRes)
         return [], errStr
 
+    # get jobs for multiple queues with a list of arguments of get_jobs. Return a list of (jobs, errStr) in the same order.
+    # getJob requests are sent concurrently since the server takes one queue per request
+    def get_jobs_for_queues(self, args_list):
+        tmpLog = self.make_logger(method_name="get_jobs_for_queues")
+        sw = core_utils.get_stopwatch()
+        retList = self.concurrent_map(lambda args: self.get_jobs(*args), args_list)
+        tmpLog.debug(f"getJob for {len(args_list)} queues {sw.get_elapsed_time()}")
+        return retList
+
     # update jobs
     def update_jobs(self, jobspec_list, id):
         sw = core_utils.get_stopwatch()
         tmpLogG = self.make_logger(f"id={id}", method_name="update_jobs")
         tmpLogG.debug(f"update {len(jobspec_list)} jobs")
-        retList = []
+
         # upload checkpoints
-        for jobSpec in jobspec_list:
+        def _upload_checkpoints(jobSpec):
             if jobSpec.outFiles:
                 tmpLogG.debug(f"upload {len(jobSpec.outFiles)} checkpoint files for PandaID={jobSpec.PandaID}")
             for fileSpec in jobSpec.outFiles:
@@ -237,8 +419,11 @@ class PandaCommunicator(BaseCommunicator):
                     tmpS = self.upload_checkpoint(jobSpec.jobParams["sourceURL"], jobSpec.taskID, jobSpec.PandaID, fileSpec.lfn, fileSpec.path)
                     if tmpS:
                         fileSpec.status = "done"
+
+        self.concurrent_map(_upload_checkpoints, [jobSpec for jobSpec in jobspec_list if jobSpec.outFiles])
+
         # update events
-        for jobSpec in jobspec_list:
+        def _update_events(jobSpec):
             eventRanges, eventSpecs = jobSpec.to_event_data(max_events=10000)
             if eventRanges != []:
                 tmpLogG.debug(f"update {len(eventSpecs)} events for PandaID={jobSpec.PandaID}")
@@ -247,12 +432,13 @@ class PandaCommunicator(BaseCommunicator):
                     for eventSpec, retVal in zip(eventSpecs, tmpRet["Returns"]):
                         if retVal in [True, False] and eventSpec.is_final_status():
                             eventSpec.subStatus = "done"
+
+        self.concurrent_map(_update_events, jobspec_list)
+
         # update jobs in bulk
-        nLookup = 100
-        iLookup = 0
-        while iLookup < len(jobspec_list):
+        def _update_jobs_in_bulk(jobSpecSubList):
+            subRetList = []
             dataList = []
-            jobSpecSubList = jobspec_list[iLookup : iLookup + nLookup]
             for jobSpec in jobSpecSubList:
                 data = jobSpec.get_job_attributes_for_panda()
                 data["jobId"] = jobSpec.PandaID
@@ -311,8 +497,15 @@ class PandaCommunicator(BaseCommunicator):
                     retMap["ErrorDiag"] = errStr
                 tmpLog.debug(f"data={str(data)}")
                 tmpLog.debug(f"done with {str(retMap)}")
-                retList.append(retMap)
-            iLookup += nLookup
+                subRetList.append(retMap)
+            return subRetList
+
+        nLookup = 100
+        retList = []
+        for subRetList in self.concurrent_map(
+            _update_jobs_in_bulk, [jobspec_list[iLookup : iLookup + nLookup] for iLookup in range(0, len(jobspec_list), nLookup)]
+        ):
+            retList += subRetList
         tmpLogG.debug("done" + sw.get_elapsed_time())
         return retList
 
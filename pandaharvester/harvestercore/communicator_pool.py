@@ -45,16 +45,27 @@ class CommunicatorPool(object):
             nConnections = harvester_config.communicator.nConnections
         except Exception:
             nConnections = harvester_config.pandacon.nConnections
-        self.pool = queue.Queue(nConnections)
         try:
-            Communicator = importlib.import_module(harvester_config.communicator.className, harvester_config.communicator.moduleName)
+            Communicator = getattr(importlib.import_module(harvester_config.communicator.moduleName), harvester_config.communicator.className)
         except Exception:
             from pandaharvester.harvestercommunicator.panda_communicator import (
                 PandaCommunicator as Communicator,
             )
-        for i in range(nConnections):
+        if getattr(Communicator, "thread_safe", False):
+            # one instance shared by all slots, which bounds the number of in-flight requests
+            try:
+                nSlots = harvester_config.communicator.nInFlightRequests
+            except Exception:
+                nSlots = 200
+            self.pool = queue.Queue(nSlots)
             con = Communicator()
-            self.pool.put(con)
+            for i in range(nSlots):
+                self.pool.put(con)
+        else:
+            self.pool = queue.Queue(nConnections)
+            for i in range(nConnections):
+                con = Communicator()
+                self.pool.put(con)
 
     # override __getattribute__
     def __getattribute__(self, name):
@@ -4,6 +4,7 @@ utilities
 """
 
 import base64
+import bisect
 import codecs
 import datetime
 import fcntl
@@ -672,3 +673,164 @@ def retry_period_sec(nth_retry, increment=1, max_retries=None, max_seconds=None,
 class SafeDict(dict):
     def __missing__(self, key):
         return "{" + key + "}"
+
+
+# default upper bounds in sec of latency histograms
+latency_buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+
+# histogram with fixed buckets
+class Histogram(object):
+    # constructor
+    def __init__(self, buckets=latency_buckets):
+        self.buckets = list(buckets)
+        # the last bucket is for values larger than all upper bounds
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.max = 0.0
+
+    # add a value
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    # number of values
+    def count(self):
+        return sum(self.counts)
+
+    # merge another histogram with the same buckets
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    # upper bound of the bucket where the percentile falls
+    def percentile(self, pc):
+        n_total = self.count()
+        if n_total == 0:
+            return None
+        threshold = n_total * pc / 100.0
+        n_sum = 0
+        for i, n in enumerate(self.counts):
+            n_sum += n
+            if n_sum >= threshold:
+                if i < len(self.buckets):
+                    return min(self.buckets[i], self.max)
+                break
+        return self.max
+
+    # convert to dict
+    def to_dict(self):
+        return {"buckets": list(self.buckets), "counts": list(self.counts), "sum": round(self.sum, 6), "max": round(self.max, 6)}
+
+    # make histogram from dict
+    @classmethod
+    def from_dict(cls, data):
+        obj = cls(data["buckets"])
+        obj.counts = list(data["counts"])
+        obj.sum = data["sum"]
+        obj.max = data["max"]
+        return obj
+
+
+# registry of counters, histograms, and gauges in the process, keyed by name such as method name
+class MetricsRegistry(object):
+    # constructor
+    def __init__(self, buckets=latency_buckets):
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        self.counters = dict()
+        self.histograms = dict()
+        self.gauges = dict()
+
+    # increment a counter
+    def increment(self, name, metric, value=1):
+        with self.lock:
+            self.counters.setdefault(name, dict())
+            self.counters[name].setdefault(metric, 0)
+            self.counters[name][metric] += value
+
+    # add a value to a histogram
+    def observe(self, name, metric, value):
+        with self.lock:
+            self.histograms.setdefault(name, dict())
+            if metric not in self.histograms[name]:
+                self.histograms[name][metric] = Histogram(self.buckets)
+            self.histograms[name][metric].observe(value)
+
+    # set the last value of a gauge
+    def set_gauge(self, name, metric, value):
+        with self.lock:
+            self.gauges.setdefault(name, dict())
+            self.gauges[name][metric] = value
+
+    # get all metrics in dict, optionally resetting counters and histograms. Gauges keep the last values
+    def get_dict(self, reset=False):
+        with self.lock:
+            ret = dict()
+            for name, metrics in self.gauges.items():
+                ret.setdefault(name, dict())
+                ret[name].update(metrics)
+            for name, metrics in self.counters.items():
+                ret.setdefault(name, dict())
+                ret[name].update(metrics)
+            for name, metrics in self.histograms.items():
+                ret.setdefault(name, dict())
+                for metric, histogram in metrics.items():
+                    ret[name][metric] = histogram.to_dict()
+            if reset:
+                self.counters = dict()
+                self.histograms = dict()
+        return ret
+
+
+# condition to wake up getters of a fifo when objects are put in the same process
+class FifoNotifier(object):
+    # constructor
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.version = 0
+
+    # wake up getters
+    def notify(self):
+        with self.condition:
+            self.version += 1
+            self.condition.notify_all()
+
+    # wait until notified after the version is taken or timeout, and return the current version
+    def wait(self, version, timeout):
+        with self.condition:
+            if self.version == version:
+                self.condition.wait(timeout)
+            return self.version
+
+
+# notifiers keyed by fifo
+fifo_notifiers = dict()
+fifo_notifiers_lock = threading.Lock()
+
+
+# get notifier of a fifo
+def get_fifo_notifier(key):
+    with fifo_notifiers_lock:
+        if key not in fifo_notifiers:
+            fifo_notifiers[key] = FifoNotifier()
+        return fifo_notifiers[key]
+
+
+# time in sec which the last dequeue of fifo in each thread waited before the object was found
+fifo_get_wait = threading.local()
+
+
+# set the wait time of the last dequeue in the thread, to be called by fifo plugins
+def set_fifo_get_wait_time(wait_time):
+    fifo_get_wait.time = wait_time
+
+
+# get and reset the wait time of the last dequeue in the thread. None if not set by the fifo plugin
+def pop_fifo_get_wait_time():
+    wait_time = getattr(fifo_get_wait, "time", None)
+    fifo_get_wait.time = None
+    return wait_time
@@ -49,21 +49,91 @@ diagTableName = "diag_table"
 queueConfigDumpTableName = "qcdump_table"
 serviceMetricsTableName = "sm_table"
 
+# spec classes and tables
+specTableList = [
+    (CommandSpec, commandTableName),
+    (JobSpec, jobTableName),
+    (WorkSpec, workTableName),
+    (FileSpec, fileTableName),
+    (EventSpec, eventTableName),
+    (CacheSpec, cacheTableName),
+    (SeqNumberSpec, seqNumberTableName),
+    (PandaQueueSpec, pandaQueueTableName),
+    (JobWorkerRelationSpec, jobWorkerTableName),
+    (ProcessLockSpec, processLockTableName),
+    (DiagSpec, diagTableName),
+    (QueueConfigDumpSpec, queueConfigDumpTableName),
+    (ServiceMetricSpec, serviceMetricsTableName),
+]
+
+# archive tables for retention
+workArchiveTableName = "work_archive_table"
+jobArchiveTableName = "job_archive_table"
+
+# name of the seq number for the schema version
+schemaVersionName = "SCHEMA_version"
+
 # connection lock
 conLock = threading.Lock()
 
+# cache of SQL templates converted for the DB engine, keyed by original SQL
+sqlTemplateCache = dict()
+sqlTemplateCacheSize = 10000
+
+
+# decorator for read-only methods which can be routed to a replica. methods with writes or locks must not use this
+def replica_read(func):
+    func.replicaRead = True
+    return func
+
+
+# decorator for generators which read items in pages with the method page_method_name, so that DBProxyPool reads each page with a pooled connection
+def paged(page_method_name):
+    def _decorator(func):
+        func.pageMethod = page_method_name
+        return func
+
+    return _decorator
+
+
+# generator of items from get_page which returns a list of items and the key of the next page or None after the last page
+def iterate_pages(get_page, *args, **kwargs):
+    lastKey = None
+    while True:
+        items, lastKey = get_page(*args, last_key=lastKey, **kwargs)
+        yield from items
+        if lastKey is None:
+            break
+
 
 # connection class
 class DBProxy(object):
     # constructor
-    def __init__(self, thr_name=None, read_only=False):
+    def __init__(self, thr_name=None, read_only=False, replica=False):
         self.thrName = thr_name
         self.verbLog = None
         self.useInspect = False
         self.reconnectTimeout = 300
         self.read_only = read_only
+        # connect to the read-only replica of MariaDB
+        self.replica = replica
         if hasattr(harvester_config.db, "reconnectTimeout"):
             self.reconnectTimeout = harvester_config.db.reconnectTimeout
+        # no reconnection to the replica since callers fall back to the primary and the replica pool reopens the connection later
+        if self.replica:
+            self.reconnectTimeout = 0
+        # number of DB errors to let callers know failures which are caught in methods
+        self.nErrors = 0
+        # concurrent reads with sqlite; only writers are serialized
+        self.concurrentRead = False
+        if harvester_config.db.engine == "sqlite" and getattr(harvester_config.db, "sqliteConcurrentRead", False) is True:
+            self.concurrentRead = True
+        # busy timeout in sec for sqlite
+        self.busyTimeout = getattr(harvester_config.db, "sqliteBusyTimeout", 5)
+        # number of rows per page when large tables are scanned
+        self.scanBatchSize = getattr(harvester_config.db, "scanBatchSize", 1000)
+        # statements captured for the index advisor
+        self.capturedStatements = None
         if harvester_config.db.verbose:
             self.verbLog = core_utils.make_logger(_logger, method_name="execute")
             if self.thrName is None:
@@ -92,6 +162,13 @@ class DBProxy(object):
                 port = harvester_config.db.port
             else:
                 port = 3306
+            user = harvester_config.db.user
+            password = harvester_config.db.password
+            if self.replica:
+                host = harvester_config.db.replicaHost
+                port = getattr(harvester_config.db, "replicaPort", port)
+                user = getattr(harvester_config.db, "replicaUser", user)
+                password = getattr(harvester_config.db, "replicaPassword", password)
             if hasattr(harvester_config.db, "useMySQLdb") and harvester_config.db.useMySQLdb is True:
                 import MySQLdb
                 import MySQLdb.cursors
@@ -118,8 +195,8 @@ class DBProxy(object):
                         return newTmpRets
 
                 self.con = MySQLdb.connect(
-                    user=harvester_config.db.user,
-                    passwd=harvester_config.db.password,
+                    user=user,
+                    passwd=password,
                     db=harvester_config.db.schema,
                     host=host,
                     port=port,
@@ -130,9 +207,7 @@ class DBProxy(object):
             else:
                 import mysql.connector
 
-                self.con = mysql.connector.connect(
-                    user=harvester_config.db.user, passwd=harvester_config.db.password, db=harvester_config.db.schema, host=host, port=port
-                )
+                self.con = mysql.connector.connect(user=user, passwd=password, db=harvester_config.db.schema, host=host, port=port)
                 self.cur = self.con.cursor(named_tuple=True, buffered=True)
         else:
             import sqlite3
@@ -142,7 +217,12 @@ class DBProxy(object):
                 database_filename = f"/dev/fd/{fd}"
             else:
                 database_filename = harvester_config.db.database_filename
-            self.con = sqlite3.connect(database_filename, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES, check_same_thread=False)
+            self.con = sqlite3.connect(
+                database_filename,
+                detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+                check_same_thread=False,
+                timeout=self.busyTimeout,
+            )
             core_utils.set_file_permission(harvester_config.db.database_filename)
             # change the row factory to use Row
             self.con.row_factory = sqlite3.Row
@@ -157,6 +237,7 @@ class DBProxy(object):
     # exception handler for type of DBs
     def _handle_exception(self, exc):
         tmpLog = core_utils.make_logger(_logger, f"thr={self.thrName}", method_name="_handle_exception")
+        self.nErrors += 1
         if harvester_config.db.engine == "mariadb":
             tmpLog.warning(f"exception of mysql {exc.__class__.__name__} occurred")
             # Case to try renew connection
@@ -199,48 +280,83 @@ class DBProxy(object):
                             time.sleep(sleep_time)
                             n_retry += 1
 
-    # convert param dict to list
-    def convert_params(self, sql, varmap):
-        # lock database if application side lock is used
-        if self.usingAppLock and (
+    # lock database for write with sqlite concurrent reads
+    def _lock_for_write(self):
+        if harvester_config.db.verbose:
+            self.verbLog.debug(f"thr={self.thrName} locking for write")
+        conLock.acquire()
+        try:
+            # take the write lock at the beginning of the transaction so that concurrent writers wait in the busy handler
+            if not self.con.in_transaction:
+                self.cur.execute("BEGIN IMMEDIATE")
+        except Exception:
+            conLock.release()
+            raise
+        if harvester_config.db.verbose:
+            self.verbLog.debug(f"thr={self.thrName} locked for write")
+
+    # make template of SQL statement for the DB engine
+    def _make_sql_template(self, sql):
+        # check if the statement writes
+        isWrite = (
             re.search("^INSERT", sql, re.I) is not None
             or re.search("^UPDATE", sql, re.I) is not None
             or re.search(" FOR UPDATE", sql, re.I) is not None
             or re.search("^DELETE", sql, re.I) is not None
-        ):
-            self.lockDB = True
+        )
         # remove FOR UPDATE for sqlite
         if harvester_config.db.engine == "sqlite":
             sql = re.sub(" FOR UPDATE", " ", sql, re.I)
             sql = re.sub("INSERT IGNORE", "INSERT OR IGNORE", sql, re.I)
         else:
             sql = re.sub("INSERT OR IGNORE", "INSERT IGNORE", sql, re.I)
-        # no conversation unless dict
-        if not isinstance(varmap, dict):
-            # using the printf style syntax for mariaDB
-            if harvester_config.db.engine == "mariadb":
-                sql = re.sub(":[^ $,)]+", "%s", sql)
-            return sql, varmap
-        paramList = []
         # extract placeholders
-        items = re.findall(":[^ $,)]+", sql)
-        for item in items:
-            if item not in varmap:
-                raise KeyError(f"{item} is missing in SQL parameters")
-            if item not in paramList:
-                paramList.append(varmap[item])
+        bindNames = tuple(re.findall(":[^ $,)]+", sql))
         # using the printf style syntax for mariaDB
         if harvester_config.db.engine == "mariadb":
             sql = re.sub(":[^ $,)]+", "%s", sql)
-        return sql, paramList
+        return sql, bindNames, isWrite
+
+    # convert param dict to list
+    def convert_params(self, sql, varmap):
+        # get template from cache
+        try:
+            newSQL, bindNames, isWrite = sqlTemplateCache[sql]
+        except KeyError:
+            newSQL, bindNames, isWrite = self._make_sql_template(sql)
+            # flush cache when too many statements with variable IN clauses are accumulated
+            if len(sqlTemplateCache) >= sqlTemplateCacheSize:
+                sqlTemplateCache.clear()
+            sqlTemplateCache[sql] = (newSQL, bindNames, isWrite)
+        # writes must go to the primary
+        if self.replica and isWrite:
+            raise RuntimeError(f"write statement on replica : {sql}")
+        # lock database if application side lock is used
+        if self.usingAppLock and isWrite:
+            # readers don't take the lock with concurrent reads, so it is taken only by the first write in the transaction
+            if self.concurrentRead and not self.lockDB:
+                self._lock_for_write()
+            self.lockDB = True
+        # no conversation unless dict
+        if not isinstance(varmap, dict):
+            return newSQL, varmap
+        # make param list
+        try:
+            paramList = [varmap[item] for item in bindNames]
+        except KeyError as e:
+            raise KeyError(f"{e.args[0]} is missing in SQL parameters")
+        return newSQL, paramList
 
     # wrapper for execute
     def execute(self, sql, varmap=None):
         sw = core_utils.get_stopwatch()
         if varmap is None:
             varmap = dict()
+        # capture statement
+        if self.capturedStatements is not None:
+            self.capturedStatements.append((sql, copy.copy(varmap)))
         # get lock if application side lock is used
-        if self.usingAppLock and not self.lockDB:
+        if self.usingAppLock and not self.lockDB and not self.concurrentRead:
             if harvester_config.db.verbose:
                 self.verbLog.debug(f"thr={self.thrName} locking")
             conLock.acquire()
@@ -266,7 +382,7 @@ class DBProxy(object):
                 raise
         finally:
             # release lock
-            if self.usingAppLock and not self.lockDB:
+            if self.usingAppLock and not self.lockDB and not self.concurrentRead:
                 if harvester_config.db.verbose:
                     self.verbLog.debug(f"thr={self.thrName} release")
                 conLock.release()
@@ -275,10 +391,13 @@ class DBProxy(object):
             self.verbLog.debug("thr={0}  {1}  sql=[{2}]".format(self.thrName, sw.get_elapsed_time(), newSQL.replace("\n", " ").strip()))
         return retVal
 
-    # wrapper for executemany
+    # wrapper for executemany, returning the total number of affected rows
     def executemany(self, sql, varmap_list):
+        # capture statement
+        if self.capturedStatements is not None and len(varmap_list) > 0:
+            self.capturedStatements.append((sql, copy.copy(varmap_list[0])))
         # get lock
-        if self.usingAppLock and not self.lockDB:
+        if self.usingAppLock and not self.lockDB and not self.concurrentRead:
             if harvester_config.db.verbose:
                 self.verbLog.debug(f"thr={self.thrName} locking")
             conLock.acquire()
@@ -302,14 +421,17 @@ class DBProxy(object):
             # execute
             try:
                 if harvester_config.db.engine == "sqlite":
-                    retVal = []
+                    retVal = 0
                     iList = 0
                     nList = 5000
                     while iList < len(paramList):
-                        retVal += self.cur.executemany(newSQL, paramList[iList : iList + nList])
+                        self.cur.executemany(newSQL, paramList[iList : iList + nList])
+                        # rowcount is only for the last chunk
+                        retVal += self.cur.rowcount
                         iList += nList
                 else:
-                    retVal = self.cur.executemany(newSQL, paramList)
+                    self.cur.executemany(newSQL, paramList)
+                    retVal = self.cur.rowcount
             except Exception as e:
                 self._handle_exception(e)
                 if harvester_config.db.verbose:
@@ -317,7 +439,7 @@ class DBProxy(object):
                 raise
         finally:
             # release lock
-            if self.usingAppLock and not self.lockDB:
+            if self.usingAppLock and not self.lockDB and not self.concurrentRead:
                 if harvester_config.db.verbose:
                     self.verbLog.debug(f"thr={self.thrName} release")
                 conLock.release()
@@ -326,6 +448,10 @@ class DBProxy(object):
 
     # commit
     def commit(self):
+        # changes are discarded while capturing statements
+        if self.capturedStatements is not None:
+            self.rollback()
+            return
         try:
             self.con.commit()
         except Exception as e:
@@ -354,6 +480,17 @@ class DBProxy(object):
                 conLock.release()
                 self.lockDB = False
 
+    # start capturing executed statements. changes are rolled back instead of committed until capturing is stopped
+    def start_capturing_statements(self):
+        self.capturedStatements = []
+
+    # stop capturing statements and return the list of (sql, varmap)
+    def stop_capturing_statements(self):
+        capturedStatements = self.capturedStatements
+        self.capturedStatements = None
+        self.rollback()
+        return capturedStatements
+
     # type conversion
     def type_conversion(self, attr_type):
         # remove decorator
@@ -507,19 +644,8 @@ class DBProxy(object):
         tmpLog = core_utils.make_logger(_logger, method_name="make_tables")
         tmpLog.debug("start")
         outStrs = []
-        outStrs += self.make_table(CommandSpec, commandTableName)
-        outStrs += self.make_table(JobSpec, jobTableName)
-        outStrs += self.make_table(WorkSpec, workTableName)
-        outStrs += self.make_table(FileSpec, fileTableName)
-        outStrs += self.make_table(EventSpec, eventTableName)
-        outStrs += self.make_table(CacheSpec, cacheTableName)
-        outStrs += self.make_table(SeqNumberSpec, seqNumberTableName)
-        outStrs += self.make_table(PandaQueueSpec, pandaQueueTableName)
-        outStrs += self.make_table(JobWorkerRelationSpec, jobWorkerTableName)
-        outStrs += self.make_table(ProcessLockSpec, processLockTableName)
-        outStrs += self.make_table(DiagSpec, diagTableName)
-        outStrs += self.make_table(QueueConfigDumpSpec, queueConfigDumpTableName)
-        outStrs += self.make_table(ServiceMetricSpec, serviceMetricsTableName)
+        for cls, table_name in specTableList:
+            outStrs += self.make_table(cls, table_name)
 
         # dump error messages
         if len(outStrs) > 0:
@@ -532,6 +658,23 @@ class DBProxy(object):
                 print(outStr)
             sys.exit(1)
 
+        # make archive tables for retention
+        if hasattr(harvester_config, "sweeper") and getattr(harvester_config.sweeper, "retentionMode", "delete") == "table":
+            outStrs = []
+            outStrs += self.make_table(WorkSpec, workArchiveTableName)
+            outStrs += self.make_table(JobSpec, jobArchiveTableName)
+            if len(outStrs) > 0:
+                errMsg = "ERROR : Definitions of archive tables are incorrect. "
+                errMsg += "Please drop those tables so that harvester automatically re-creates those tables."
+                errMsg += "\n"
+                print(errMsg)
+                for outStr in outStrs:
+                    print(outStr)
+                sys.exit(1)
+
+        # migrate schema
+        self.migrate_schema()
+
         # sync workerID
         init_worker = 1
         if hasattr(harvester_config.db, "syncMaxWorkerID") and harvester_config.db.syncMaxWorkerID:
@@ -589,6 +732,148 @@ class DBProxy(object):
                     outStrs.append(f"{attrName} {attrType} is missing in {table_name}")
         return outStrs
 
+    # get names of indexes in a table
+    def get_index_names(self, table_name):
+        varMap = dict()
+        if harvester_config.db.engine == "mariadb":
+            varMap[":name"] = table_name
+            varMap[":schema"] = harvester_config.db.schema
+            sqlI = "SELECT DISTINCT index_name FROM information_schema.statistics WHERE table_schema=:schema AND table_name=:name "
+        else:
+            sqlI = f"PRAGMA index_list({table_name}) "
+        self.execute(sqlI, varMap)
+        resI = self.cur.fetchall()
+        self.commit()
+        indexNames = set()
+        for tmpItem in resI:
+            if harvester_config.db.engine == "mariadb":
+                indexNames.add(tmpItem[0])
+            else:
+                indexNames.add(tmpItem[1])
+        return indexNames
+
+    # get the schema version
+    def get_schema_version(self):
+        sqlC = f"SELECT curVal FROM {seqNumberTableName} WHERE numberName=:numberName "
+        varMap = dict()
+        varMap[":numberName"] = schemaVersionName
+        self.execute(sqlC, varMap)
+        resC = self.cur.fetchone()
+        self.commit()
+        if resC is None:
+            return 0
+        return resC[0]
+
+    # set the schema version
+    def set_schema_version(self, version):
+        sqlU = f"UPDATE {seqNumberTableName} SET curVal=:curVal WHERE numberName=:numberName "
+        varMap = dict()
+        varMap[":numberName"] = schemaVersionName
+        varMap[":curVal"] = version
+        self.execute(sqlU, varMap)
+        if self.cur.rowcount == 0:
+            seqNumberSpec = SeqNumberSpec()
+            seqNumberSpec.numberName = schemaVersionName
+            seqNumberSpec.curVal = version
+            sqlI = f"INSERT INTO {seqNumberTableName} ({SeqNumberSpec.column_names()}) "
+            sqlI += SeqNumberSpec.bind_values_expression()
+            self.execute(sqlI, seqNumberSpec.values_list())
+        self.commit()
+
+    # get composite indexes declared in spec classes which are newer than a schema version
+    def get_pending_composite_indexes(self, version):
+        retList = []
+        for cls, table_name in specTableList:
+            for indexVersion, columns in cls.compositeIndexes:
+                if indexVersion > version:
+                    indexName = "idx_{0}_{1}".format("_".join(columns), table_name)
+                    retList.append((indexVersion, table_name, indexName, columns))
+        retList.sort()
+        return retList
+
+    # apply versioned schema migrations to make composite indexes declared in spec classes
+    def migrate_schema(self):
+        # get logger
+        tmpLog = core_utils.make_logger(_logger, method_name="migrate_schema")
+        try:
+            version = self.get_schema_version()
+            pendingIndexes = self.get_pending_composite_indexes(version)
+            if len(pendingIndexes) == 0:
+                tmpLog.debug(f"schema version {version} is up to date")
+                return True
+            tmpLog.debug(f"start from schema version {version}")
+            # apply version by version
+            for iItem, (indexVersion, table_name, indexName, columns) in enumerate(pendingIndexes):
+                if indexName not in self.get_index_names(table_name):
+                    sqlI = "CREATE INDEX {0} ON {1}({2}) ".format(indexName, table_name, ",".join(columns))
+                    self.execute(sqlI)
+                    self.commit()
+                    tmpLog.debug(f"added {indexName} for version {indexVersion}")
+                # bump the version once all indexes of the version are made
+                if iItem + 1 == len(pendingIndexes) or pendingIndexes[iItem + 1][0] != indexVersion:
+                    version = indexVersion
+                    self.set_schema_version(version)
+            tmpLog.debug(f"migrated to schema version {version}")
+            return True
+        except Exception:
+            # roll back
+            self.rollback()
+            # dump error
+            core_utils.dump_error_message(tmpLog)
+            return False
+
+    # get query plan of a statement as a list of dicts with table, scan type, index, and detail
+    def explain_statement(self, sql, varmap=None):
+        if harvester_config.db.engine == "mariadb":
+            self.execute("EXPLAIN " + sql, varmap)
+            resE = self.cur.fetchall()
+            columnNames = [d[0].lower() for d in self.cur.description]
+            self.commit()
+            retList = []
+            for tmpItem in resE:
+                tmpItem = dict(zip(columnNames, tmpItem))
+                accessType = tmpItem.get("type")
+                if accessType == "ALL":
+                    scanType = "full scan"
+                elif accessType == "index":
+                    scanType = "full index scan"
+                elif accessType is None:
+                    scanType = "no table"
+                else:
+                    scanType = "index search"
+                retList.append(
+                    {
+                        "table": tmpItem.get("table"),
+                        "scan": scanType,
+                        "index": tmpItem.get("key"),
+                        "detail": f"type={accessType} rows={tmpItem.get('rows')} extra={tmpItem.get('extra')}",
+                    }
+                )
+        else:
+            self.execute("EXPLAIN QUERY PLAN " + sql, varmap)
+            resE = self.cur.fetchall()
+            self.commit()
+            retList = []
+            for tmpItem in resE:
+                detail = tmpItem[-1]
+                tmpMatch = re.search("^(SCAN|SEARCH)( TABLE)? (\\S+)", detail)
+                if tmpMatch is None:
+                    # temporary B-trees for ORDER BY etc
+                    retList.append({"table": None, "scan": "other", "index": None, "detail": detail})
+                    continue
+                tmpIndex = re.search("USING (COVERING |INTEGER PRIMARY KEY)?(INDEX (\\S+))?", detail)
+                indexName = None
+                if tmpIndex is not None and tmpIndex.group(0) != "USING ":
+                    indexName = tmpIndex.group(3) or "PRIMARY KEY"
+                if tmpMatch.group(1) == "SEARCH":
+                    scanType = "index search"
+                elif indexName is not None:
+                    scanType = "full index scan"
+                else:
+                    scanType = "full scan"
+                retList.append({"table": tmpMatch.group(3), "scan": scanType, "index": indexName, "detail": detail})
+        return retList
+
     # insert jobs
     def insert_jobs(self, jobspec_list):
         # get logger
@@ -629,8 +914,6 @@ class DBProxy(object):
                     self.execute(sqlDE, varMap)
                     # delete relations
                     self.execute(sqlDR, varMap)
-                # commit
-                self.commit()
                 # insert job and files
                 varMap = jobSpec.values_list()
                 varMapsJ.append(varMap)
@@ -2133,6 +2416,8 @@ class DBProxy(object):
     def update_jobs_workers(self, jobspec_list, workspec_list, locked_by, panda_ids_list=None):
         try:
             timeNow = datetime.datetime.utcnow()
+            # group statements with the same shape into executemany and commit once at the end
+            useBatch = hasattr(harvester_config.db, "batchUpdateJobsWorkers") and harvester_config.db.batchUpdateJobsWorkers is True
             # sql to check job
             sqlCJ = f"SELECT status FROM {jobTableName} WHERE PandaID=:PandaID FOR UPDATE "
             # sql to check file
@@ -2173,6 +2458,8 @@ class DBProxy(object):
             sqlEU += "WHERE PandaID=:PandaID AND eventRangeID=:eventRangeID "
             # sql to check if relationship is already available
             sqlCR = f"SELECT 1 c FROM {jobWorkerTableName} WHERE PandaID=:PandaID AND workerID=:workerID "
+            # sql to get relationships of workers
+            sqlCRW = f"SELECT PandaID,workerID FROM {jobWorkerTableName} WHERE workerID IN "
             # sql to insert job and worker relationship
             sqlIR = f"INSERT INTO {jobWorkerTableName} ({JobWorkerRelationSpec.column_names()}) "
             sqlIR += JobWorkerRelationSpec.bind_values_expression()
@@ -2180,6 +2467,8 @@ class DBProxy(object):
             sqlNW = f"SELECT DISTINCT t.workerID FROM {jobWorkerTableName} t, {workTableName} w "
             sqlNW += "WHERE t.PandaID=:PandaID AND w.workerID=t.workerID "
             sqlNW += "AND w.status IN (:st_submitted,:st_running,:st_idle) "
+            # job updates grouped by sql
+            jobUpdateMap = dict()
             # update job
             if jobspec_list is not None:
                 if len(workspec_list) > 0 and workspec_list[0].mapType == WorkSpec.MT_MultiWorkers:
@@ -2225,6 +2514,7 @@ class DBProxy(object):
                         nFiles = 0
                         fileIdMap = {}
                         zipFileRes = dict()
+                        varMapsFU = []
                         for fileSpec in jobSpec.outFiles:
                             # insert file
                             if fileSpec.lfn not in allLFNs:
@@ -2249,7 +2539,10 @@ class DBProxy(object):
                                     varMap[":status"] = fileSpec.status
                                     varMap[":fileID"] = fileSpec.fileID
                                     varMap[":zipFileID"] = fileSpec.fileID
-                                    self.execute(sqlFU, varMap)
+                                    if useBatch:
+                                        varMapsFU.append(varMap)
+                                    else:
+                                        self.execute(sqlFU, varMap)
                             elif fileSpec.isZip == 1 and fileSpec.eventRangeID is not None:
                                 # add a fake file with eventRangeID which has the same lfn/zipFileID as zip file
                                 varMap = dict()
@@ -2284,9 +2577,15 @@ class DBProxy(object):
                                 varMap[":status"] = "renewed"
                                 varMap[":fileID"] = allLFNs[fileSpec.lfn]
                                 varMap[":zipFileID"] = None
-                                self.execute(sqlFU, varMap)
+                                if useBatch:
+                                    varMapsFU.append(varMap)
+                                else:
+                                    self.execute(sqlFU, varMap)
                         if nFiles > 0:
                             tmpLog.debug(f"inserted {nFiles} files")
+                        # update files in bulk
+                        if len(varMapsFU) > 0:
+                            self.executemany(sqlFU, varMapsFU)
                         # check pending files
                         if jobSpec.zipPerMB is not None and not (jobSpec.zipPerMB == 0 and jobSpec.subStatus != "to_transfer"):
                             # get workerID and provenanceID of pending files
@@ -2435,14 +2734,39 @@ class DBProxy(object):
                             jobSpec.modificationTime = timeNow
                             varMap = jobSpec.values_map(only_changed=True)
                             varMap[":PandaID"] = jobSpec.PandaID
-                            self.execute(sqlJ, varMap)
-                            nRow = self.cur.rowcount
-                            tmpLog.debug(f"done with {nRow}")
+                            if useBatch:
+                                jobUpdateMap.setdefault(sqlJ, [])
+                                jobUpdateMap[sqlJ].append(varMap)
+                            else:
+                                self.execute(sqlJ, varMap)
+                                nRow = self.cur.rowcount
+                                tmpLog.debug(f"done with {nRow}")
                         tmpLog.debug("all done for job")
                     # commit
-                    self.commit()
+                    if not useBatch:
+                        self.commit()
+            # update jobs in bulk
+            tmpLog = core_utils.make_logger(_logger, f"by {locked_by}", method_name="update_jobs_workers")
+            for sqlJ, varMaps in jobUpdateMap.items():
+                nRow = self.executemany(sqlJ, varMaps)
+                tmpLog.debug(f"updated {nRow} jobs with {len(varMaps)} rows")
+            # get existing relationships of workers in bulk
+            existingRelations = set()
+            if useBatch and panda_ids_list is not None:
+                workerIDs = [workSpec.workerID for workSpec in workspec_list]
+                for iSlice in range(0, len(workerIDs), 100):
+                    varMap = dict()
+                    for j, workerID in enumerate(workerIDs[iSlice : iSlice + 100]):
+                        varMap[f":workerID{j}"] = workerID
+                    sqlCRWx = sqlCRW + "({0}) ".format(",".join(varMap.keys()))
+                    self.execute(sqlCRWx, varMap)
+                    resCRW = self.cur.fetchall()
+                    for tmpPandaID, tmpWorkerID in resCRW:
+                        existingRelations.add((tmpPandaID, tmpWorkerID))
             # update worker
             retVal = True
+            workerUpdateMap = dict()
+            varMapsIR = []
             for idxW, workSpec in enumerate(workspec_list):
                 tmpLog = core_utils.make_logger(_logger, f"workerID={workSpec.workerID}", method_name="update_jobs_workers")
                 tmpLog.debug("update worker")
@@ -2471,30 +2795,55 @@ class DBProxy(object):
                     varMap[":st2"] = WorkSpec.ST_finished
                     varMap[":st3"] = WorkSpec.ST_failed
                     varMap[":st4"] = WorkSpec.ST_missed
-                    self.execute(sqlW, varMap)
-                    nRow = self.cur.rowcount
-                    tmpLog.debug(f"done with {nRow}")
-                    if nRow == 0:
-                        retVal = False
+                    if useBatch:
+                        workerUpdateMap.setdefault(sqlW, [])
+                        workerUpdateMap[sqlW].append(varMap)
+                    else:
+                        self.execute(sqlW, varMap)
+                        nRow = self.cur.rowcount
+                        tmpLog.debug(f"done with {nRow}")
+                        if nRow == 0:
+                            retVal = False
                 # insert relationship if necessary
                 if panda_ids_list is not None and len(panda_ids_list) > idxW:
-                    varMapsIR = []
                     for pandaID in panda_ids_list[idxW]:
-                        varMap = dict()
-                        varMap[":PandaID"] = pandaID
-                        varMap[":workerID"] = workSpec.workerID
-                        self.execute(sqlCR, varMap)
-                        resCR = self.cur.fetchone()
-                        if resCR is None:
-                            jwRelation = JobWorkerRelationSpec()
-                            jwRelation.PandaID = pandaID
-                            jwRelation.workerID = workSpec.workerID
-                            varMap = jwRelation.values_list()
-                            varMapsIR.append(varMap)
-                    if len(varMapsIR) > 0:
+                        if useBatch:
+                            if (pandaID, workSpec.workerID) in existingRelations:
+                                continue
+                            existingRelations.add((pandaID, workSpec.workerID))
+                        else:
+                            varMap = dict()
+                            varMap[":PandaID"] = pandaID
+                            varMap[":workerID"] = workSpec.workerID
+                            self.execute(sqlCR, varMap)
+                            resCR = self.cur.fetchone()
+                            if resCR is not None:
+                                continue
+                        jwRelation = JobWorkerRelationSpec()
+                        jwRelation.PandaID = pandaID
+                        jwRelation.workerID = workSpec.workerID
+                        varMap = jwRelation.values_list()
+                        varMapsIR.append(varMap)
+                    if not useBatch and len(varMapsIR) > 0:
                         self.executemany(sqlIR, varMapsIR)
+                        varMapsIR = []
                 tmpLog.debug("all done for worker")
                 # commit
+                if not useBatch:
+                    self.commit()
+            if useBatch:
+                # update workers in bulk
+                tmpLog = core_utils.make_logger(_logger, f"by {locked_by}", method_name="update_jobs_workers")
+                for sqlW, varMaps in workerUpdateMap.items():
+                    nRow = self.executemany(sqlW, varMaps)
+                    tmpLog.debug(f"updated {nRow} workers with {len(varMaps)} rows")
+                    # workerID is the primary key so each row updates at most one worker
+                    if nRow < len(varMaps):
+                        retVal = False
+                # insert relationships in bulk
+                if len(varMapsIR) > 0:
+                    self.executemany(sqlIR, varMapsIR)
+                # commit
                 self.commit()
             # return
             return retVal
@@ -3468,6 +3817,7 @@ class DBProxy(object):
             return {}
 
     # get worker stats
+    @replica_read
     def get_worker_stats_bulk(self, active_ups_queues):
         try:
             # get logger
@@ -3525,6 +3875,7 @@ class DBProxy(object):
             return {}
 
     # get full worker stats
+    @replica_read
     def get_worker_stats_full(self, filter_site_list=None):
         try:
             # get logger
@@ -3677,16 +4028,35 @@ class DBProxy(object):
 
     # get workers for cleanup
     def get_workers_for_cleanup(self, max_workers, status_timeout_map):
+        retVal = dict()
+        try:
+            for queueName, configID, workSpec in self.iterate_workers_for_cleanup(max_workers, status_timeout_map):
+                retVal.setdefault(queueName, dict())
+                retVal[queueName].setdefault(configID, [])
+                retVal[queueName][configID].append(workSpec)
+        except Exception:
+            # the error was dumped when reading the page
+            return dict()
+        return retVal
+
+    # generator of queueName, configID, and workSpec for workers to be cleaned up, oldest first
+    @paged("get_workers_for_cleanup_page")
+    def iterate_workers_for_cleanup(self, max_workers, status_timeout_map):
+        return iterate_pages(self.get_workers_for_cleanup_page, max_workers, status_timeout_map)
+
+    # get a page of workers for cleanup ordered by modificationTime and workerID.
+    # last_key is (the number of candidates, modificationTime, workerID) of the previous page
+    def get_workers_for_cleanup_page(self, max_workers, status_timeout_map, last_key=None):
         try:
             # get logger
-            tmpLog = core_utils.make_logger(_logger, method_name="get_workers_for_cleanup")
+            tmpLog = core_utils.make_logger(_logger, f"last_key={last_key}", method_name="get_workers_for_cleanup_page")
             tmpLog.debug("start")
             # sql to get worker IDs
             timeNow = datetime.datetime.utcnow()
             modTimeLimit = timeNow - datetime.timedelta(minutes=60)
             varMap = dict()
             varMap[":timeLimit"] = modTimeLimit
-            sqlW = f"SELECT workerID, configID FROM {workTableName} "
+            sqlW = f"SELECT workerID,configID,modificationTime FROM {workTableName} "
             sqlW += "WHERE lastUpdate IS NULL AND ("
             for tmpStatus, tmpTimeout in iteritems(status_timeout_map):
                 tmpStatusKey = f":status_{tmpStatus}"
@@ -3697,7 +4067,6 @@ class DBProxy(object):
             sqlW = sqlW[:-4]
             sqlW += ") "
             sqlW += "AND modificationTime<:timeLimit "
-            sqlW += f"ORDER BY modificationTime LIMIT {max_workers} "
             # sql to lock or release worker
             sqlL = f"UPDATE {workTableName} SET modificationTime=:setTime "
             sqlL += "WHERE workerID=:workerID AND modificationTime<:timeLimit "
@@ -3720,13 +4089,26 @@ class DBProxy(object):
             # sql to get files not to be deleted. b.todelete is not used to use index on b.lfn
             sqlD = "SELECT b.lfn,b.todelete  FROM {0} a, {0} b ".format(fileTableName)
             sqlD += "WHERE a.PandaID=:PandaID AND a.fileType IN (:fileType1,:fileType2) AND b.lfn=a.lfn "
-            # get workerIDs
+            # get workerIDs after the previous page
+            if last_key is None:
+                nCandidates = 0
+            else:
+                nCandidates, lastTime, lastID = last_key
+                sqlW += "AND (modificationTime>:lastTime1 OR (modificationTime=:lastTime2 AND workerID>:lastID)) "
+                varMap[":lastTime1"] = lastTime
+                varMap[":lastTime2"] = lastTime
+                varMap[":lastID"] = lastID
+            batchSize = min(self.scanBatchSize, max_workers - nCandidates)
+            if batchSize <= 0:
+                return [], None
+            sqlW += f"ORDER BY modificationTime,workerID LIMIT {batchSize} "
             timeNow = datetime.datetime.utcnow()
             self.execute(sqlW, varMap)
             resW = self.cur.fetchall()
-            retVal = dict()
-            iWorkers = 0
-            for workerID, configID in resW:
+            # commit
+            self.commit()
+            retList = []
+            for workerID, configID, _ in resW:
                 # lock worker
                 varMap = dict()
                 varMap[":workerID"] = workerID
@@ -3755,9 +4137,6 @@ class DBProxy(object):
                     workSpec = WorkSpec()
                     workSpec.pack(resG)
                     queueName = workSpec.computingSite
-                    retVal.setdefault(queueName, dict())
-                    retVal[queueName].setdefault(configID, [])
-                    retVal[queueName][configID].append(workSpec)
                     # get jobs
                     jobSpecs = []
                     checkedLFNs = set()
@@ -3800,16 +4179,22 @@ class DBProxy(object):
                             if fileSpec.lfn not in keepLFNs:
                                 jobSpec.add_file(fileSpec)
                     workSpec.set_jobspec_list(jobSpecs)
-                    iWorkers += 1
-            tmpLog.debug(f"got {iWorkers} workers")
-            return retVal
+                    retList.append((queueName, configID, workSpec))
+            # commit
+            self.commit()
+            # key of the next page
+            nextKey = None
+            if len(resW) == batchSize:
+                lastID, _, lastTime = resW[-1]
+                nextKey = (nCandidates + len(resW), lastTime, lastID)
+            tmpLog.debug(f"got {len(retList)} workers in {len(resW)} candidates")
+            return retList, nextKey
         except Exception:
             # roll back
             self.rollback()
             # dump error
             core_utils.dump_error_message(_logger)
-            # return
-            return {}
+            raise
 
     # delete a worker
     def delete_worker(self, worker_id):
@@ -4145,8 +4530,8 @@ class DBProxy(object):
             # return
             return False
 
-    # get a process lock
-    def get_process_lock(self, process_name, locked_by, lock_interval):
+    # get a process lock. The lock held by the same owner is extended if renew=True
+    def get_process_lock(self, process_name, locked_by, lock_interval, renew=False):
         try:
             # get logger
             tmpLog = core_utils.make_logger(_logger, f"proc={process_name} by={locked_by}", method_name="get_process_lock")
@@ -4160,7 +4545,7 @@ class DBProxy(object):
             # commit
             self.commit()
             # check lock
-            sqlC = f"SELECT lockTime FROM {processLockTableName} "
+            sqlC = f"SELECT lockTime,lockedBy FROM {processLockTableName} "
             sqlC += "WHERE processName=:processName "
             varMap = dict()
             varMap[":processName"] = process_name
@@ -4180,9 +4565,20 @@ class DBProxy(object):
                 self.execute(sqlI, varMap)
                 retVal = True
             else:
-                (oldLockTime,) = resC
+                oldLockTime, oldLockedBy = resC
                 timeLimit = timeNow - datetime.timedelta(seconds=lock_interval)
-                if oldLockTime <= timeLimit:
+                if renew and oldLockedBy == locked_by:
+                    # extend lock held by the same owner
+                    sqlR = f"UPDATE {processLockTableName} SET lockTime=:timeNow "
+                    sqlR += "WHERE processName=:processName AND lockedBy=:lockedBy "
+                    varMap = dict()
+                    varMap[":processName"] = process_name
+                    varMap[":lockedBy"] = locked_by
+                    varMap[":timeNow"] = timeNow
+                    self.execute(sqlR, varMap)
+                    if self.cur.rowcount > 0:
+                        retVal = True
+                elif oldLockTime <= timeLimit:
                     # update lock if old
                     sqlU = f"UPDATE {processLockTableName} SET lockedBy=:lockedBy,lockTime=:timeNow "
                     sqlU += "WHERE processName=:processName AND lockTime<=:timeLimit "
@@ -4231,6 +4627,84 @@ class DBProxy(object):
             # return
             return False
 
+    # expire a process lock, keeping the owner so that others taking it over know who held it
+    def expire_process_lock(self, process_name, locked_by, lock_interval):
+        try:
+            # get logger
+            tmpLog = core_utils.make_logger(_logger, f"proc={process_name} by={locked_by}", method_name="expire_process_lock")
+            tmpLog.debug("start")
+            # sql to expire lock
+            sqlE = f"UPDATE {processLockTableName} SET lockTime=:timeLimit "
+            sqlE += "WHERE processName=:processName AND lockedBy=:lockedBy "
+            varMap = dict()
+            varMap[":processName"] = process_name
+            varMap[":lockedBy"] = locked_by
+            varMap[":timeLimit"] = datetime.datetime.utcnow() - datetime.timedelta(seconds=lock_interval)
+            self.execute(sqlE, varMap)
+            # commit
+            self.commit()
+            tmpLog.debug("done")
+            return True
+        except Exception:
+            # roll back
+            self.rollback()
+            # dump error
+            core_utils.dump_error_message(_logger)
+            # return
+            return False
+
+    # get the owner of a process lock. None if missing
+    def get_process_lock_owner(self, process_name):
+        try:
+            # get logger
+            tmpLog = core_utils.make_logger(_logger, f"proc={process_name}", method_name="get_process_lock_owner")
+            tmpLog.debug("start")
+            # sql to get owner
+            sqlC = f"SELECT lockedBy FROM {processLockTableName} "
+            sqlC += "WHERE processName=:processName "
+            varMap = dict()
+            varMap[":processName"] = process_name
+            self.execute(sqlC, varMap)
+            resC = self.cur.fetchone()
+            # commit
+            self.commit()
+            retVal = None if resC is None else resC[0]
+            tmpLog.debug(f"got {retVal}")
+            return retVal
+        except Exception:
+            # roll back
+            self.rollback()
+            # dump error
+            core_utils.dump_error_message(_logger)
+            # return
+            return None
+
+    # get the number of process locks with names matching a LIKE pattern, which were taken or renewed within lock_interval sec
+    def get_num_process_locks(self, process_name_pattern, lock_interval):
+        try:
+            # get logger
+            tmpLog = core_utils.make_logger(_logger, f"proc={process_name_pattern}", method_name="get_num_process_locks")
+            tmpLog.debug("start")
+            # sql to count locks
+            sqlC = f"SELECT COUNT(*) FROM {processLockTableName} "
+            sqlC += "WHERE processName LIKE :processName AND lockTime>:timeLimit "
+            varMap = dict()
+            varMap[":processName"] = process_name_pattern
+            varMap[":timeLimit"] = datetime.datetime.utcnow() - datetime.timedelta(seconds=lock_interval)
+            self.execute(sqlC, varMap)
+            (nLocks,) = self.cur.fetchone()
+            # commit
+            self.commit()
+            tmpLog.debug(f"got {nLocks}")
+            return nLocks
+        except Exception:
+            # roll back
+            self.rollback()
+            # dump error
+            core_utils.dump_error_message(_logger)
+            # return
+            return None
+
     # get file status
     def get_file_status(self, lfn, file_type, endpoint, job_status):
         try:
@@ -4876,85 +5350,217 @@ class DBProxy(object):
 
     # delete old jobs
     def delete_old_jobs(self, timeout):
+        # get logger
+        tmpLog = core_utils.make_logger(_logger, f"timeout={timeout}", method_name="delete_old_jobs")
+        tmpLog.debug("start")
+        # delete jobs in chunks
+        nDel = 0
+        lastKey = None
+        while True:
+            tmpRet = self.get_rows_to_archive(jobTableName, timeout, self.scanBatchSize, last_key=lastKey)
+            if tmpRet is None:
+                tmpLog.error(f"failed to get jobs after deleting {nDel} jobs")
+                return False
+            keyList, _, lastKey = tmpRet
+            if len(keyList) > 0:
+                tmpDel = self.archive_rows(jobTableName, timeout, keyList)
+                if tmpDel is None:
+                    tmpLog.error(f"failed to delete jobs after deleting {nDel} jobs")
+                    return False
+                nDel += tmpDel
+            if lastKey is None:
+                break
+        tmpLog.debug(f"deleted {nDel} jobs")
+        return True
+
+    # get the spec class, the key, the archive table, dependent tables, and the condition with its parameters
+    # for terminal rows of work_table or job_table older than timeout in hours
+    def _get_retention_condition(self, table_name, timeout):
+        timeNow = datetime.datetime.utcnow()
+        varMap = dict()
+        if table_name == workTableName:
+            # terminal workers which are no longer related to jobs
+            sqlCond = "status IN (:st_finished,:st_failed,:st_cancelled,:st_missed) AND modificationTime<:timeLimit1 "
+            sqlCond += f"AND NOT EXISTS (SELECT 1 FROM {jobWorkerTableName} r WHERE r.workerID={workTableName}.workerID) "
+            varMap[":st_finished"] = WorkSpec.ST_finished
+            varMap[":st_failed"] = WorkSpec.ST_failed
+            varMap[":st_cancelled"] = WorkSpec.ST_cancelled
+            varMap[":st_missed"] = WorkSpec.ST_missed
+            varMap[":timeLimit1"] = timeNow - datetime.timedelta(hours=timeout)
+            return WorkSpec, "workerID", workArchiveTableName, [], sqlCond, varMap
+        if table_name == jobTableName:
+            # jobs already propagated
+            sqlCond = "subStatus=:subStatus AND propagatorTime IS NULL "
+            sqlCond += "AND ((modificationTime IS NOT NULL AND modificationTime<:timeLimit1) "
+            sqlCond += "OR (modificationTime IS NULL AND creationTime<:timeLimit2)) "
+            varMap[":subStatus"] = "done"
+            varMap[":timeLimit1"] = timeNow - datetime.timedelta(hours=timeout)
+            varMap[":timeLimit2"] = timeNow - datetime.timedelta(hours=timeout * 2)
+            return JobSpec, "PandaID", jobArchiveTableName, [fileTableName, eventTableName, jobWorkerTableName], sqlCond, varMap
+        raise RuntimeError(f"archiving {table_name} is not supported")
+
+    # get a chunk of terminal rows of work_table or job_table older than timeout in hours, ordered by the key.
+    # returns a list of keys, a list of specs only if with_specs is True, and the key of the next chunk or None after the last chunk
+    def get_rows_to_archive(self, table_name, timeout, chunk_size, with_specs=False, last_key=None):
         try:
             # get logger
-            tmpLog = core_utils.make_logger(_logger, f"timeout={timeout}", method_name="delete_old_jobs")
+            tmpLog = core_utils.make_logger(_logger, f"table={table_name} last_key={last_key}", method_name="get_rows_to_archive")
             tmpLog.debug("start")
-            # sql to get old jobs to be deleted
-            sqlGJ = f"SELECT PandaID FROM {jobTableName} "
-            sqlGJ += "WHERE subStatus=:subStatus AND propagatorTime IS NULL "
-            sqlGJ += "AND ((modificationTime IS NOT NULL AND modificationTime<:timeLimit1) "
-            sqlGJ += "OR (modificationTime IS NULL AND creationTime<:timeLimit2)) "
-            # sql to delete job
-            sqlDJ = f"DELETE FROM {jobTableName} "
-            sqlDJ += "WHERE PandaID=:PandaID "
-            # sql to delete files
-            sqlDF = f"DELETE FROM {fileTableName} "
-            sqlDF += "WHERE PandaID=:PandaID "
-            # sql to delete events
-            sqlDE = f"DELETE FROM {eventTableName} "
-            sqlDE += "WHERE PandaID=:PandaID "
-            # sql to delete relations
-            sqlDR = f"DELETE FROM {jobWorkerTableName} "
-            sqlDR += "WHERE PandaID=:PandaID "
-            # get jobs
-            varMap = dict()
-            varMap[":subStatus"] = "done"
-            varMap[":timeLimit1"] = datetime.datetime.utcnow() - datetime.timedelta(hours=timeout)
-            varMap[":timeLimit2"] = datetime.datetime.utcnow() - datetime.timedelta(hours=timeout * 2)
-            self.execute(sqlGJ, varMap)
-            resGJ = self.cur.fetchall()
+            specClass, keyName, _, _, sqlCond, varMap = self._get_retention_condition(table_name, timeout)
+            # sql to get rows in a chunk
+            if with_specs:
+                sqlS = f"SELECT {specClass.column_names()} FROM {table_name} "
+            else:
+                sqlS = f"SELECT {keyName} FROM {table_name} "
+            sqlS += f"WHERE {sqlCond} AND {keyName}>:lastKey ORDER BY {keyName} LIMIT {chunk_size} "
+            varMap[":lastKey"] = -1 if last_key is None else last_key
+            self.execute(sqlS, varMap)
+            resS = self.cur.fetchall()
+            # commit
+            self.commit()
+            keyList = []
+            specList = []
+            for tmpRes in resS:
+                if with_specs:
+                    tmpSpec = specClass()
+                    tmpSpec.pack(tmpRes)
+                    specList.append(tmpSpec)
+                    keyList.append(getattr(tmpSpec, keyName))
+                else:
+                    keyList.append(tmpRes[0])
+            # key of the next chunk
+            nextKey = None
+            if len(keyList) == chunk_size:
+                nextKey = keyList[-1]
+            tmpLog.debug(f"got {len(keyList)} rows")
+            return keyList, specList, nextKey
+        except Exception:
+            # roll back
+            self.rollback()
+            # dump error
+            core_utils.dump_error_message(_logger)
+            # return
+            return None
+
+    # remove a chunk of terminal rows of work_table or job_table older than timeout in hours with the keys in key_list,
+    # together with rows in dependent tables. mode=table copies the rows into the archive table before removal.
+    # returns the number of removed rows
+    def archive_rows(self, table_name, timeout, key_list, mode="delete"):
+        try:
+            # get logger
+            tmpLog = core_utils.make_logger(_logger, f"table={table_name} mode={mode}", method_name="archive_rows")
+            tmpLog.debug(f"start for {len(key_list)} rows")
+            specClass, keyName, archiveTableName, dependentTables, sqlCond, varMap = self._get_retention_condition(table_name, timeout)
+            # sql to copy rows to the archive table. the condition is repeated so that rows modified after they were read are kept
+            sqlA = f"INSERT INTO {archiveTableName} ({specClass.column_names()}) "
+            sqlA += f"SELECT {specClass.column_names()} FROM {table_name} "
+            sqlA += f"WHERE {sqlCond} AND {keyName} IN "
+            # sql to delete rows
+            sqlD = f"DELETE FROM {table_name} "
+            sqlD += f"WHERE {sqlCond} AND {keyName} IN "
+            # sql to delete rows in dependent tables
+            sqlDD = "DELETE FROM {0} "
+            sqlDD += "WHERE NOT EXISTS (SELECT 1 FROM {2} m WHERE m.{1}={0}.{1}) AND {1} IN "
+            # archive and delete the chunk in slices
             nDel = 0
-            for (pandaID,) in resGJ:
-                varMap = dict()
-                varMap[":PandaID"] = pandaID
-                # delete job
-                self.execute(sqlDJ, varMap)
-                iDel = self.cur.rowcount
-                if iDel > 0:
-                    nDel += iDel
-                    # delete files
-                    self.execute(sqlDF, varMap)
-                    # delete events
-                    self.execute(sqlDE, varMap)
-                    # delete relations
-                    self.execute(sqlDR, varMap)
-                # commit
-                self.commit()
-            tmpLog.debug(f"deleted {nDel} jobs")
-            return True
+            for iSlice in range(0, len(key_list), 100):
+                varMapK = dict()
+                for j, tmpKey in enumerate(key_list[iSlice : iSlice + 100]):
+                    varMapK[f":key{j}"] = tmpKey
+                sqlK = "({0}) ".format(",".join(varMapK.keys()))
+                varMapS = dict(varMap)
+                varMapS.update(varMapK)
+                if mode == "table":
+                    self.execute(sqlA + sqlK, varMapS)
+                self.execute(sqlD + sqlK, varMapS)
+                nDel += self.cur.rowcount
+                for dependentTable in dependentTables:
+                    self.execute(sqlDD.format(dependentTable, keyName, table_name) + sqlK, varMapK)
+            # commit
+            self.commit()
+            tmpLog.debug(f"deleted {nDel} rows")
+            return nDel
         except Exception:
             # roll back
             self.rollback()
             # dump error
             core_utils.dump_error_message(_logger)
             # return
-            return False
+            return None
+
+    # get the number of rows and the size in bytes of a table. The number of rows is an estimate on MariaDB and the size is None on sqlite
+    def get_table_stats(self, table_name):
+        try:
+            # get logger
+            tmpLog = core_utils.make_logger(_logger, f"table={table_name}", method_name="get_table_stats")
+            tmpLog.debug("start")
+            varMap = dict()
+            if harvester_config.db.engine == "mariadb":
+                varMap[":name"] = table_name
+                varMap[":schema"] = harvester_config.db.schema
+                sqlT = "SELECT table_rows,data_length+index_length FROM information_schema.tables WHERE table_schema=:schema AND table_name=:name "
+            else:
+                sqlT = f"SELECT COUNT(*),NULL FROM {table_name} "
+            self.execute(sqlT, varMap)
+            nRows, nBytes = self.cur.fetchone()
+            # commit
+            self.commit()
+            tmpLog.debug(f"rows={nRows} bytes={nBytes}")
+            return {"n_rows": nRows, "n_bytes": nBytes}
+        except Exception:
+            # roll back
+            self.rollback()
+            # dump error
+            core_utils.dump_error_message(_logger)
+            # return
+            return None
 
-    # get iterator of active workers to monitor fifo
+    # get iterator of active workers to monitor fifo, ordered by modificationTime and computingSite
+    @paged("get_active_workers_page")
     def get_active_workers(self, n_workers, seconds_ago=0):
+        return iterate_pages(self.get_active_workers_page, n_workers, seconds_ago)
+
+    # get a page of active workers ordered by modificationTime, computingSite, and workerID.
+    # last_key is (the number of workers, modificationTime, computingSite, workerID) of the previous page
+    def get_active_workers_page(self, n_workers, seconds_ago=0, last_key=None):
         try:
             # get logger
-            tmpLog = core_utils.make_logger(_logger, method_name="get_active_workers")
+            tmpLog = core_utils.make_logger(_logger, f"last_key={last_key}", method_name="get_active_workers_page")
             tmpLog.debug("start")
             # sql to get workers
             sqlW = f"SELECT {WorkSpec.column_names()} FROM {workTableName} "
             sqlW += "WHERE status IN (:st_submitted,:st_running,:st_idle) "
             sqlW += "AND modificationTime<:timeLimit "
-            sqlW += f"ORDER BY modificationTime,computingSite LIMIT {n_workers} "
             # sql to get jobs
             sqlJ = f"SELECT j.{JobSpec.column_names()} FROM {jobWorkerTableName} jw, {jobTableName} j "
             sqlJ += "WHERE j.PandaID=jw.PandaID AND jw.workerID=:workerID "
             # parameter map
-            varMap = dict()
-            varMap[":timeLimit"] = datetime.datetime.utcnow() - datetime.timedelta(seconds=seconds_ago)
-            varMap[":st_submitted"] = WorkSpec.ST_submitted
-            varMap[":st_running"] = WorkSpec.ST_running
-            varMap[":st_idle"] = WorkSpec.ST_idle
-            self.execute(sqlW, varMap)
+            varMapW = dict()
+            varMapW[":timeLimit"] = datetime.datetime.utcnow() - datetime.timedelta(seconds=seconds_ago)
+            varMapW[":st_submitted"] = WorkSpec.ST_submitted
+            varMapW[":st_running"] = WorkSpec.ST_running
+            varMapW[":st_idle"] = WorkSpec.ST_idle
+            # workers after the previous page
+            if last_key is None:
+                nWorkers = 0
+            else:
+                nWorkers, lastTime, lastSite, lastID = last_key
+                sqlW += "AND (modificationTime>:lastTime1 OR (modificationTime=:lastTime2 AND "
+                sqlW += "(computingSite>:lastSite1 OR (computingSite=:lastSite2 AND workerID>:lastID)))) "
+                varMapW[":lastTime1"] = lastTime
+                varMapW[":lastTime2"] = lastTime
+                varMapW[":lastSite1"] = lastSite
+                varMapW[":lastSite2"] = lastSite
+                varMapW[":lastID"] = lastID
+            batchSize = min(self.scanBatchSize, n_workers - nWorkers)
+            if batchSize <= 0:
+                return [], None
+            sqlW += f"ORDER BY modificationTime,computingSite,workerID LIMIT {batchSize} "
+            self.execute(sqlW, varMapW)
             resW = self.cur.fetchall()
-
-            def _get_workspec_from_record(rec):
+            # make workers
+            workSpecs = []
+            for rec in resW:
                 workspec = WorkSpec()
                 workspec.pack(rec)
                 jobspec_list = []
@@ -4969,18 +5575,21 @@ class DBProxy(object):
                     jobspec_list.append(jobspec)
                     workspec.pandaid_list.append(jobspec.PandaID)
                 workspec.set_jobspec_list(jobspec_list)
-                return workspec
-
-            retVal = map(_get_workspec_from_record, resW)
-            tmpLog.debug(f"got {len(resW)} workers")
-            return retVal
+                workSpecs.append(workspec)
+            # commit
+            self.commit()
+            # key of the next page
+            nextKey = None
+            if len(workSpecs) == batchSize:
+                nextKey = (nWorkers + len(workSpecs), workSpecs[-1].modificationTime, workSpecs[-1].computingSite, workSpecs[-1].workerID)
+            tmpLog.debug(f"got {len(workSpecs)} workers")
+            return workSpecs, nextKey
         except Exception:
             # roll back
             self.rollback()
             # dump error
             core_utils.dump_error_message(_logger)
-            # return
-            return {}
+            raise
 
     # lock workers for specific thread
     def lock_workers(self, worker_id_list, lock_interval):
@@ -5411,6 +6020,7 @@ class DBProxy(object):
             return False
 
     # get service metrics
+    @replica_read
     def get_service_metrics(self, last_update):
         try:
             # get logger
@@ -5443,6 +6053,31 @@ class DBProxy(object):
             # return
             return {}
 
+    # get replication lag in sec of the replica. None if replication is not running
+    def get_replica_lag(self):
+        try:
+            # get logger
+            tmpLog = core_utils.make_logger(_logger, method_name="get_replica_lag")
+            # get status
+            self.execute("SHOW SLAVE STATUS")
+            resS = self.cur.fetchone()
+            columnNames = [d[0] for d in self.cur.description] if self.cur.description is not None else []
+            # commit
+            self.commit()
+            if resS is None or "Seconds_Behind_Master" not in columnNames:
+                tmpLog.debug("replication is not running")
+                return None
+            lag = resS[columnNames.index("Seconds_Behind_Master")]
+            tmpLog.debug(f"lag={lag}")
+            return lag
+        except Exception:
+            # roll back
+            self.rollback()
+            # dump error
+            core_utils.dump_error_message(_logger)
+            # return
+            return None
+
     # release a site
     def release_site(self, site_name, locked_by):
         try:
@@ -5474,6 +6109,47 @@ class DBProxy(object):
             # return
             return False
 
+    # get active workerIDs via batchIDs, returning dict of batchID: list of workerIDs.
+    # workers are limited to submission_host if given, since batchIDs are not unique across batch systems
+    def get_worker_ids_with_batch_ids(self, batch_id_list, chunk_size=500, submission_host=None):
+        try:
+            # get logger
+            tmpLog = core_utils.make_logger(_logger, f"submissionHost={submission_host}", method_name="get_worker_ids_with_batch_ids")
+            tmpLog.debug(f"start for {len(batch_id_list)} batchIDs")
+            retVal = dict()
+            batch_id_list = list(batch_id_list)
+            for iChunk in range(0, len(batch_id_list), chunk_size):
+                varMap = dict()
+                varMap[":st_submitted"] = WorkSpec.ST_submitted
+                varMap[":st_running"] = WorkSpec.ST_running
+                varMap[":st_idle"] = WorkSpec.ST_idle
+                batch_id_var_name_list = []
+                for j, batch_id in enumerate(batch_id_list[iChunk : iChunk + chunk_size]):
+                    batch_id_var_name = f":batchID{j}"
+                    batch_id_var_name_list.append(batch_id_var_name)
+                    varMap[batch_id_var_name] = batch_id
+                # sql to get workers
+                sqlW = f"SELECT batchID,workerID FROM {workTableName} "
+                sqlW += "WHERE batchID IN ({0}) AND status IN (:st_submitted,:st_running,:st_idle) ".format(",".join(batch_id_var_name_list))
+                if submission_host is not None:
+                    sqlW += "AND submissionHost=:submissionHost "
+                    varMap[":submissionHost"] = submission_host
+                self.execute(sqlW, varMap)
+                for batchID, workerID in self.cur.fetchall():
+                    retVal.setdefault(batchID, [])
+                    retVal[batchID].append(workerID)
+            # commit
+            self.commit()
+            tmpLog.debug(f"got workers for {len(retVal)} batchIDs")
+            return retVal
+        except Exception:
+            # roll back
+            self.rollback()
+            # dump error
+            core_utils.dump_error_message(_logger)
+            # return
+            return {}
+
     # get workers via workerID
     def get_workers_from_ids(self, ids):
         try:
@@ -5573,6 +6249,65 @@ class DBProxy(object):
             # return
             return {}
 
+    # get map of workerID and worker with associated PandaIDs for a list of workerIDs. Associated jobs are set as well if with_jobs=True
+    def get_workers_with_ids(self, worker_ids, with_jobs=False):
+        try:
+            # get logger
+            tmpLog = core_utils.make_logger(_logger, method_name="get_workers_with_ids")
+            tmpLog.debug(f"start for {len(worker_ids)} workers")
+            # sql to get workers
+            sqlW = f"SELECT {WorkSpec.column_names()} FROM {workTableName} WHERE workerID IN "
+            # sql to get associated PandaIDs
+            sqlP = f"SELECT workerID,PandaID FROM {jobWorkerTableName} WHERE workerID IN "
+            # sql to get associated jobs
+            sqlJ = f"SELECT jw.workerID,j.{JobSpec.column_names()} FROM {jobWorkerTableName} jw, {jobTableName} j "
+            sqlJ += "WHERE j.PandaID=jw.PandaID AND jw.workerID IN "
+            retVal = dict()
+            for iSlice in range(0, len(worker_ids), 100):
+                varMap = dict()
+                for j, workerID in enumerate(worker_ids[iSlice : iSlice + 100]):
+                    varMap[f":workerID{j}"] = workerID
+                bindStr = ",".join(varMap.keys())
+                self.execute(sqlW + f"({bindStr}) ", varMap)
+                resW = self.cur.fetchall()
+                for resItem in resW:
+                    workSpec = WorkSpec()
+                    workSpec.pack(resItem)
+                    workSpec.pandaid_list = []
+                    if with_jobs:
+                        workSpec.set_jobspec_list([])
+                    retVal[workSpec.workerID] = workSpec
+                if with_jobs:
+                    self.execute(sqlJ + f"({bindStr}) ", varMap)
+                    resJ = self.cur.fetchall()
+                    for resJob in resJ:
+                        tmpWorkerID = resJob[0]
+                        if tmpWorkerID in retVal:
+                            jobSpec = JobSpec()
+                            jobSpec.pack(resJob)
+                            retVal[tmpWorkerID].get_jobspec_list().append(jobSpec)
+                            retVal[tmpWorkerID].pandaid_list.append(jobSpec.PandaID)
+                else:
+                    self.execute(sqlP + f"({bindStr}) ", varMap)
+                    resP = self.cur.fetchall()
+                    for tmpWorkerID, tmpPandaID in resP:
+                        if tmpWorkerID in retVal:
+                            retVal[tmpWorkerID].pandaid_list.append(tmpPandaID)
+                # commit
+                self.commit()
+            for workSpec in retVal.values():
+                if len(workSpec.pandaid_list) > 0:
+                    workSpec.nJobs = len(workSpec.pandaid_list)
+            tmpLog.debug(f"got {len(retVal)} workers")
+            return retVal
+        except Exception:
+            # roll back
+            self.rollback()
+            # dump error
+            core_utils.dump_error_message(_logger)
+            # return
+            return {}
+
     # send kill command to workers by query
     def mark_workers_to_kill_by_query(self, params, delay_seconds=None):
         try:
@@ -5643,29 +6378,46 @@ class DBProxy(object):
 
     # get all active input files
     def get_all_active_input_files(self):
+        try:
+            return set(self.iterate_all_active_input_files())
+        except Exception:
+            # the error was dumped when reading the page
+            return set()
+
+    # generator of LFNs of all active input files
+    @paged("get_active_input_files_page")
+    def iterate_all_active_input_files(self):
+        return iterate_pages(self.get_active_input_files_page)
+
+    # get a page of LFNs of active input files ordered by fileID. last_key is fileID of the previous page
+    def get_active_input_files_page(self, last_key=None):
         try:
             # get logger
-            tmpLog = core_utils.make_logger(_logger, method_name="get_all_active_input_files")
+            tmpLog = core_utils.make_logger(_logger, f"last_key={last_key}", method_name="get_active_input_files_page")
             tmpLog.debug("start")
             # sql to get files
-            sqlF = f"SELECT lfn FROM {fileTableName} "
+            sqlF = f"SELECT fileID,lfn FROM {fileTableName} "
             sqlF += "WHERE fileType IN (:type1,:type2) "
+            sqlF += f"AND fileID>:lastID ORDER BY fileID LIMIT {self.scanBatchSize} "
             # get files
             varMap = dict()
             varMap[":type1"] = "input"
             varMap[":type2"] = FileSpec.AUX_INPUT
+            varMap[":lastID"] = -1 if last_key is None else last_key
             self.execute(sqlF, varMap)
-            ret = set()
-            for (lfn,) in self.cur.fetchall():
-                ret.add(lfn)
+            resF = self.cur.fetchall()
             # commit
             self.commit()
-            tmpLog.debug(f"got {len(ret)} files")
-            return ret
+            retList = [lfn for _, lfn in resF]
+            # key of the next page
+            nextKey = None
+            if len(resF) == self.scanBatchSize:
+                nextKey = resF[-1][0]
+            tmpLog.debug(f"got {len(retList)} files")
+            return retList, nextKey
         except Exception:
             # roll back
             self.rollback()
             # dump error
             core_utils.dump_error_message(_logger)
-            # return
-            return set()
+            raise
@@ -1,39 +1,73 @@
+import functools
 import os
 import queue
 import threading
+import time
 
 from pandaharvester.harvesterconfig import harvester_config
 
 from . import core_utils
-from .db_proxy import DBProxy
+from .db_proxy import DBProxy, iterate_pages
 
 # logger
 _logger = core_utils.setup_logger("db_proxy_pool")
 
+# metrics of waiting time for connections and execution time per method
+metrics_registry = core_utils.MetricsRegistry()
+
 
 # method wrapper
 class DBProxyMethod(object):
     # constructor
-    def __init__(self, method_name, pool):
+    def __init__(self, method_name, pool, replica_pool=None):
         self.methodName = method_name
         self.pool = pool
+        self.replicaPool = replica_pool
 
     # method emulation
     def __call__(self, *args, **kwargs):
+        # use the replica unless it lags behind too much
+        if self.replicaPool is not None and self.replicaPool.is_usable():
+            timeStart = time.monotonic()
+            con = self.replicaPool.get_connection()
+            # use the primary when the replica cannot be connected
+            if con is not None:
+                nErrors = con.nErrors
+                try:
+                    retVal = self._exec(con, self.replicaPool.pool, timeStart, args, kwargs)
+                    isFailed = con.nErrors != nErrors
+                except Exception:
+                    core_utils.dump_error_message(_logger)
+                    isFailed = True
+                self.replicaPool.release_connection(con, isFailed)
+                # read from the primary again when the query failed on the replica
+                if not isFailed:
+                    metrics_registry.increment(self.methodName, "n_replica_calls")
+                    return retVal
+        timeStart = time.monotonic()
+        con = self.pool.get()
+        try:
+            return self._exec(con, self.pool, timeStart, args, kwargs)
+        finally:
+            self.pool.put(con)
+
+    # execute the method with a connection
+    def _exec(self, con, pool, time_start, args, kwargs):
         tmpLog = core_utils.make_logger(_logger, f"method={self.methodName}", method_name="call")
         sw = core_utils.get_stopwatch()
+        timeGot = time.monotonic()
+        metrics_registry.observe(self.methodName, "wait_time", timeGot - time_start)
+        tmpLog.debug(f"got lock. qsize={pool.qsize()} {sw.get_elapsed_time()}")
+        sw.reset()
         try:
-            # get connection
-            con = self.pool.get()
-            tmpLog.debug(f"got lock. qsize={self.pool.qsize()} {sw.get_elapsed_time()}")
-            sw.reset()
             # get function
             func = getattr(con, self.methodName)
             # exec
             return func(*args, **kwargs)
         finally:
+            metrics_registry.observe(self.methodName, "exec_time", time.monotonic() - timeGot)
+            metrics_registry.increment(self.methodName, "n_calls")
             tmpLog.debug("release lock" + sw.get_elapsed_time())
-            self.pool.put(con)
 
 
 # connection class
@@ -60,6 +94,10 @@ class DBProxyPool(object):
         for i in range(harvester_config.db.nConnections):
             con = DBProxy(thr_name=f"{thrName}-{i}", read_only=read_only)
             self.pool.put(con)
+        # pool of connections to the read-only replica
+        self.replicaPool = None
+        if harvester_config.db.engine == "mariadb" and getattr(harvester_config.db, "replicaHost", None):
+            self.replicaPool = DBProxyReplicaPool()
 
     # override __new__ to have a singleton
     def __new__(cls, *args, **kwargs):
@@ -80,7 +118,110 @@ class DBProxyPool(object):
             return object.__getattribute__(self, name)
         except Exception:
             pass
+        # generators over pages read one by one with pooled connections, so that no connection is kept while items are consumed
+        pageMethod = getattr(getattr(DBProxy, name, None), "pageMethod", None)
+        if pageMethod is not None:
+            tmpO = functools.partial(iterate_pages, getattr(self, pageMethod))
+            object.__setattr__(self, name, tmpO)
+            return tmpO
+        # route read-only methods to the replica
+        replicaPool = None
+        if getattr(getattr(DBProxy, name, None), "replicaRead", False):
+            replicaPool = self.replicaPool
         # method object
-        tmpO = DBProxyMethod(name, self.pool)
+        tmpO = DBProxyMethod(name, self.pool, replicaPool)
         object.__setattr__(self, name, tmpO)
         return tmpO
+
+
+# connection pool for the read-only replica
+class DBProxyReplicaPool(DBProxyPool):
+    instance = None
+    lock = threading.Lock()
+
+    # initialize
+    def initialize(self, read_only=False):
+        # install members
+        object.__setattr__(self, "pool", None)
+        self.replicaPool = None
+        # connection pool. connections are opened when they are used for the first time, so that agents start while the replica is down
+        nConnections = getattr(harvester_config.db, "nReplicaConnections", harvester_config.db.nConnections)
+        self.pool = queue.Queue(nConnections)
+        currentThr = threading.current_thread()
+        if currentThr is None:
+            thrID = None
+        else:
+            thrID = currentThr.ident
+        self.thrName = f"{os.getpid()}-{thrID}-replica"
+        self.nOpened = 0
+        for i in range(nConnections):
+            self.pool.put(None)
+        # tolerance of replication lag
+        self.maxLag = getattr(harvester_config.db, "replicaMaxLag", 60)
+        self.lagCheckInterval = getattr(harvester_config.db, "replicaLagCheckInterval", 30)
+        self.lagLock = threading.Lock()
+        self.usable = None
+        self.nextLagCheck = 0
+
+    # get a connection to the replica. None if the replica cannot be connected
+    def get_connection(self):
+        con = self.pool.get()
+        if con is not None:
+            return con
+        try:
+            with self.lagLock:
+                self.nOpened += 1
+                thrName = f"{self.thrName}-{self.nOpened}"
+            return DBProxy(thr_name=thrName, replica=True)
+        except Exception:
+            core_utils.dump_error_message(_logger)
+            self.pool.put(None)
+            self.set_unusable("failed to connect")
+            return None
+
+    # release a connection to the replica. failed connections are closed and opened again when used next time
+    def release_connection(self, con, is_failed):
+        if not is_failed:
+            self.pool.put(con)
+            return
+        for obj in [con.cur, con.con]:
+            try:
+                obj.close()
+            except Exception:
+                pass
+        self.pool.put(None)
+        self.set_unusable("query failed")
+
+    # stop using the replica until the next lag check
+    def set_unusable(self, reason):
+        with self.lagLock:
+            if self.usable is not False:
+                tmpLog = core_utils.make_logger(_logger, method_name="set_unusable")
+                tmpLog.warning(f"use the primary since {reason} on the replica")
+            self.usable = False
+            self.nextLagCheck = time.monotonic() + self.lagCheckInterval
+
+    # check if the replica is usable. replication lag is checked periodically
+    def is_usable(self):
+        with self.lagLock:
+            timeNow = time.monotonic()
+            if timeNow < self.nextLagCheck:
+                return self.usable
+            # other threads use the last result while one thread checks the lag without holding the lock
+            self.nextLagCheck = timeNow + self.lagCheckInterval
+        con = self.get_connection()
+        if con is None:
+            return False
+        nErrors = con.nErrors
+        lag = con.get_replica_lag()
+        self.release_connection(con, con.nErrors != nErrors)
+        usable = lag is not None and lag <= self.maxLag
+        with self.lagLock:
+            if usable != self.usable:
+                tmpLog = core_utils.make_logger(_logger, method_name="is_usable")
+                if usable:
+                    tmpLog.info(f"use the replica with lag={lag} sec")
+                else:
+                    tmpLog.warning(f"use the primary since the replica lag={lag} sec exceeds {self.maxLag} sec or replication is not running")
+            self.usable = usable
+        return usable
@@ -6,7 +6,7 @@ Event spec class
 from future.utils import iteritems
 from past.builtins import long
 
-from .spec_base import SpecBase
+from .spec_base import SpecBase, make_slots
 
 
 class EventSpec(SpecBase):
@@ -22,6 +22,9 @@ class EventSpec(SpecBase):
         "loss:text",
     )
 
+    # use slots instead of __dict__ to reduce memory footprint
+    __slots__ = make_slots(attributesWithTypes)
+
     # constructor
     def __init__(self):
         SpecBase.__init__(self)
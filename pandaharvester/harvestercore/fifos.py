@@ -1,9 +1,14 @@
 import collections
 import datetime
 import json
+import math
 import os
+import random
 import socket
+import struct
+import threading
 import time
+import zlib
 from calendar import timegm
 
 from future.utils import iteritems
@@ -33,6 +38,78 @@ FifoObject = collections.namedtuple("FifoObject", _attribute_list, rename=False)
 # logger
 _logger = core_utils.setup_logger("fifos")
 
+# compact payload of monitor fifo objects. Only workerIDs and work params set by monitor are serialized, and workers are reloaded from DB when dequeued
+# layout version 1 = header(magic, version, length of queueName), queueName, number of sublists,
+# and then the number of workers and workerIDs per sublist
+# layout version 2 = version 1 with workerID followed by values of _compact_work_params per worker, where NaN is missing
+_compact_magic = b"HMFC"
+_compact_version = 2
+_compact_header = struct.Struct("!4sBH")
+_compact_count = struct.Struct("!I")
+_compact_work_params = ("lastCheckAt", "lastForceEnqueueAt", "startFifoPreemptAt")
+_compact_worker = struct.Struct(f"!q{len(_compact_work_params)}d")
+
+
+# encode (queueName, [[workSpec, ...], ...]) to compact payload
+def encode_monitor_payload(item):
+    queue_name, workspec_list = item
+    queue_name_encoded = queue_name.encode()
+    parts = [_compact_header.pack(_compact_magic, _compact_version, len(queue_name_encoded)), queue_name_encoded, _compact_count.pack(len(workspec_list))]
+    for workspecs in workspec_list:
+        parts.append(struct.pack("!H", len(workspecs)))
+        for workspec in workspecs:
+            work_params = workspec.workParams or {}
+            values = [work_params.get(param_name) for param_name in _compact_work_params]
+            parts.append(_compact_worker.pack(workspec.workerID, *[float("nan") if value is None else value for value in values]))
+    return b"".join(parts)
+
+
+# check if serialized item is compact payload
+def is_monitor_payload(item_serialized):
+    return item_serialized[: len(_compact_magic)] == _compact_magic
+
+
+# decode compact payload to (queueName, [[workerID, ...], ...], {workerID: work params})
+def decode_monitor_payload(item_serialized):
+    magic, version, queue_name_length = _compact_header.unpack_from(item_serialized, 0)
+    if version not in (1, _compact_version):
+        raise ValueError(f"unsupported version {version} of monitor fifo payload")
+    offset = _compact_header.size
+    queue_name = item_serialized[offset : offset + queue_name_length].decode()
+    offset += queue_name_length
+    (n_sublists,) = _compact_count.unpack_from(item_serialized, offset)
+    offset += _compact_count.size
+    worker_ids_list = []
+    work_params_map = dict()
+    for _ in range(n_sublists):
+        (n_workers,) = struct.unpack_from("!H", item_serialized, offset)
+        offset += 2
+        if version == 1:
+            worker_ids_list.append(list(struct.unpack_from(f"!{n_workers}q", item_serialized, offset)))
+            offset += 8 * n_workers
+            continue
+        worker_ids = []
+        for _ in range(n_workers):
+            worker_id, *values = _compact_worker.unpack_from(item_serialized, offset)
+            offset += _compact_worker.size
+            worker_ids.append(worker_id)
+            work_params_map[worker_id] = {param_name: value for param_name, value in zip(_compact_work_params, values) if not math.isnan(value)}
+        worker_ids_list.append(worker_ids)
+    return queue_name, worker_ids_list, work_params_map
+
+
+# metrics of fifo operations keyed by fifo name
+fifo_metrics_registry = core_utils.MetricsRegistry()
+
+# reaper threads keyed by fifo name
+_reaper_threads = dict()
+_reaper_threads_lock = threading.Lock()
+
+# indexes of monitor fifo shards claimed by this process
+_claimed_monitor_shards = set()
+_claimed_monitor_shards_lock = threading.Lock()
+
+
 # base class of fifo message queue
 
 
@@ -62,8 +139,10 @@ class FIFOBase(object):
         return core_utils.make_logger(base_log, token=token, method_name=method_name, hook=hook)
 
     # intialize fifo from harvester configuration
-    def _initialize_fifo(self, force_enable=False):
-        self.fifoName = f"{self.titleName}_fifo"
+    def _initialize_fifo(self, force_enable=False, plugin_title_name=None):
+        if plugin_title_name is None:
+            plugin_title_name = self.titleName
+        self.fifoName = f"{plugin_title_name}_fifo"
         self.config = getattr(harvester_config, self.titleName)
         if force_enable:
             self.enabled = True
@@ -73,7 +152,7 @@ class FIFOBase(object):
             self.enabled = False
             return
         pluginConf = vars(self.config).copy()
-        pluginConf.update({"titleName": self.titleName})
+        pluginConf.update({"titleName": plugin_title_name})
         if hasattr(self.config, "fifoModule") and hasattr(self.config, "fifoClass"):
             pluginConf.update(
                 {
@@ -92,6 +171,44 @@ class FIFOBase(object):
             )
         pluginFactory = PluginFactory()
         self.fifo = pluginFactory.get_plugin(pluginConf)
+        fifo_metrics_registry.set_gauge(self.fifoName, "backend", self.fifo.__class__.__name__)
+        self._start_reaper(pluginConf)
+
+    # start a thread to requeue objects dequeued protectively and not deleted within visibility timeout,
+    # once per fifo in the process
+    def _start_reaper(self, plugin_conf):
+        visibility_timeout = getattr(self.config, "fifoVisibilityTimeout", None)
+        if not visibility_timeout or not hasattr(self.fifo, "requeue_expired"):
+            return
+        interval = getattr(self.config, "fifoReaperInterval", min(60, visibility_timeout / 4))
+        with _reaper_threads_lock:
+            if self.fifoName in _reaper_threads:
+                return
+            thr = threading.Thread(target=self._reaper_loop, args=(plugin_conf, interval), name=f"{self.fifoName}_reaper")
+            thr.daemon = True
+            _reaper_threads[self.fifoName] = thr
+            thr.start()
+
+    # loop of reaper thread
+    def _reaper_loop(self, plugin_conf, interval):
+        mainLog = self.make_logger(_logger, f"id={self.fifoName}-{self.get_pid()}", method_name="_reaper_loop")
+        # own plugin instance since connections of some plugins are not thread-safe
+        fifo = PluginFactory().get_plugin(plugin_conf)
+        while True:
+            time.sleep(interval)
+            try:
+                retVal = fifo.requeue_expired()
+                fifo_metrics_registry.increment(self.fifoName, "n_requeued", retVal)
+                if retVal:
+                    mainLog.info(f"requeued {retVal} objects not deleted within visibility timeout")
+            except Exception:
+                core_utils.dump_error_message(mainLog)
+
+    # record latency of an operation and the number of objects
+    def _record_metrics(self, operation, time_start, n_objects=None):
+        fifo_metrics_registry.observe(self.fifoName, f"{operation}_time", time.monotonic() - time_start)
+        if n_objects is not None:
+            fifo_metrics_registry.increment(self.fifoName, f"n_{operation}", n_objects)
 
     # encode
     def encode(self, item):
@@ -107,6 +224,7 @@ class FIFOBase(object):
     def size(self):
         mainLog = self.make_logger(_logger, f"id={self.fifoName}-{self.get_pid()}", method_name="size")
         retVal = self.fifo.size()
+        fifo_metrics_registry.set_gauge(self.fifoName, "size", retVal)
         mainLog.debug(f"size={retVal}")
         return retVal
 
@@ -119,7 +237,9 @@ class FIFOBase(object):
             item_serialized = item
         if score is None:
             score = time.time()
+        time_start = time.monotonic()
         retVal = self.fifo.put(item_serialized, score)
+        self._record_metrics("put", time_start, 1)
         mainLog.debug(f"score={score}")
         return retVal
 
@@ -132,46 +252,98 @@ class FIFOBase(object):
             item_serialized = item
         if score is None:
             score = time.time()
+        time_start = time.monotonic()
         retVal = self.fifo.putbyid(id, item_serialized, score)
+        self._record_metrics("put", time_start, 1)
         mainLog.debug(f"id={id} score={score}")
         return retVal
 
+    # enqueue list of (item, score) in a batch; return number of objects put
+    def putmany(self, item_score_list, encode_item=True):
+        mainLog = self.make_logger(_logger, f"id={self.fifoName}-{self.get_pid()}", method_name="putmany")
+        object_list = []
+        timeNow_timestamp = time.time()
+        for item, score in item_score_list:
+            if encode_item:
+                item_serialized = self.encode(item)
+            else:
+                item_serialized = item
+            if score is None:
+                score = timeNow_timestamp
+            object_list.append((item_serialized, score))
+        time_start = time.monotonic()
+        if not object_list:
+            retVal = 0
+        elif hasattr(self.fifo, "putmany"):
+            retVal = self.fifo.putmany(object_list)
+        else:
+            # plugin without batch enqueue
+            retVal = 0
+            for item_serialized, score in object_list:
+                if self.fifo.put(item_serialized, score) is not False:
+                    retVal += 1
+        self._record_metrics("put", time_start, retVal)
+        mainLog.debug(f"put {retVal}/{len(object_list)} objects")
+        return retVal
+
     # dequeue to get the first fifo object
     def get(self, timeout=None, protective=False, decode_item=True):
         mainLog = self.make_logger(_logger, f"id={self.fifoName}-{self.get_pid()}", method_name="get")
+        time_start = time.monotonic()
         object_tuple = self.fifo.get(timeout, protective)
+        wait_time = core_utils.pop_fifo_get_wait_time()
         if object_tuple is None:
             retVal = None
+            fifo_metrics_registry.increment(self.fifoName, "n_get_empty")
+            if timeout:
+                fifo_metrics_registry.observe(self.fifoName, "get_wait_time", time.monotonic() - time_start)
         else:
+            # time waited for the object is recorded separately from the time to get it
+            if wait_time is not None:
+                fifo_metrics_registry.observe(self.fifoName, "get_wait_time", wait_time)
+                time_start += wait_time
             id, item_serialized, score = object_tuple
             if item_serialized is not None and decode_item:
                 item = self.decode(item_serialized)
             else:
                 item = item_serialized
             retVal = FifoObject(id, item, score)
+            self._record_metrics("get", time_start, 1)
         mainLog.debug(f"called. protective={protective} decode_item={decode_item}")
         return retVal
 
     # dequeue to get the last fifo object
     def getlast(self, timeout=None, protective=False, decode_item=True):
         mainLog = self.make_logger(_logger, f"id={self.fifoName}-{self.get_pid()}", method_name="getlast")
+        time_start = time.monotonic()
         object_tuple = self.fifo.getlast(timeout, protective)
+        wait_time = core_utils.pop_fifo_get_wait_time()
         if object_tuple is None:
             retVal = None
+            fifo_metrics_registry.increment(self.fifoName, "n_get_empty")
+            if timeout:
+                fifo_metrics_registry.observe(self.fifoName, "get_wait_time", time.monotonic() - time_start)
         else:
+            # time waited for the object is recorded separately from the time to get it
+            if wait_time is not None:
+                fifo_metrics_registry.observe(self.fifoName, "get_wait_time", wait_time)
+                time_start += wait_time
             id, item_serialized, score = object_tuple
             if item_serialized is not None and decode_item:
                 item = self.decode(item_serialized)
             else:
                 item = item_serialized
             retVal = FifoObject(id, item, score)
+            self._record_metrics("get", time_start, 1)
         mainLog.debug(f"called. protective={protective} decode_item={decode_item}")
         return retVal
 
     # dequeue list of objects with some conditions
     def getmany(self, mode="first", minscore=None, maxscore=None, count=None, protective=False, temporary=False, decode_item=True):
         mainLog = self.make_logger(_logger, f"id={self.fifoName}-{self.get_pid()}", method_name="getmany")
+        time_start = time.monotonic()
         object_tuple_list = self.fifo.getmany(mode, minscore, maxscore, count, protective, temporary)
+        self._record_metrics("get", time_start, len(object_tuple_list))
         if not object_tuple_list:
             mainLog.debug("empty list")
         ret_list = []
@@ -192,7 +364,9 @@ class FIFOBase(object):
     # If item is large un unnecessary to show int peek, set skip_item=True
     def peek(self, skip_item=False):
         mainLog = self.make_logger(_logger, f"id={self.fifoName}-{self.get_pid()}", method_name="peek")
+        time_start = time.monotonic()
         object_tuple = self.fifo.peek(skip_item=skip_item)
+        self._record_metrics("peek", time_start)
         if object_tuple is None:
             retVal = None
             mainLog.debug("fifo empty")
@@ -210,7 +384,9 @@ class FIFOBase(object):
     # get tuple of the last object and its score without dequeuing
     def peeklast(self, skip_item=False):
         mainLog = self.make_logger(_logger, f"id={self.fifoName}-{self.get_pid()}", method_name="peeklast")
+        time_start = time.monotonic()
         object_tuple = self.fifo.peeklast(skip_item=skip_item)
+        self._record_metrics("peek", time_start)
         if object_tuple is None:
             retVal = None
             mainLog.debug("fifo empty")
@@ -228,7 +404,9 @@ class FIFOBase(object):
     # get tuple of the object by id without dequeuing
     def peekbyid(self, id, temporary=False, skip_item=False):
         mainLog = self.make_logger(_logger, f"id={self.fifoName}-{self.get_pid()}", method_name="peekbyid")
+        time_start = time.monotonic()
         object_tuple = self.fifo.peekbyid(id, temporary, skip_item=skip_item)
+        self._record_metrics("peek", time_start)
         if object_tuple is None:
             retVal = None
             mainLog.debug("fifo empty")
@@ -265,7 +443,9 @@ class FIFOBase(object):
     # delete objects by list of ids from temporary space, return the number of objects successfully deleted
     def delete(self, ids):
         mainLog = self.make_logger(_logger, f"id={self.fifoName}-{self.get_pid()}", method_name="release")
+        time_start = time.monotonic()
         retVal = self.fifo.delete(ids)
+        self._record_metrics("delete", time_start, retVal)
         mainLog.debug(f"released {retVal} objects in {ids}")
         return retVal
 
@@ -279,13 +459,21 @@ class FIFOBase(object):
             mainLog.debug(f"restored objects in {ids}")
         return retVal
 
+    # requeue objects in temporary space with expired deadline, return the number of objects requeued
+    def requeue_expired(self):
+        mainLog = self.make_logger(_logger, f"id={self.fifoName}-{self.get_pid()}", method_name="requeue_expired")
+        retVal = self.fifo.requeue_expired()
+        fifo_metrics_registry.increment(self.fifoName, "n_requeued", retVal)
+        mainLog.debug(f"requeued {retVal} objects")
+        return retVal
+
     # update a object by its id with some conditions
     def update(self, id, item=None, score=None, temporary=None, cond_score="gt"):
         mainLog = self.make_logger(_logger, f"id={self.fifoName}-{self.get_pid()}", method_name="update")
         retVal = self.fifo.update(id, item, score, temporary, cond_score)
         update_report_list = []
         if item is not None:
-            update_report_list.append(f"item={item}")
+            update_report_list.append(f"item_size={len(item)}")
         if score is not None:
             update_report_list.append(f"score={score}")
         if temporary is not None:
@@ -311,6 +499,7 @@ class SpecialFIFOBase(FIFOBase):
         )
         pluginFactory = PluginFactory()
         self.fifo = pluginFactory.get_plugin(pluginConf)
+        fifo_metrics_registry.set_gauge(self.fifoName, "backend", self.fifo.__class__.__name__)
 
 
 # Benchmark fifo
@@ -323,9 +512,143 @@ class MonitorFIFO(FIFOBase):
     titleName = "monitor"
 
     # constructor
-    def __init__(self, **kwarg):
+    def __init__(self, shard_index=None, **kwarg):
         FIFOBase.__init__(self, **kwarg)
-        self._initialize_fifo()
+        self.shardIndex = shard_index
+        if shard_index is None or shard_index == 0:
+            # the first shard shares the unsharded fifo
+            self._initialize_fifo()
+        else:
+            self._initialize_fifo(plugin_title_name=f"{self.titleName}_shard{shard_index}")
+        self.compactPayload = self.enabled and getattr(self.config, "fifoCompactPayload", False)
+        # shards partitioned by hash of computingSite
+        self.shardList = [self]
+        if self.enabled and shard_index is None:
+            nShards = getattr(self.config, "fifoNumShards", 1)
+            if nShards > 1:
+                self.shardList = [MonitorFIFO(shard_index=i) for i in range(nShards)]
+        self._roundRobinIndex = 0
+
+    # check if sharded
+    def is_sharded(self):
+        return len(self.shardList) > 1
+
+    # get the shard for a queue
+    def get_shard(self, queue_name):
+        return self.shardList[zlib.crc32(queue_name.encode()) % len(self.shardList)]
+
+    # size of all shards
+    def size(self):
+        if self.is_sharded():
+            return sum(shard.size() for shard in self.shardList)
+        return FIFOBase.size(self)
+
+    # enqueue to the shard of the queue
+    def put(self, item, score=None, encode_item=True):
+        if self.is_sharded() and encode_item:
+            return self.get_shard(item[0]).put(item, score)
+        return FIFOBase.put(self, item, score, encode_item)
+
+    # enqueue to the shards of the queues
+    def putmany(self, item_score_list, encode_item=True):
+        if not (self.is_sharded() and encode_item):
+            return FIFOBase.putmany(self, item_score_list, encode_item)
+        shard_item_score_dict = collections.defaultdict(list)
+        for item, score in item_score_list:
+            shard_item_score_dict[self.get_shard(item[0]).shardIndex].append((item, score))
+        return sum(self.shardList[shard_index].putmany(shard_item_score_list) for shard_index, shard_item_score_list in iteritems(shard_item_score_dict))
+
+    def claim_shards(self, lock_interval):
+        """
+        Claim shards for this node and renew shards already claimed, up to the number of shards divided by the number of active nodes
+        and fifoMaxShardsPerNode. Nodes renew their heartbeat locks here to be counted as active, so that a node holding more
+        shards than its share releases them for new nodes, and shards of dead nodes are claimed by others after lock_interval.
+        Objects in temporary space of a newly claimed shard are restored only if the previous owner is dead, since a live owner
+        released the shard for rebalancing and still deletes objects in flight.
+        Return list of claimed shards
+        """
+        if not self.is_sharded():
+            return self.shardList
+        mainLog = self.make_logger(_logger, f"id={self.fifoName}-{self.get_pid()}", method_name="claim_shards")
+        locked_by = f"{self.hostname}_{self.os_pid}"
+        nShards = len(self.shardList)
+        # heartbeat of this node and the number of active nodes
+        node_process_name_prefix = f"{self.titleName}_fifo_node_"
+        self.dbProxy.get_process_lock(f"{node_process_name_prefix}{locked_by}", locked_by, lock_interval, renew=True)
+        nNodes = self.dbProxy.get_num_process_locks(f"{node_process_name_prefix}%", lock_interval)
+        if not nNodes:
+            nNodes = 1
+        maxShards = min(getattr(self.config, "fifoMaxShardsPerNode", nShards), math.ceil(nShards / nNodes))
+        retList = []
+        with _claimed_monitor_shards_lock:
+            # shards already claimed first, and then others from a random offset to spread nodes
+            offset = random.randrange(nShards)
+            for shard_index in sorted(range(nShards), key=lambda i: (i not in _claimed_monitor_shards, (i - offset) % nShards)):
+                process_name = f"{self.titleName}_fifo_shard{shard_index}"
+                if len(retList) >= maxShards:
+                    if shard_index in _claimed_monitor_shards:
+                        # expire instead of deleting the lock, so that the next owner knows this node is alive
+                        self.dbProxy.expire_process_lock(process_name, locked_by, lock_interval)
+                        _claimed_monitor_shards.discard(shard_index)
+                    continue
+                shard = self.shardList[shard_index]
+                previous_owner = None
+                if shard_index not in _claimed_monitor_shards:
+                    previous_owner = self.dbProxy.get_process_lock_owner(process_name)
+                if self.dbProxy.get_process_lock(process_name, locked_by, lock_interval, renew=True):
+                    if shard_index not in _claimed_monitor_shards:
+                        if previous_owner is None or not self.dbProxy.get_num_process_locks(f"{node_process_name_prefix}{previous_owner}", lock_interval):
+                            shard.restore()
+                            mainLog.info(f"claimed shard {shard_index} and restored objects left by {previous_owner}")
+                        else:
+                            mainLog.info(f"claimed shard {shard_index} released by {previous_owner}")
+                        _claimed_monitor_shards.add(shard_index)
+                    retList.append(shard)
+                elif shard_index in _claimed_monitor_shards:
+                    _claimed_monitor_shards.discard(shard_index)
+                    mainLog.warning(f"lost shard {shard_index}")
+        mainLog.debug(f"claimed {len(retList)}/{nShards} shards with {nNodes} active nodes")
+        return retList
+
+    def to_check_workers_in_shards(self, shard_list):
+        """
+        Find a shard to dequeue from in round-robin order, so that each shard with workers to check gets its turn
+        Return shard, retVal, overhead_time, where shard is None and overhead_time is of the shard to be checked first
+        if no worker is to be checked
+        """
+        overhead_time_list = []
+        for _ in range(len(shard_list)):
+            shard = shard_list[self._roundRobinIndex % len(shard_list)]
+            self._roundRobinIndex += 1
+            retVal, overhead_time = shard.to_check_workers()
+            if retVal:
+                return shard, retVal, overhead_time
+            if overhead_time is not None:
+                overhead_time_list.append(overhead_time)
+        return None, False, max(overhead_time_list) if overhead_time_list else None
+
+    # encode with compact payload if enabled
+    def encode(self, item):
+        if self.compactPayload:
+            return encode_monitor_payload(item)
+        return FIFOBase.encode(self, item)
+
+    # decode both compact payload and pickle, and reload workers with jobs from DB for compact payload
+    def decode(self, item_serialized):
+        if not is_monitor_payload(item_serialized):
+            return FIFOBase.decode(self, item_serialized)
+        queue_name, worker_ids_list, work_params_map = decode_monitor_payload(item_serialized)
+        workspec_map = self.dbProxy.get_workers_with_ids([worker_id for worker_ids in worker_ids_list for worker_id in worker_ids], with_jobs=True)
+        workspec_list = []
+        for worker_ids in worker_ids_list:
+            # skip workers already deleted
+            workspecs = [workspec_map[worker_id] for worker_id in worker_ids if worker_id in workspec_map]
+            # restore work params set by monitor, which are not always in DB
+            for workspec in workspecs:
+                workspec.set_work_params(work_params_map.get(workspec.workerID))
+            if len(workspecs) > 0:
+                workspec_list.append(workspecs)
+        return queue_name, workspec_list
 
     def populate(self, seconds_ago=0, clear_fifo=False):
         """
@@ -334,7 +657,8 @@ class MonitorFIFO(FIFOBase):
         object in fifo = [(queueName_1, [[worker_1_1], [worker_1_2], ...]), (queueName_2, ...)]
         """
         if clear_fifo:
-            self.fifo.clear()
+            for shard in self.shardList:
+                shard.fifo.clear()
         try:
             fifoMaxWorkersToPopulate = self.config.fifoMaxWorkersToPopulate
         except AttributeError:
@@ -393,6 +717,7 @@ class MonitorFIFO(FIFOBase):
                 else:
                     mainLog.debug("True")
                     mainLog.info(f"Overhead time is {overhead_time:.3f} sec")
+                    fifo_metrics_registry.observe(self.fifoName, "overhead_time", overhead_time)
             else:
                 mainLog.debug("False. Workers too young to check")
                 mainLog.debug(f"Overhead time is {overhead_time:.3f} sec")
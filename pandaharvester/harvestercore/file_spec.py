@@ -3,7 +3,7 @@ File spec class
 
 """
 
-from .spec_base import SpecBase
+from .spec_base import SpecBase, make_slots
 
 
 class FileSpec(SpecBase):
@@ -43,6 +43,9 @@ class FileSpec(SpecBase):
     # attributes initialized with 0
     zeroAttrs = ("attemptNr", "todelete")
 
+    # use slots instead of __dict__ to reduce memory footprint
+    __slots__ = make_slots(attributesWithTypes, ("associatedFiles",))
+
     # constructor
     def __init__(self):
         SpecBase.__init__(self)
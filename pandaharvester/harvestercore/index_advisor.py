@@ -0,0 +1,102 @@
+"""
+index advisor to check query plans of statements issued by hot DBProxy methods
+
+"""
+
+import re
+
+from pandaharvester.harvesterconfig import harvester_config
+
+from . import core_utils
+from .db_proxy import DBProxy
+from .work_spec import WorkSpec
+
+# logger
+_logger = core_utils.setup_logger("index_advisor")
+
+
+# hot methods and representative arguments
+hotMethodList = [
+    ("get_workers_to_update", (100, 600, 600, "index_advisor")),
+    ("get_workers_to_propagate", (100, 600)),
+    ("get_ready_workers", ("ANY_QUEUE", 10)),
+    ("get_queues_to_submit", (10, 600, 600, "index_advisor", 600)),
+    ("get_jobs_to_propagate", (100, 600, 600, "index_advisor")),
+    ("get_jobs_in_sub_status", ("to_transfer", 100, "stagerTime", "stagerLock", 600, 600, "index_advisor", "transferring")),
+    ("get_jobs_in_sub_status", ("fetched", 100, "preparatorTime", "preparatorLock", 600, 600, "index_advisor", "preparing")),
+    ("get_workers_for_cleanup", (100, {WorkSpec.ST_finished: 24})),
+]
+
+
+# normalize SQL to identify unique statements
+def normalize_sql(sql):
+    return re.sub("\\s+", " ", sql).strip()
+
+
+# class to advise indexes
+class IndexAdvisor(object):
+    # constructor
+    def __init__(self, method_list=None):
+        self.methodList = hotMethodList if method_list is None else method_list
+        # dedicated proxy since statements are captured per connection
+        self.dbProxy = DBProxy(thr_name="index_advisor")
+
+    # capture statements issued by a method
+    def capture(self, method_name, args):
+        tmpLog = core_utils.make_logger(_logger, method_name="capture")
+        self.dbProxy.start_capturing_statements()
+        try:
+            retVal = getattr(self.dbProxy, method_name)(*args)
+            # consume generators
+            if hasattr(retVal, "__next__"):
+                for _ in retVal:
+                    pass
+        except Exception:
+            core_utils.dump_error_message(tmpLog)
+        return self.dbProxy.stop_capturing_statements()
+
+    # run hot methods and explain their SELECT statements
+    def explain_hot_methods(self):
+        tmpLog = core_utils.make_logger(_logger, method_name="explain_hot_methods")
+        retList = []
+        doneSet = set()
+        for method_name, args in self.methodList:
+            for sql, varMap in self.capture(method_name, args):
+                normalizedSQL = normalize_sql(sql)
+                if not normalizedSQL.upper().startswith("SELECT") or normalizedSQL in doneSet:
+                    continue
+                doneSet.add(normalizedSQL)
+                try:
+                    plan = self.dbProxy.explain_statement(sql, varMap)
+                except Exception:
+                    core_utils.dump_error_message(tmpLog)
+                    plan = []
+                retList.append({"method": method_name, "sql": normalizedSQL, "plan": plan})
+        return retList
+
+    # get composite indexes declared in spec classes and missing in the database
+    def get_missing_indexes(self):
+        retList = []
+        for _, table_name, indexName, columns in self.dbProxy.get_pending_composite_indexes(0):
+            if indexName not in self.dbProxy.get_index_names(table_name):
+                retList.append({"table": table_name, "index": indexName, "columns": list(columns)})
+        return retList
+
+    # make a report
+    def make_report(self):
+        report = dict()
+        report["engine"] = harvester_config.db.engine
+        report["schema_version"] = self.dbProxy.get_schema_version()
+        report["statements"] = self.explain_hot_methods()
+        report["full_scans"] = [
+            {"method": item["method"], "table": step["table"], "sql": item["sql"]}
+            for item in report["statements"]
+            for step in item["plan"]
+            if step["scan"] == "full scan"
+        ]
+        report["missing_indexes"] = self.get_missing_indexes()
+        return report
+
+    # apply schema migration
+    def migrate(self):
+        return self.dbProxy.migrate_schema()
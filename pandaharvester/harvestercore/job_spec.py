@@ -10,7 +10,7 @@ import json
 from future.utils import iteritems
 from past.builtins import long
 
-from .spec_base import SpecBase
+from .spec_base import SpecBase, make_slots
 
 
 class JobSpec(SpecBase):
@@ -77,6 +77,15 @@ class JobSpec(SpecBase):
     # attributes to skip when slim reading
     skipAttrsToSlim = "jobParams"
 
+    # composite indexes for lookups by preparator and stager
+    compositeIndexes = (
+        (1, ("subStatus", "preparatorTime")),
+        (1, ("subStatus", "stagerTime")),
+    )
+
+    # use slots instead of __dict__ to reduce memory footprint
+    __slots__ = make_slots(attributesWithTypes, ("events", "zipEventMap", "inFiles", "outFiles", "zipFileMap", "workspec_list"))
+
     # constructor
     def __init__(self):
         SpecBase.__init__(self)
@@ -4,6 +4,7 @@ Base class for XyzSpec
 """
 
 import json
+import operator
 import pickle
 
 import rpyc
@@ -32,30 +33,154 @@ def as_python_object(dct):
     return dct
 
 
+# raw value of blob attribute to be decoded at the first access
+class _RawBlob(object):
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+
+# descriptor for blob attribute to decode raw value lazily
+class _BlobAttribute(object):
+    # constructor
+    def __init__(self, name):
+        self.name = name
+        self.storage = f"_blob_{name}"
+
+    # get value
+    def __get__(self, obj, obj_type=None):
+        if obj is None:
+            return self
+        try:
+            val = object.__getattribute__(obj, self.storage)
+        except AttributeError:
+            raise AttributeError(self.name)
+        if type(val) is _RawBlob:
+            try:
+                val = json.loads(val.text, object_hook=as_python_object)
+            except JSONDecodeError:
+                val = val.text
+            object.__setattr__(obj, self.storage, val)
+        return val
+
+    # set value
+    def __set__(self, obj, value):
+        object.__setattr__(obj, self.storage, value)
+
+
+# get column names and values accessible with index from a row of DB query
+def _get_columns(values):
+    if isinstance(values, dict):
+        return tuple(values), tuple(values.values())
+    if hasattr(values, "_fields"):
+        return values._fields, values
+    if hasattr(values, "attributes"):
+        return tuple(values.attributes), values
+    if hasattr(values, "keys"):
+        return tuple(values.keys()), values
+    values = values._asdict()
+    return tuple(values), tuple(values.values())
+
+
+# make names of slots for attributes of a spec class. blob attributes are stored in
+# hidden slots since their names are taken by descriptors
+def make_slots(attributes_with_types, extra_attrs=()):
+    slots = []
+    for attr in attributes_with_types:
+        attr, attrType = attr.split(":")
+        attrType = attrType.split()[0]
+        if attrType in ["blob"]:
+            slots.append(f"_blob_{attr}")
+        else:
+            slots.append(attr)
+    slots += list(extra_attrs)
+    return tuple(slots)
+
+
 # base class for XyzSpec
 class SpecBase(object):
+    # subclasses without __slots__ get __dict__ for their attributes
+    __slots__ = ("changedAttrs",)
+
     # to be set
     attributesWithTypes = ()
     zeroAttrs = ()
     skipAttrsToSlim = ()
+    # composite indexes made by schema migration, as tuples of (schema version, column names)
+    compositeIndexes = ()
 
-    # constructor
-    def __init__(self):
-        # remove types
-        object.__setattr__(self, "attributes", [])
-        object.__setattr__(self, "serializedAttrs", set())
-        for attr in self.attributesWithTypes:
+    # make class-level metadata once when a spec class is defined
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        attributes = []
+        serializedAttrs = set()
+        initialValues = []
+        for attr in cls.attributesWithTypes:
             attr, attrType = attr.split(":")
             attrType = attrType.split()[0]
-            self.attributes.append(attr)
+            attributes.append(attr)
             if attrType in ["blob"]:
-                self.serializedAttrs.add(attr)
-        # install attributes
-        for attr in self.attributes:
-            if attr in self.zeroAttrs:
-                object.__setattr__(self, attr, 0)
+                serializedAttrs.add(attr)
+            if attr in cls.zeroAttrs:
+                initialValues.append((attr, 0))
             else:
-                object.__setattr__(self, attr, None)
+                initialValues.append((attr, None))
+        cls.attributes = tuple(attributes)
+        cls.serializedAttrs = frozenset(serializedAttrs)
+        cls._initialValues = tuple(initialValues)
+        # names of slots to be pickled
+        slotNames = []
+        for klass in reversed(cls.__mro__):
+            slots = klass.__dict__.get("__slots__", ())
+            if isinstance(slots, str):
+                slots = (slots,)
+            for name in slots:
+                if name not in ["changedAttrs", "__dict__", "__weakref__"] and name not in slotNames:
+                    slotNames.append(name)
+        cls._slotNames = tuple(slotNames)
+        # unpackers for pack() keyed by column names of rows
+        cls._unpackers = dict()
+        # install descriptors to decode blob attributes at the first access
+        for attr in serializedAttrs:
+            setattr(cls, attr, _BlobAttribute(attr))
+
+    # make unpacker which maps column indexes of rows to attributes
+    @classmethod
+    def _make_unpacker(cls, column_names, slim):
+        columnIndexes = dict()
+        for idx, columnName in enumerate(column_names):
+            columnIndexes.setdefault(columnName, idx)
+            columnIndexes.setdefault(columnName.lower(), idx)
+        plainAttrs = []
+        plainIndexes = []
+        blobAttrs = []
+        skippedAttrs = []
+        for attr in cls.attributes:
+            if slim and attr in cls.skipAttrsToSlim:
+                skippedAttrs.append(attr)
+                continue
+            idx = columnIndexes.get(attr, columnIndexes.get(attr.lower()))
+            # attributes not in the query are left untouched
+            if idx is None:
+                continue
+            if attr in cls.serializedAttrs:
+                blobAttrs.append((f"_blob_{attr}", idx))
+            else:
+                plainAttrs.append(attr)
+                plainIndexes.append(idx)
+        # getter for plain attributes
+        if len(plainIndexes) == 0:
+            plainGetter = None
+        else:
+            plainGetter = operator.itemgetter(*plainIndexes)
+        return tuple(plainAttrs), plainGetter, tuple(blobAttrs), tuple(skippedAttrs)
+
+    # constructor
+    def __init__(self):
+        # install attributes
+        for attr, val in self._initialValues:
+            object.__setattr__(self, attr, val)
         # map of changed attributes
         object.__setattr__(self, "changedAttrs", {})
 
@@ -70,14 +195,29 @@ class SpecBase(object):
 
     # keep state for pickle
     def __getstate__(self):
-        odict = self.__dict__.copy()
-        del odict["changedAttrs"]
+        odict = dict()
+        for name in self._slotNames:
+            try:
+                odict[name] = object.__getattribute__(self, name)
+            except AttributeError:
+                pass
+        if hasattr(self, "__dict__"):
+            odict.update(self.__dict__)
+        # use decoded values of blob attributes
+        for attr in self.serializedAttrs:
+            storage = f"_blob_{attr}"
+            if storage in odict:
+                del odict[storage]
+                odict[attr] = getattr(self, attr)
         return odict
 
     # restore state from the unpickled state values
     def __setstate__(self, state):
         self.__init__()
         for k, v in state.items():
+            # metadata which used to be pickled per instance
+            if k in ["attributes", "serializedAttrs"]:
+                continue
             object.__setattr__(self, k, v)
 
     # reset changed attribute list
@@ -98,21 +238,31 @@ class SpecBase(object):
     def has_updated_attributes(self):
         return len(self.changedAttrs) > 0
 
-    # pack into attributes
+    # pack into attributes. blob attributes are decoded at the first access
     def pack(self, values, slim=False):
-        if hasattr(values, "_asdict"):
-            values = values._asdict()
-        for attr in self.attributes:
-            if slim and attr in self.skipAttrsToSlim:
-                val = None
+        columnNames, values = _get_columns(values)
+        # get unpacker for the column set
+        unpackerKey = (columnNames, slim)
+        try:
+            unpacker = self._unpackers[unpackerKey]
+        except KeyError:
+            unpacker = self._make_unpacker(columnNames, slim)
+            self._unpackers[unpackerKey] = unpacker
+        plainAttrs, plainGetter, blobAttrs, skippedAttrs = unpacker
+        setter = object.__setattr__
+        if plainGetter is not None:
+            if len(plainAttrs) == 1:
+                setter(self, plainAttrs[0], plainGetter(values))
             else:
-                val = values[attr]
-                if attr in self.serializedAttrs and val is not None:
-                    try:
-                        val = json.loads(val, object_hook=as_python_object)
-                    except JSONDecodeError:
-                        pass
-            object.__setattr__(self, attr, val)
+                for attr, val in zip(plainAttrs, plainGetter(values)):
+                    setter(self, attr, val)
+        for storage, idx in blobAttrs:
+            val = values[idx]
+            if val is not None:
+                val = _RawBlob(val)
+            setter(self, storage, val)
+        for attr in skippedAttrs:
+            setter(self, attr, None)
 
     # set blob attribute
     def set_blob_attribute(self, key, val):
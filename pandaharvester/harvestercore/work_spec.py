@@ -10,7 +10,7 @@ import re
 from future.utils import iteritems
 from pandaharvester.harvesterconfig import harvester_config
 
-from .spec_base import SpecBase
+from .spec_base import SpecBase, make_slots
 
 
 # work spec
@@ -94,6 +94,19 @@ class WorkSpec(SpecBase):
     # attributes to skip when slim reading
     skipAttrsToSlim = ("workParams", "workAttributes")
 
+    # composite indexes for lookups by monitor and submitter
+    compositeIndexes = (
+        (1, ("status", "modificationTime")),
+        (1, ("computingSite", "status")),
+        (2, ("batchID", "status")),
+    )
+
+    # attributes which are not in the table
+    extraAttrs = ("isNew", "nextLookup", "jobspec_list", "pandaid_list", "new_status", "pilot_closed")
+
+    # use slots instead of __dict__ to reduce memory footprint
+    __slots__ = make_slots(attributesWithTypes, extraAttrs)
+
     # constructor
     def __init__(self):
         SpecBase.__init__(self)
@@ -0,0 +1,354 @@
+import atexit
+import heapq
+import os
+import pickle
+import re
+import threading
+import time
+
+from pandaharvester.harvesterconfig import harvester_config
+from pandaharvester.harvestercore import core_utils
+from pandaharvester.harvestercore.plugin_base import PluginBase
+
+# logger
+_logger = core_utils.setup_logger("memory_fifo")
+
+
+# store of objects shared by all fifo instances of the same title in the process
+class MemoryStore(object):
+    # constructor
+    def __init__(self, snapshot_path=None, snapshot_interval=None):
+        self.condition = threading.Condition()
+        # id -> [item, score, temporary, version, deadline]
+        self.objects = dict()
+        # heaps of (score, id, version) and (-score, -id, version) with stale entries skipped lazily
+        self.first_heap = []
+        self.last_heap = []
+        self.last_id = 0
+        self.snapshot_path = snapshot_path
+        self.dirty = False
+        if snapshot_path is not None:
+            self.load_snapshot()
+            if snapshot_interval:
+                thr = threading.Thread(target=self.snapshot_loop, args=(snapshot_interval,), name=f"memory_fifo_snapshot-{os.path.basename(snapshot_path)}")
+                thr.daemon = True
+                thr.start()
+            atexit.register(self.write_snapshot)
+
+    # push heap entries of an object, to be called with the lock
+    def push_entries(self, id, obj):
+        obj[3] += 1
+        heapq.heappush(self.first_heap, (obj[1], id, obj[3]))
+        heapq.heappush(self.last_heap, (-obj[1], -id, obj[3]))
+        # compact heaps when stale entries dominate
+        if len(self.first_heap) > 2 * len(self.objects) + 1000:
+            self.rebuild_heaps()
+
+    # rebuild heaps with valid entries, to be called with the lock
+    def rebuild_heaps(self):
+        self.first_heap = [(obj[1], id, obj[3]) for id, obj in self.objects.items() if not obj[2]]
+        self.last_heap = [(-obj[1], -id, obj[3]) for id, obj in self.objects.items() if not obj[2]]
+        heapq.heapify(self.first_heap)
+        heapq.heapify(self.last_heap)
+
+    # get id of the first or last object in the queue, to be called with the lock
+    def head_id(self, mode="first"):
+        heap = self.first_heap if mode == "first" else self.last_heap
+        while heap:
+            score, id, version = heap[0]
+            if mode == "last":
+                id = -id
+            obj = self.objects.get(id)
+            if obj is not None and not obj[2] and obj[3] == version:
+                return id
+            heapq.heappop(heap)
+        return None
+
+    # add an object, to be called with the lock
+    def add(self, id, item, score):
+        obj = [item, score, 0, 0, None]
+        self.objects[id] = obj
+        self.last_id = max(self.last_id, id)
+        self.push_entries(id, obj)
+        self.dirty = True
+
+    # load snapshot
+    def load_snapshot(self):
+        tmpLog = core_utils.make_logger(_logger, f"path={self.snapshot_path}", method_name="load_snapshot")
+        if not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                last_id, object_list = pickle.load(f)
+        except Exception:
+            core_utils.dump_error_message(tmpLog)
+            return
+        with self.condition:
+            for id, item, score, temporary, deadline in object_list:
+                self.objects[id] = [item, score, temporary, 0, deadline]
+            self.last_id = max(self.last_id, last_id)
+            self.rebuild_heaps()
+        tmpLog.debug(f"loaded {len(object_list)} objects")
+
+    # write snapshot to a temporary file and then rename it
+    def write_snapshot(self):
+        tmpLog = core_utils.make_logger(_logger, f"path={self.snapshot_path}", method_name="write_snapshot")
+        with self.condition:
+            if not self.dirty:
+                return
+            object_list = [(id, obj[0], obj[1], obj[2], obj[4]) for id, obj in self.objects.items()]
+            last_id = self.last_id
+            self.dirty = False
+        tmp_path = f"{self.snapshot_path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump((last_id, object_list), f, -1)
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception:
+            self.dirty = True
+            core_utils.dump_error_message(tmpLog)
+
+    # write snapshots periodically
+    def snapshot_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            self.write_snapshot()
+
+
+# stores keyed by title
+_stores = dict()
+_stores_lock = threading.Lock()
+
+
+class MemoryFifo(PluginBase):
+    # constructor
+    def __init__(self, **kwarg):
+        PluginBase.__init__(self, **kwarg)
+        if not hasattr(self, "snapshotFilename"):
+            self.snapshotFilename = getattr(harvester_config.fifo, "snapshotFilename", None) if hasattr(harvester_config, "fifo") else None
+        # objects dequeued protectively are requeued if not deleted within visibility timeout in sec
+        if not hasattr(self, "fifoVisibilityTimeout"):
+            self.fifoVisibilityTimeout = None
+        if not hasattr(self, "snapshotInterval"):
+            self.snapshotInterval = getattr(harvester_config.fifo, "snapshotInterval", 60) if hasattr(harvester_config, "fifo") else 60
+        snapshot_path = None
+        if self.snapshotFilename:
+            _filename = re.sub("\$\(TITLE\)", self.titleName, self.snapshotFilename)
+            _filename = re.sub("\$\(AGENT\)", self.titleName, _filename)
+            snapshot_path = os.path.abspath(_filename)
+        with _stores_lock:
+            if self.titleName not in _stores:
+                _stores[self.titleName] = MemoryStore(snapshot_path, self.snapshotInterval)
+            self.store = _stores[self.titleName]
+
+    def __len__(self):
+        with self.store.condition:
+            return len(self.store.objects)
+
+    def __iter__(self):
+        with self.store.condition:
+            item_list = [obj[0] for obj in self.store.objects.values()]
+        for item in item_list:
+            yield item
+
+    # take out an object, to be called with the lock
+    def _take(self, id, protective):
+        obj = self.store.objects[id]
+        if protective:
+            obj[2] = 1
+            if self.fifoVisibilityTimeout:
+                obj[4] = time.time() + self.fifoVisibilityTimeout
+        else:
+            del self.store.objects[id]
+        self.store.dirty = True
+        return (id, obj[0], obj[1])
+
+    def _pop(self, timeout=None, protective=False, mode="first"):
+        start_timestamp = time.time()
+        with self.store.condition:
+            while True:
+                id = self.store.head_id(mode)
+                if id is not None:
+                    core_utils.set_fifo_get_wait_time(time.time() - start_timestamp)
+                    return self._take(id, protective)
+                if timeout is None:
+                    return None
+                remaining_time = timeout - (time.time() - start_timestamp)
+                if remaining_time <= 0:
+                    return None
+                self.store.condition.wait(remaining_time)
+
+    # get objects sorted by score with some conditions, to be called with the lock
+    def _select(self, mode="first", minscore=None, maxscore=None, count=None, temporary=False):
+        ret_list = []
+        for id, obj in self.store.objects.items():
+            if bool(obj[2]) != temporary:
+                continue
+            if minscore is not None and obj[1] < minscore:
+                continue
+            if maxscore is not None and obj[1] > maxscore:
+                continue
+            ret_list.append((obj[1], id))
+        ret_list.sort(reverse=(mode == "last"))
+        if count is not None:
+            ret_list = ret_list[: int(count)]
+        return [id for score, id in ret_list]
+
+    # number of objects in queue
+    def size(self):
+        return len(self)
+
+    # enqueue with priority score
+    def put(self, item, score):
+        with self.store.condition:
+            self.store.add(self.store.last_id + 1, item, score)
+            self.store.condition.notify_all()
+        return True
+
+    # enqueue list of (item, score)
+    def putmany(self, item_score_list):
+        n_obj = 0
+        with self.store.condition:
+            for item, score in item_score_list:
+                self.store.add(self.store.last_id + 1, item, score)
+                n_obj += 1
+            self.store.condition.notify_all()
+        return n_obj
+
+    # enqueue by id
+    def putbyid(self, id, item, score):
+        with self.store.condition:
+            if id in self.store.objects:
+                return False
+            self.store.add(id, item, score)
+            self.store.condition.notify_all()
+        return True
+
+    # dequeue the first object
+    def get(self, timeout=None, protective=False):
+        return self._pop(timeout=timeout, protective=protective, mode="first")
+
+    # dequeue the last object
+    def getlast(self, timeout=None, protective=False):
+        return self._pop(timeout=timeout, protective=protective, mode="last")
+
+    # dequeue list of objects with some conditions
+    def getmany(self, mode="first", minscore=None, maxscore=None, count=None, protective=False, temporary=False):
+        with self.store.condition:
+            if temporary or (mode == "first" and minscore is not None) or (mode == "last" and maxscore is not None):
+                ids = self._select(mode, minscore, maxscore, count, temporary)
+                return [self._take(id, protective) for id in ids]
+            # take objects from the head of the queue
+            ret_list = []
+            while count is None or len(ret_list) < count:
+                id = self.store.head_id(mode)
+                if id is None:
+                    break
+                score = self.store.objects[id][1]
+                if (maxscore is not None and score > maxscore) or (minscore is not None and score < minscore):
+                    break
+                ret_list.append(self._take(id, protective))
+            return ret_list
+
+    # get tuple of (id, item, score) of the first object without dequeuing it
+    def peek(self, skip_item=False):
+        return self._peek(mode="first", skip_item=skip_item)
+
+    # get tuple of (id, item, score) of the last object without dequeuing it
+    def peeklast(self, skip_item=False):
+        return self._peek(mode="last", skip_item=skip_item)
+
+    # get tuple of (id, item, score) of object by id without dequeuing it
+    def peekbyid(self, id, temporary=False, skip_item=False):
+        return self._peek(mode="id", id=id, temporary=temporary, skip_item=skip_item)
+
+    def _peek(self, mode="first", id=None, temporary=False, skip_item=False):
+        with self.store.condition:
+            if mode != "id":
+                id = self.store.head_id(mode)
+            obj = self.store.objects.get(id)
+            if obj is None or bool(obj[2]) != temporary:
+                return None
+            return (id, None if skip_item else obj[0], obj[1])
+
+    # get list of tuples of (id, item, score) without dequeuing them
+    def peekmany(self, mode="first", minscore=None, maxscore=None, count=None, skip_item=False):
+        with self.store.condition:
+            ids = self._select(mode, minscore, maxscore, count)
+            return [(id, None if skip_item else self.store.objects[id][0], self.store.objects[id][1]) for id in ids]
+
+    # drop all objects in queue
+    def clear(self):
+        with self.store.condition:
+            self.store.objects.clear()
+            self.store.first_heap = []
+            self.store.last_heap = []
+            self.store.last_id = 0
+            self.store.dirty = True
+
+    # delete objects by list of id
+    def delete(self, ids):
+        if isinstance(ids, (list, tuple)):
+            n_row = 0
+            with self.store.condition:
+                for id in ids:
+                    if self.store.objects.pop(id, None) is not None:
+                        n_row += 1
+                self.store.dirty = True
+            return n_row
+        else:
+            raise TypeError("ids should be list or tuple")
+
+    # Move objects in temporary space to the queue
+    def restore(self, ids):
+        with self.store.condition:
+            if ids is None:
+                ids = [id for id, obj in self.store.objects.items() if obj[2]]
+            elif not isinstance(ids, (list, tuple)):
+                raise TypeError("ids should be list or tuple or None")
+            for id in ids:
+                obj = self.store.objects.get(id)
+                if obj is not None and obj[2]:
+                    obj[2] = 0
+                    obj[4] = None
+                    self.store.push_entries(id, obj)
+            self.store.dirty = True
+            self.store.condition.notify_all()
+
+    # move objects in temporary space with expired deadline to the queue, and return the number of objects
+    def requeue_expired(self):
+        timeNow_timestamp = time.time()
+        with self.store.condition:
+            ids = [id for id, obj in self.store.objects.items() if obj[2] and obj[4] is not None and obj[4] < timeNow_timestamp]
+            if ids:
+                self.restore(ids)
+        return len(ids)
+
+    # update a object by its id with some conditions
+    def update(self, id, item=None, score=None, temporary=None, cond_score=None):
+        cond_score_func_map = {
+            "gt": lambda old_score: old_score < score,
+            "ge": lambda old_score: old_score <= score,
+            "lt": lambda old_score: old_score > score,
+            "le": lambda old_score: old_score >= score,
+        }
+        if item is None and score is None and temporary is None:
+            return False
+        with self.store.condition:
+            obj = self.store.objects.get(id)
+            if obj is None:
+                return False
+            if cond_score in cond_score_func_map and (score is None or not cond_score_func_map[cond_score](obj[1])):
+                return False
+            if item is not None:
+                obj[0] = item
+            if score is not None:
+                obj[1] = score
+            if temporary is not None:
+                obj[2] = temporary
+                obj[4] = None
+            if not obj[2]:
+                self.store.push_entries(id, obj)
+            self.store.dirty = True
+            self.store.condition.notify_all()
+        return True
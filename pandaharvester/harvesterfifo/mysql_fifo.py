@@ -19,6 +19,13 @@ class MysqlFifo(PluginBase):
             self.reconnectTimeout = harvester_config.db.reconnectTimeout
         PluginBase.__init__(self, **kwarg)
         self.tableName = f"{self.titleName}_FIFO"
+        # getters wait for notification by putters in the same process instead of sleeping between polls
+        if not hasattr(self, "blockingDequeue"):
+            self.blockingDequeue = getattr(harvester_config.fifo, "blockingDequeue", False) if hasattr(harvester_config, "fifo") else False
+        self.notifier = core_utils.get_fifo_notifier(f"mysql:{self.tableName}")
+        # objects dequeued protectively are requeued if not deleted within visibility timeout in sec
+        if not hasattr(self, "fifoVisibilityTimeout"):
+            self.fifoVisibilityTimeout = None
         # get connection, cursor and error types
         self._connect_db()
         # create table for fifo
@@ -153,10 +160,20 @@ class MysqlFifo(PluginBase):
             "  item LONGBLOB,"
             "  score DOUBLE,"
             "  temporary TINYINT DEFAULT 0,"
+            "  deadline DOUBLE,"
             "  PRIMARY KEY (id) "
             ")"
         ).format(table_name=self.tableName)
         self.execute(sql_make_table)
+        # add deadline column to tables made by old versions
+        sql_add_deadline = f"ALTER TABLE {self.tableName} ADD COLUMN IF NOT EXISTS deadline DOUBLE"
+        self.execute(sql_add_deadline)
+
+    # get deadline of objects dequeued protectively
+    def _get_deadline(self):
+        if self.fifoVisibilityTimeout:
+            return time.time() + self.fifoVisibilityTimeout
+        return None
 
     # make index
     def _make_index(self):
@@ -181,7 +198,7 @@ class MysqlFifo(PluginBase):
     def _pop(self, timeout=None, protective=False, mode="first"):
         sql_pop_get_first = f"SELECT id, item, score FROM {self.tableName} WHERE temporary = 0 ORDER BY score LIMIT 1 "
         sql_pop_get_last = f"SELECT id, item, score FROM {self.tableName} WHERE temporary = 0 ORDER BY score DESC LIMIT 1 "
-        sql_pop_to_temp = f"UPDATE {self.tableName} SET temporary = 1 WHERE id = %s AND temporary = 0 "
+        sql_pop_to_temp = f"UPDATE {self.tableName} SET temporary = 1, deadline = %s WHERE id = %s AND temporary = 0 "
         sql_pop_del = f"DELETE FROM {self.tableName} WHERE id = %s AND temporary = 0 "
         mode_sql_map = {
             "first": sql_pop_get_first,
@@ -197,16 +214,17 @@ class MysqlFifo(PluginBase):
         id = None
         last_attempt_timestamp = time.time()
         while keep_polling:
+            attempt_timestamp = time.time()
+            notified_version = self.notifier.version
             try:
                 self.execute(sql_pop_get)
                 res = self.cur.fetchall()
                 if len(res) > 0:
                     id, item, score = res[0]
-                    params = (id,)
                     if protective:
-                        self.execute(sql_pop_to_temp, params)
+                        self.execute(sql_pop_to_temp, (self._get_deadline(), id))
                     else:
-                        self.execute(sql_pop_del, params)
+                        self.execute(sql_pop_del, (id,))
                     n_row = self.cur.rowcount
                     self.commit()
                     if n_row >= 1:
@@ -217,14 +235,20 @@ class MysqlFifo(PluginBase):
             else:
                 if got_object:
                     keep_polling = False
+                    core_utils.set_fifo_get_wait_time(attempt_timestamp - last_attempt_timestamp)
                     return (id, item, score)
             now_timestamp = time.time()
             if timeout is None or (now_timestamp - last_attempt_timestamp) >= timeout:
                 keep_polling = False
                 if _exc is not None:
                     raise _exc
+                continue
             tries += 1
-            time.sleep(wait)
+            if self.blockingDequeue:
+                # wake up as soon as objects are put in the same process. Objects put by other processes are found by polling
+                self.notifier.wait(notified_version, min(wait, timeout - (now_timestamp - last_attempt_timestamp)))
+            else:
+                time.sleep(wait)
             wait = min(max_wait, tries / 10.0 + wait)
         return None
 
@@ -284,6 +308,7 @@ class MysqlFifo(PluginBase):
         if temporary is not None:
             attr_set_list.append("temporary = %s")
             params.append(temporary)
+            attr_set_list.append("deadline = NULL")
         attr_set_str = " , ".join(attr_set_list)
         if not attr_set_str:
             return False
@@ -323,6 +348,20 @@ class MysqlFifo(PluginBase):
         except Exception as _e:
             self.rollback()
             raise _e
+        self.notifier.notify()
+
+    # enqueue list of (item, score) with one multi-row insert
+    def putmany(self, item_score_list):
+        sql_push = f"INSERT INTO {self.tableName} (item, score) VALUES (%s, %s) "
+        try:
+            self.executemany(sql_push, list(item_score_list))
+            n_row = self.cur.rowcount
+            self.commit()
+        except Exception as _e:
+            self.rollback()
+            raise _e
+        self.notifier.notify()
+        return n_row
 
     # enqueue by id
     def putbyid(self, id, item, score):
@@ -333,6 +372,7 @@ class MysqlFifo(PluginBase):
             self.rollback()
             raise _e
         else:
+            self.notifier.notify()
             return retVal
 
     # dequeue the first object
@@ -363,7 +403,7 @@ class MysqlFifo(PluginBase):
             rank=mode_rank_map[mode],
             count_str=count_str,
         )
-        sql_pop_to_temp = f"UPDATE {self.tableName} SET temporary = 1 WHERE id = %s AND temporary = 0 "
+        sql_pop_to_temp = f"UPDATE {self.tableName} SET temporary = 1, deadline = %s WHERE id = %s AND temporary = 0 "
         sql_pop_del = f"DELETE FROM {self.tableName} WHERE id = %s AND temporary = {1 if temporary else 0} "
         ret_list = []
         try:
@@ -372,11 +412,10 @@ class MysqlFifo(PluginBase):
             for _rec in res:
                 got_object = False
                 id, item, score = _rec
-                params = (id,)
                 if protective:
-                    self.execute(sql_pop_to_temp, params)
+                    self.execute(sql_pop_to_temp, (self._get_deadline(), id))
                 else:
-                    self.execute(sql_pop_del, params)
+                    self.execute(sql_pop_del, (id,))
                 n_row = self.cur.rowcount
                 self.commit()
                 if n_row >= 1:
@@ -470,18 +509,35 @@ class MysqlFifo(PluginBase):
     # Move objects in temporary space to the queue
     def restore(self, ids):
         if ids is None:
-            sql_restore = f"UPDATE {self.tableName} SET temporary = 0 WHERE temporary != 0 "
+            sql_restore = f"UPDATE {self.tableName} SET temporary = 0, deadline = NULL WHERE temporary != 0 "
+            params = None
         elif isinstance(ids, (list, tuple)):
             placeholders_str = ",".join([" %s"] * len(ids))
-            sql_restore = f"UPDATE {self.tableName} SET temporary = 0 WHERE temporary != 0 AND id in ({placeholders_str} ) "
+            sql_restore = f"UPDATE {self.tableName} SET temporary = 0, deadline = NULL WHERE temporary != 0 AND id in ({placeholders_str} ) "
+            params = ids
         else:
             raise TypeError("ids should be list or tuple or None")
         try:
-            self.execute(sql_restore)
+            self.execute(sql_restore, params)
+            self.commit()
+        except Exception as _e:
+            self.rollback()
+            raise _e
+        self.notifier.notify()
+
+    # move objects in temporary space with expired deadline to the queue, and return the number of objects
+    def requeue_expired(self):
+        sql_requeue = f"UPDATE {self.tableName} SET temporary = 0, deadline = NULL WHERE temporary != 0 AND deadline IS NOT NULL AND deadline < %s "
+        try:
+            self.execute(sql_requeue, (time.time(),))
+            n_row = self.cur.rowcount
             self.commit()
         except Exception as _e:
             self.rollback()
             raise _e
+        if n_row > 0:
+            self.notifier.notify()
+        return n_row
 
     # update a object by its id with some conditions
     def update(self, id, item=None, score=None, temporary=None, cond_score=None):
@@ -492,4 +548,5 @@ class MysqlFifo(PluginBase):
             self.rollback()
             raise _e
         else:
+            self.notifier.notify()
             return retVal
@@ -5,6 +5,7 @@ import time
 
 import redis
 from pandaharvester.harvesterconfig import harvester_config
+from pandaharvester.harvestercore import core_utils
 from pandaharvester.harvestercore.plugin_base import PluginBase
 
 
@@ -37,6 +38,11 @@ class RedisFifo(PluginBase):
         self.id_score = f"{self.titleName}-fifo_id-score"
         self.id_item = f"{self.titleName}-fifo_id-item"
         self.id_temp = f"{self.titleName}-fifo_id-temp"
+        self.id_temp_score = f"{self.titleName}-fifo_id-temp-score"
+        self.id_deadline = f"{self.titleName}-fifo_id-deadline"
+        # objects dequeued protectively are requeued if not deleted within visibility timeout in sec
+        if not hasattr(self, "fifoVisibilityTimeout"):
+            self.fifoVisibilityTimeout = None
 
     def __len__(self):
         return self.qconn.zcard(self.id_score)
@@ -56,7 +62,10 @@ class RedisFifo(PluginBase):
             resVal = self.qconn.sismember(self.id_temp, id)
             if (mode == "id" and not resVal) or (mode == "idtemp" and resVal):
                 id_gotten = id
-                score = self.qconn.zscore(self.id_score, id)
+                if mode == "idtemp":
+                    score = self.qconn.zscore(self.id_temp_score, id)
+                else:
+                    score = self.qconn.zscore(self.id_score, id)
             else:
                 id_gotten, score = None, None
         if skip_item:
@@ -68,6 +77,12 @@ class RedisFifo(PluginBase):
         else:
             return (id_gotten, item, score)
 
+    # set deadline of objects dequeued protectively in pipeline
+    def _set_deadline(self, pipeline, ids):
+        if self.fifoVisibilityTimeout:
+            deadline = time.time() + self.fifoVisibilityTimeout
+            pipeline.execute_command("ZADD", self.id_deadline, *[arg for id in ids for arg in (deadline, id)])
+
     def _pop(self, timeout=None, protective=False, mode="first"):
         keep_polling = True
         wait = 0.1
@@ -76,6 +91,7 @@ class RedisFifo(PluginBase):
         last_attempt_timestamp = time.time()
         id, item, score = None, None, None
         while keep_polling:
+            attempt_timestamp = time.time()
             peeked_tuple = self._peek(mode=mode)
             if peeked_tuple is None:
                 time.sleep(wait)
@@ -88,10 +104,13 @@ class RedisFifo(PluginBase):
                             pipeline.watch(self.id_score, self.id_item, self.id_temp)
                             pipeline.multi()
                             if protective:
+                                self._set_deadline(pipeline, [id])
+                                pipeline.execute_command("ZADD", self.id_temp_score, score, id)
                                 pipeline.sadd(self.id_temp, id)
                                 pipeline.zrem(self.id_score, id)
                             else:
                                 pipeline.srem(self.id_temp, id)
+                                pipeline.zrem(self.id_temp_score, id)
                                 pipeline.hdel(self.id_item, id)
                                 pipeline.zrem(self.id_score, id)
                             resVal = pipeline.execute()
@@ -100,6 +119,7 @@ class RedisFifo(PluginBase):
                     else:
                         break
                 if resVal[-2] == 1 and resVal[-1] == 1:
+                    core_utils.set_fifo_get_wait_time(attempt_timestamp - last_attempt_timestamp)
                     break
             tries += 1
             now_timestamp = time.time()
@@ -138,6 +158,38 @@ class RedisFifo(PluginBase):
             time.sleep(0.0001)
         return False
 
+    # enqueue list of (item, score) in one transaction
+    def putmany(self, item_score_list):
+        item_score_list = list(item_score_list)
+        if not item_score_list:
+            return 0
+        generate_id_attempt_timestamp = time.time()
+        with self.qconn.pipeline() as pipeline:
+            while True:
+                try:
+                    pipeline.watch(self.id_score, self.id_item)
+                    # generate ids not in use; commands are executed immediately while watching
+                    while True:
+                        ids = [random_id() for _ in item_score_list]
+                        existing_items = pipeline.hmget(self.id_item, ids)
+                        if len(set(ids)) == len(ids) and all(existing_item is None for existing_item in existing_items):
+                            break
+                        if time.time() > generate_id_attempt_timestamp + 60:
+                            raise Exception("Cannot generate unique id")
+                    zadd_args = []
+                    for id, (item, score) in zip(ids, item_score_list):
+                        zadd_args.extend([score, id])
+                    pipeline.multi()
+                    pipeline.execute_command("ZADD", self.id_score, "NX", *zadd_args)
+                    for id, (item, score) in zip(ids, item_score_list):
+                        pipeline.hsetnx(self.id_item, id, item)
+                    resVal = pipeline.execute()
+                except redis.WatchError:
+                    continue
+                else:
+                    break
+        return resVal[0]
+
     # enqueue by id
     def putbyid(self, id, item, score):
         with self.qconn.pipeline() as pipeline:
@@ -165,6 +217,58 @@ class RedisFifo(PluginBase):
     def getlast(self, timeout=None, protective=False):
         return self._pop(timeout=timeout, protective=protective, mode="last")
 
+    # dequeue list of objects with some conditions
+    def getmany(self, mode="first", minscore=None, maxscore=None, count=None, protective=False, temporary=False):
+        mode_rank_map = {
+            "first": False,
+            "last": True,
+        }
+        desc = mode_rank_map[mode]
+        minscore_str = "-inf" if minscore is None else float(minscore)
+        maxscore_str = "+inf" if maxscore is None else float(maxscore)
+        ret_list = []
+        with self.qconn.pipeline() as pipeline:
+            while True:
+                try:
+                    pipeline.watch(self.id_score, self.id_item, self.id_temp, self.id_temp_score)
+                    # commands are executed immediately while watching
+                    # scores of objects in temporary space are kept in another sorted set
+                    score_key = self.id_temp_score if temporary else self.id_score
+                    range_opt_dict = {"withscores": True}
+                    if count is not None:
+                        range_opt_dict.update({"start": 0, "num": int(count)})
+                    if desc:
+                        id_score_list = pipeline.zrevrangebyscore(score_key, maxscore_str, minscore_str, **range_opt_dict)
+                    else:
+                        id_score_list = pipeline.zrangebyscore(score_key, minscore_str, maxscore_str, **range_opt_dict)
+                    ids = [id for id, score in id_score_list]
+                    scores = [score for id, score in id_score_list]
+                    if not ids:
+                        break
+                    items = pipeline.hmget(self.id_item, ids)
+                    pipeline.multi()
+                    if temporary:
+                        if not protective:
+                            pipeline.srem(self.id_temp, *ids)
+                            pipeline.zrem(self.id_temp_score, *ids)
+                            pipeline.zrem(self.id_deadline, *ids)
+                            pipeline.hdel(self.id_item, *ids)
+                    elif protective:
+                        self._set_deadline(pipeline, ids)
+                        pipeline.execute_command("ZADD", self.id_temp_score, *[arg for id, score in id_score_list for arg in (score, id)])
+                        pipeline.sadd(self.id_temp, *ids)
+                        pipeline.zrem(self.id_score, *ids)
+                    else:
+                        pipeline.hdel(self.id_item, *ids)
+                        pipeline.zrem(self.id_score, *ids)
+                    pipeline.execute()
+                except redis.WatchError:
+                    continue
+                else:
+                    ret_list = list(zip(ids, items, scores))
+                    break
+        return ret_list
+
     # get tuple of (id, item, score) of the first object without dequeuing it
     def peek(self, skip_item=False):
         return self._peek(skip_item=skip_item)
@@ -190,6 +294,8 @@ class RedisFifo(PluginBase):
                     pipeline.delete(self.id_score)
                     pipeline.delete(self.id_item)
                     pipeline.delete(self.id_temp)
+                    pipeline.delete(self.id_temp_score)
+                    pipeline.delete(self.id_deadline)
                     pipeline.execute()
                 except redis.WatchError:
                     continue
@@ -205,6 +311,8 @@ class RedisFifo(PluginBase):
                         pipeline.watch(self.id_score, self.id_item, self.id_temp)
                         pipeline.multi()
                         pipeline.srem(self.id_temp, *ids)
+                        pipeline.zrem(self.id_temp_score, *ids)
+                        pipeline.zrem(self.id_deadline, *ids)
                         pipeline.hdel(self.id_item, *ids)
                         pipeline.zrem(self.id_score, *ids)
                         resVal = pipeline.execute()
@@ -216,25 +324,57 @@ class RedisFifo(PluginBase):
         else:
             raise TypeError("ids should be list or tuple")
 
-    # Move objects in temporary space to the queue
+    # move objects in temporary space to the queue with scores, and drop deadlines of stale ids, to be called in watching pipeline
+    def _requeue(self, pipeline, id_score_list, stale_ids=()):
+        pipeline.multi()
+        if stale_ids:
+            pipeline.srem(self.id_temp, *stale_ids)
+            pipeline.zrem(self.id_temp_score, *stale_ids)
+            pipeline.zrem(self.id_deadline, *stale_ids)
+        if id_score_list:
+            ids = [id for id, score in id_score_list]
+            pipeline.srem(self.id_temp, *ids)
+            pipeline.zrem(self.id_temp_score, *ids)
+            pipeline.zrem(self.id_deadline, *ids)
+            pipeline.execute_command("ZADD", self.id_score, "NX", *[arg for id, score in id_score_list for arg in (score, id)])
+        pipeline.execute()
+
+    # Move objects in temporary space to the queue. Objects are requeued with the current time
     def restore(self, ids):
         with self.qconn.pipeline() as pipeline:
             while True:
                 now_timestamp = time.time()
                 try:
-                    pipeline.watch(self.id_score, self.id_item, self.id_temp)
+                    pipeline.watch(self.id_score, self.id_item, self.id_temp, self.id_deadline)
                     if ids is None:
-                        pipeline.multi()
-                        pipeline.delete(self.id_temp)
-                        pipeline.execute()
+                        temp_ids = pipeline.smembers(self.id_temp)
                     elif isinstance(ids, (list, tuple)):
-                        if len(ids) > 0:
-                            pipeline.multi()
-                            pipeline.srem(self.id_temp, *ids)
-                            pipeline.execute()
+                        temp_ids = [id for id, is_member in zip(ids, [pipeline.sismember(self.id_temp, id) for id in ids]) if is_member]
                     else:
                         raise TypeError("ids should be list or tuple or None")
+                    self._requeue(pipeline, [(id, now_timestamp) for id in temp_ids])
                 except redis.WatchError:
                     continue
                 else:
                     break
+
+    # move objects in temporary space with expired deadline to the queue with the deadline as score,
+    # and return the number of objects
+    def requeue_expired(self):
+        with self.qconn.pipeline() as pipeline:
+            while True:
+                try:
+                    pipeline.watch(self.id_score, self.id_item, self.id_temp, self.id_deadline)
+                    # objects already deleted or restored are not requeued, and only their deadlines are dropped
+                    id_score_list = []
+                    stale_ids = []
+                    for id, score in pipeline.zrangebyscore(self.id_deadline, "-inf", time.time(), withscores=True):
+                        if pipeline.sismember(self.id_temp, id) and pipeline.hexists(self.id_item, id):
+                            id_score_list.append((id, score))
+                        else:
+                            stale_ids.append(id)
+                    self._requeue(pipeline, id_score_list, stale_ids)
+                except redis.WatchError:
+                    continue
+                else:
+                    return len(id_score_list)
@@ -9,6 +9,7 @@ except ImportError:
     from thread import get_ident
 
 from pandaharvester.harvesterconfig import harvester_config
+from pandaharvester.harvestercore import core_utils
 from pandaharvester.harvestercore.plugin_base import PluginBase
 
 try:
@@ -19,8 +20,19 @@ except NameError:
 
 class SqliteFifo(PluginBase):
     # template of SQL commands
-    _create_sql = "CREATE TABLE IF NOT EXISTS queue_table " "(" "  id INTEGER PRIMARY KEY," "  item BLOB," "  score REAL," "  temporary INTEGER DEFAULT 0 " ")"
+    _create_sql = (
+        "CREATE TABLE IF NOT EXISTS queue_table "
+        "("
+        "  id INTEGER PRIMARY KEY,"
+        "  item BLOB,"
+        "  score REAL,"
+        "  temporary INTEGER DEFAULT 0,"
+        "  deadline REAL "
+        ")"
+    )
     _create_index_sql = "CREATE INDEX IF NOT EXISTS score_index ON queue_table " "(score)"
+    _columns_sql = "PRAGMA table_info(queue_table)"
+    _add_deadline_sql = "ALTER TABLE queue_table ADD COLUMN deadline REAL"
     _count_sql = "SELECT COUNT(id) FROM queue_table"
     _iterate_sql = "SELECT id, item, score FROM queue_table"
     _write_lock_sql = "BEGIN IMMEDIATE"
@@ -34,15 +46,19 @@ class SqliteFifo(PluginBase):
         "SELECT id, item, score FROM queue_table " "WHERE " "{temporary_str} " "{minscore_str} " "{maxscore_str} " "ORDER BY score {rank} " "{count_str} "
     )
     _pop_del_sql = "DELETE FROM queue_table WHERE id = ?"
-    _move_to_temp_sql = "UPDATE queue_table SET temporary = 1 WHERE id = ?"
-    _move_many_to_temp_sql_template = "UPDATE queue_table SET temporary = 1 WHERE id in ({0})"
+    _move_to_temp_sql = "UPDATE queue_table SET temporary = 1, deadline = ? WHERE id = ?"
+    _move_many_to_temp_sql_template = "UPDATE queue_table SET temporary = 1, deadline = ? WHERE id in ({0})"
     _del_sql_template = "DELETE FROM queue_table WHERE id in ({0})"
     _clear_delete_table_sql = "DELETE FROM queue_table"
     _clear_drop_table_sql = "DROP TABLE IF EXISTS queue_table"
     _clear_zero_id_sql = 'DELETE FROM sqlite_sequence WHERE name = "queue_table"'
     _peek_sql = "SELECT id, item, score FROM queue_table " "WHERE temporary = 0 " "ORDER BY score LIMIT 1"
-    _restore_sql = "UPDATE queue_table SET temporary = 0 WHERE temporary != 0"
-    _restore_sql_template = "UPDATE queue_table SET temporary = 0 " "WHERE temporary != 0 AND id in ({0})"
+    _restore_sql = "UPDATE queue_table SET temporary = 0, deadline = NULL WHERE temporary != 0"
+    _restore_sql_template = "UPDATE queue_table SET temporary = 0, deadline = NULL " "WHERE temporary != 0 AND id in ({0})"
+    _requeue_expired_sql = "UPDATE queue_table SET temporary = 0, deadline = NULL " "WHERE temporary != 0 AND deadline IS NOT NULL AND deadline < ?"
+    _data_version_sql = "PRAGMA data_version"
+    # interval in sec to check changes by other processes while blocking
+    _check_interval = 0.05
 
     # constructor
     def __init__(self, **kwarg):
@@ -55,10 +71,20 @@ class SqliteFifo(PluginBase):
         _db_filename = re.sub("\$\(AGENT\)", self.titleName, _db_filename)
         self.db_path = os.path.abspath(_db_filename)
         self._connection_cache = {}
+        # getters block until objects are put instead of polling with write lock
+        if not hasattr(self, "blockingDequeue"):
+            self.blockingDequeue = getattr(harvester_config.fifo, "blockingDequeue", False) if hasattr(harvester_config, "fifo") else False
+        self.notifier = core_utils.get_fifo_notifier(f"sqlite:{self.db_path}")
+        # objects dequeued protectively are requeued if not deleted within visibility timeout in sec
+        if not hasattr(self, "fifoVisibilityTimeout"):
+            self.fifoVisibilityTimeout = None
         with self._get_conn() as conn:
             conn.execute(self._exclusive_lock_sql)
             conn.execute(self._create_sql)
             conn.execute(self._create_index_sql)
+            # add deadline column to tables made by old versions
+            if "deadline" not in [row[1] for row in conn.execute(self._columns_sql)]:
+                conn.execute(self._add_deadline_sql)
             conn.commit()
 
     def __len__(self):
@@ -71,6 +97,12 @@ class SqliteFifo(PluginBase):
             for id, item_buf, score in conn.execute(self._iterate_sql):
                 yield bytes(item_buf)
 
+    # get deadline of objects dequeued protectively
+    def _get_deadline(self):
+        if self.fifoVisibilityTimeout:
+            return time.time() + self.fifoVisibilityTimeout
+        return None
+
     def _get_conn(self):
         id = get_ident()
         if id not in self._connection_cache:
@@ -78,6 +110,8 @@ class SqliteFifo(PluginBase):
         return self._connection_cache[id]
 
     def _pop(self, get_sql, timeout=None, protective=False):
+        if self.blockingDequeue:
+            return self._blocking_pop(get_sql, timeout, protective)
         keep_polling = True
         wait = 0.1
         max_wait = 2
@@ -86,10 +120,12 @@ class SqliteFifo(PluginBase):
         with self._get_conn() as conn:
             id = None
             while keep_polling:
+                attempt_timestamp = time.time()
                 conn.execute(self._write_lock_sql)
                 cursor = conn.execute(get_sql)
                 try:
                     id, item_buf, score = next(cursor)
+                    core_utils.set_fifo_get_wait_time(attempt_timestamp - last_attempt_timestamp)
                     keep_polling = False
                 except StopIteration:
                     # unlock the database
@@ -103,7 +139,44 @@ class SqliteFifo(PluginBase):
                     wait = min(max_wait, tries / 10.0 + wait)
             if id is not None:
                 if protective:
-                    conn.execute(self._move_to_temp_sql, (id,))
+                    conn.execute(self._move_to_temp_sql, (self._get_deadline(), id))
+                else:
+                    conn.execute(self._pop_del_sql, (id,))
+                conn.commit()
+                return (id, bytes(item_buf), score)
+        return None
+
+    # pop which waits for notification by putters in the same process, and checks data_version which is changed
+    # by commits of other connections so that write lock is taken only when the database has been changed
+    def _blocking_pop(self, get_sql, timeout=None, protective=False):
+        start_timestamp = time.time()
+        with self._get_conn() as conn:
+            id = None
+            last_data_version = None
+            while True:
+                attempt_timestamp = time.time()
+                notified_version = self.notifier.version
+                data_version = next(conn.execute(self._data_version_sql))[0]
+                if data_version != last_data_version:
+                    last_data_version = data_version
+                    conn.execute(self._write_lock_sql)
+                    cursor = conn.execute(get_sql)
+                    try:
+                        id, item_buf, score = next(cursor)
+                        core_utils.set_fifo_get_wait_time(attempt_timestamp - start_timestamp)
+                        break
+                    except StopIteration:
+                        # unlock the database
+                        conn.commit()
+                if timeout is None:
+                    break
+                remaining_time = timeout - (time.time() - start_timestamp)
+                if remaining_time <= 0:
+                    break
+                self.notifier.wait(notified_version, min(remaining_time, self._check_interval))
+            if id is not None:
+                if protective:
+                    conn.execute(self._move_to_temp_sql, (self._get_deadline(), id))
                 else:
                     conn.execute(self._pop_del_sql, (id,))
                 conn.commit()
@@ -147,8 +220,19 @@ class SqliteFifo(PluginBase):
             n_row = cursor.rowcount
             if n_row == 1:
                 retVal = True
+        self.notifier.notify()
         return retVal
 
+    # enqueue list of (item, score) in one transaction
+    def putmany(self, item_score_list):
+        params_list = [(memoryviewOrBuffer(item), score) for item, score in item_score_list]
+        with self._get_conn() as conn:
+            conn.execute(self._write_lock_sql)
+            cursor = conn.executemany(self._push_sql, params_list)
+            n_row = cursor.rowcount
+        self.notifier.notify()
+        return n_row
+
     # enqueue by id
     def putbyid(self, id, item, score):
         retVal = False
@@ -158,6 +242,7 @@ class SqliteFifo(PluginBase):
             n_row = cursor.rowcount
             if n_row == 1:
                 retVal = True
+        self.notifier.notify()
         return retVal
 
     # dequeue the first object
@@ -193,7 +278,7 @@ class SqliteFifo(PluginBase):
                 ids.append(id)
             placeholders_str = ",".join("?" * len(ids))
             if protective:
-                conn.execute(self._move_many_to_temp_sql_template.format(placeholders_str), ids)
+                conn.execute(self._move_many_to_temp_sql_template.format(placeholders_str), [self._get_deadline()] + ids)
             else:
                 conn.execute(self._del_sql_template.format(placeholders_str), ids)
             conn.commit()
@@ -247,6 +332,17 @@ class SqliteFifo(PluginBase):
                 conn.execute(self._restore_sql_template.format(placeholders_str), ids)
             else:
                 raise TypeError("ids should be list or tuple or None")
+        self.notifier.notify()
+
+    # move objects in temporary space with expired deadline to the queue, and return the number of objects
+    def requeue_expired(self):
+        with self._get_conn() as conn:
+            conn.execute(self._write_lock_sql)
+            cursor = conn.execute(self._requeue_expired_sql, (time.time(),))
+            n_row = cursor.rowcount
+        if n_row > 0:
+            self.notifier.notify()
+        return n_row
 
     # update a object by its id with some conditions
     def update(self, id, item=None, score=None, temporary=None, cond_score=None):
@@ -269,6 +365,7 @@ class SqliteFifo(PluginBase):
         if temporary is not None:
             attr_set_list.append("temporary = ?")
             params.append(temporary)
+            attr_set_list.append("deadline = NULL")
         attr_set_str = " , ".join(attr_set_list)
         if not attr_set_str:
             return False
@@ -284,4 +381,5 @@ class SqliteFifo(PluginBase):
             n_row = cursor.rowcount
             if n_row >= 1:
                 retVal = True
+        self.notifier.notify()
         return retVal
@@ -4,6 +4,7 @@ import types
 import six
 from pandaharvester.harvestercore import core_utils
 from pandaharvester.harvestercore.plugin_base import PluginBase
+from pandaharvester.harvestercore.spec_base import SpecBase
 
 from .ssh_master_pool import sshMasterPool
 
@@ -13,7 +14,14 @@ _logger = core_utils.setup_logger("direct_ssh_herder")
 
 # is mutable object to handle
 def is_mutable(obj):
-    return isinstance(obj, (list, dict)) or hasattr(obj, "__dict__")
+    return isinstance(obj, (list, dict, SpecBase)) or hasattr(obj, "__dict__")
+
+
+# get names of instance attributes of an object. specs may have slots instead of __dict__
+def get_attribute_names(obj):
+    if isinstance(obj, SpecBase):
+        return ["changedAttrs"] + list(obj.__getstate__())
+    return list(obj.__dict__)
 
 
 # update changes recursively of an object from a new object
@@ -40,20 +48,20 @@ def update_object(old_obj, new_obj):
                     update_object(old_obj[k], new_obj[k])
                 else:
                     old_obj[k] = new_obj[k]
-    elif hasattr(old_obj, "__dict__"):
-        for k in old_obj.__dict__:
+    elif is_mutable(old_obj):
+        for k in get_attribute_names(old_obj):
             try:
-                new_obj.__dict__[k]
-            except KeyError:
+                newVal = getattr(new_obj, k)
+            except AttributeError:
                 pass
             else:
                 if k in ["isNew", "new_status"]:
                     # skip attributes omitted in workspec pickling
                     pass
-                elif is_mutable(old_obj.__dict__[k]):
-                    update_object(old_obj.__dict__[k], new_obj.__dict__[k])
+                elif is_mutable(getattr(old_obj, k)):
+                    update_object(getattr(old_obj, k), newVal)
                 else:
-                    old_obj.__dict__[k] = new_obj.__dict__[k]
+                    object.__setattr__(old_obj, k, newVal)
 
 
 # function class
@@ -1,13 +1,14 @@
 # === Imports ===================================================
 
 import functools
+import glob
 import multiprocessing
+import os
 import random
 import re
 import tempfile
 import threading
 import time
-import traceback
 import xml.etree.ElementTree as ET
 
 try:
@@ -209,11 +210,12 @@ def condor_submit_process(mp_queue, host, jdl_map_list):
 
 # === Classes ===================================================
 
-# Condor queue cache fifo
+# Condor queue cache fifo, to share the latest job ads of a schedd among nodes
 
 
 class CondorQCacheFifo(six.with_metaclass(SingletonWithID, SpecialFIFOBase)):
-    global_lock_id = -1
+    # id of the object of cache
+    cache_id = 0
 
     def __init__(self, target, *args, **kwargs):
         name_suffix = target.split(".")[0]
@@ -221,24 +223,356 @@ class CondorQCacheFifo(six.with_metaclass(SingletonWithID, SpecialFIFOBase)):
         self.titleName = f"CondorQCache_{name_suffix}"
         SpecialFIFOBase.__init__(self)
 
-    def lock(self, score=None):
-        lock_key = format(int(random.random() * 2**32), "x")
-        if score is None:
-            score = time.time()
-        retVal = self.putbyid(self.global_lock_id, lock_key, score)
-        if retVal:
-            return lock_key
-        return None
-
-    def unlock(self, key=None, force=False):
-        peeked_tuple = self.peekbyid(id=self.global_lock_id)
-        if peeked_tuple.score is None or peeked_tuple.item is None:
-            return True
-        elif force or self.decode(peeked_tuple.item) == key:
-            self.delete([self.global_lock_id])
-            return True
+    # get the update time of the cache in fifo, or None if no cache
+    def get_last_update(self):
+        peeked_tuple = self.peekbyid(id=self.cache_id, skip_item=True)
+        if peeked_tuple is None or peeked_tuple.id is None:
+            return None
+        return peeked_tuple.score
+
+    # load the cache object from fifo
+    def load(self):
+        peeked_tuple = self.peekbyid(id=self.cache_id)
+        if peeked_tuple is None or peeked_tuple.item is None:
+            return None
+        return self.decode(peeked_tuple.item)
+
+    # save the cache object to fifo unless a newer one is already there
+    def save(self, obj, last_update):
+        item_serialized = self.encode(obj)
+        if hasattr(self.fifo, "update"):
+            if self.update(self.cache_id, item_serialized, last_update, None, "gt"):
+                return True
         else:
+            # replace the object with delete and putbyid for fifo plugins without update
+            last_update_in_fifo = self.get_last_update()
+            if last_update_in_fifo is not None:
+                if last_update_in_fifo >= last_update:
+                    return False
+                self.delete([self.cache_id])
+        return self.putbyid(self.cache_id, item_serialized, last_update, encode_item=False)
+
+    # get the lock to refresh the cache, which is held for lock_interval to allow only one refresh among nodes
+    def get_refresh_lock(self, lock_interval):
+        return self.dbProxy.get_process_lock(f"{self.titleName}_refresh", f"{self.hostname}_{self.os_pid}", lock_interval)
+
+
+# Cache of job ads from condor_q of a schedd, shared by all threads
+
+
+class ScheddQueryCache(six.with_metaclass(SingletonWithID, object)):
+    # full refresh every N refresh intervals to resync attributes not tracked by incremental refresh
+    full_refresh_factor = 10
+    # margin in seconds of incremental refresh for clock skew between harvester and schedd
+    incremental_margin = 120
+
+    def __init__(self, *args, **kwargs):
+        self.submissionHost = str(kwargs.get("id"))
+        self.lock = threading.Lock()
+        # dict of "ClusterId.ProcId": job ads dict, replaced rather than modified when refreshed
+        self.job_ads_dict = {}
+        self.last_update = 0
+        self.last_full_update = 0
+
+    # get cache fifo of the thread
+    def _get_cache_fifo(self):
+        return CondorQCacheFifo(target=self.submissionHost, id=f"{self.submissionHost},{get_ident()}")
+
+    # load cache from fifo if it is newer than the local one
+    def _sync_from_fifo(self, cache_fifo, tmpLog):
+        last_update = cache_fifo.get_last_update()
+        if last_update is None or last_update <= self.last_update:
+            return False
+        obj = cache_fifo.load()
+        if obj is None:
             return False
+        self.last_update, self.last_full_update, self.job_ads_dict = obj
+        tmpLog.debug(f"loaded {len(self.job_ads_dict)} job ads updated at {self.last_update:.0f} from fifo")
+        return True
+
+    # query schedd and update cache, fully or incrementally since the last update
+    def _refresh(self, schedd, refresh_interval, tmpLog):
+        constraint = f'harvesterID =?= "{harvesterID}"'
+        timeNow = time.time()
+        job_ads_dict = None
+        if self.job_ads_dict and timeNow < self.last_full_update + refresh_interval * self.full_refresh_factor:
+            # ids of all jobs in queue to drop jobs gone, and full ads of jobs which changed status since the last update
+            batchid_set = set(get_batchid_from_job(job) for job in schedd.xquery(constraint=constraint, projection=["ClusterId", "ProcId"]))
+            since = int(self.last_update - self.incremental_margin)
+            job_ads_dict = {batchid: job_ads for batchid, job_ads in self.job_ads_dict.items() if batchid in batchid_set}
+            n_changed = 0
+            for job in schedd.xquery(constraint=f"{constraint} && EnteredCurrentStatus >= {since}", projection=CONDOR_JOB_ADS_LIST):
+                job_ads = dict(job)
+                job_ads_dict[get_batchid_from_job(job_ads)] = job_ads
+                n_changed += 1
+            if len(job_ads_dict) < len(batchid_set):
+                # jobs unknown to the cache, which should not happen
+                tmpLog.debug(f"{len(batchid_set) - len(job_ads_dict)} jobs missing in incremental refresh. Do full refresh")
+                job_ads_dict = None
+            else:
+                tmpLog.debug(f"incremental refresh: {n_changed} changed, {len(self.job_ads_dict) + n_changed - len(job_ads_dict)} gone")
+                last_full_update = self.last_full_update
+        if job_ads_dict is None:
+            job_ads_dict = {}
+            for job in schedd.xquery(constraint=constraint, projection=CONDOR_JOB_ADS_LIST):
+                try:
+                    job_ads = dict(job)
+                    job_ads_dict[get_batchid_from_job(job_ads)] = job_ads
+                except Exception as e:
+                    tmpLog.error(f"In updating cache schedd xquery; got exception {e.__class__.__name__}: {e} ; {repr(job)}")
+            tmpLog.debug(f"full refresh: {len(job_ads_dict)} jobs")
+            last_full_update = timeNow
+        self.job_ads_dict = job_ads_dict
+        self.last_update = timeNow
+        self.last_full_update = last_full_update
+
+    def get_job_ads(self, schedd, refresh_interval, timeout=60):
+        """
+        Get dict of "ClusterId.ProcId": job ads of the schedd, refreshing the cache if older than refresh_interval.
+        Concurrent refreshes are single-flighted with a thread lock in the process and a process lock among nodes
+        """
+        tmpLog = core_utils.make_logger(baseLogger, f"submissionHost={self.submissionHost}", method_name="ScheddQueryCache.get_job_ads")
+        if time.time() < self.last_update + refresh_interval:
+            return self.job_ads_dict
+        # other threads wait for the thread refreshing the cache
+        if not self.lock.acquire(timeout=timeout):
+            tmpLog.debug(f"timeout ({timeout} seconds) to wait for refresh by another thread. Use old cache")
+            return self.job_ads_dict
+        try:
+            if time.time() < self.last_update + refresh_interval:
+                return self.job_ads_dict
+            try:
+                cache_fifo = self._get_cache_fifo()
+                if self._sync_from_fifo(cache_fifo, tmpLog) and time.time() < self.last_update + refresh_interval:
+                    return self.job_ads_dict
+                to_refresh = cache_fifo.get_refresh_lock(refresh_interval)
+                if not to_refresh:
+                    # wait for another node to refresh
+                    tmpLog.debug("cache being refreshed by another node. Wait")
+                    attempt_timestamp = time.time()
+                    while time.time() < attempt_timestamp + timeout:
+                        time.sleep(random.uniform(1, 5))
+                        if self._sync_from_fifo(cache_fifo, tmpLog):
+                            break
+                    else:
+                        tmpLog.debug(f"timeout ({timeout} seconds) to wait for refresh by another node. Use old cache")
+            except Exception as e:
+                # query schedd directly without sharing
+                tmpLog.error(f"failed to use cache fifo; {e.__class__.__name__}: {e} . Query schedd directly")
+                cache_fifo = None
+                to_refresh = True
+            if to_refresh:
+                # refresh from schedd and share it among nodes
+                self._refresh(schedd, refresh_interval, tmpLog)
+                if cache_fifo is not None:
+                    try:
+                        cache_fifo.save((self.last_update, self.last_full_update, self.job_ads_dict), self.last_update)
+                    except Exception as e:
+                        tmpLog.error(f"failed to save cache to fifo; {e.__class__.__name__}: {e}")
+        finally:
+            self.lock.release()
+        return self.job_ads_dict
+
+
+# Index of completed jobs from condor_history of a schedd, updated incrementally
+
+
+class ScheddHistoryIndex(six.with_metaclass(SingletonWithID, object)):
+    # margin in seconds to rescan before the watermark, as history is not strictly ordered by EnteredCurrentStatus
+    watermark_margin = 300
+
+    def __init__(self, *args, **kwargs):
+        self.submissionHost = str(kwargs.get("id"))
+        self.lock = threading.Lock()
+        # dict of "ClusterId.ProcId": job ads dict of completed jobs
+        self.job_ads_dict = {}
+        # EnteredCurrentStatus of the latest job got from history
+        self.watermark = None
+        self.last_update = 0
+
+    # query history since the watermark and merge into the index, then drop jobs older than retention
+    def _update(self, schedd, retention, tmpLog):
+        timeNow = time.time()
+        if self.watermark is None:
+            self.watermark = timeNow - retention
+        since_timestamp = int(self.watermark - self.watermark_margin)
+        constraint = f'harvesterID =?= "{harvesterID}" && EnteredCurrentStatus >= {since_timestamp}'
+        # stop scanning history file backwards once reaching jobs older than the watermark if supported
+        try:
+            import classad
+
+            query_kwargs = {"since": classad.ExprTree(f"EnteredCurrentStatus < {since_timestamp}")}
+        except Exception:
+            query_kwargs = {}
+        try:
+            jobs_iter = schedd.history(constraint=constraint, projection=CONDOR_JOB_ADS_LIST, **query_kwargs)
+        except TypeError:
+            jobs_iter = schedd.history(constraint=constraint, projection=CONDOR_JOB_ADS_LIST)
+        job_ads_dict = dict(self.job_ads_dict)
+        watermark = self.watermark
+        n_new = 0
+        for job in jobs_iter:
+            try:
+                job_ads = dict(job)
+                batchid = get_batchid_from_job(job_ads)
+            except Exception as e:
+                tmpLog.error(f"In updating history index; got exception {e.__class__.__name__}: {e} ; {repr(job)}")
+                continue
+            if batchid not in job_ads_dict:
+                n_new += 1
+            job_ads_dict[batchid] = job_ads
+            watermark = max(watermark, job_ads.get("EnteredCurrentStatus", 0))
+        # retention
+        time_limit = timeNow - retention
+        n_all = len(job_ads_dict)
+        job_ads_dict = {batchid: job_ads for batchid, job_ads in job_ads_dict.items() if job_ads.get("EnteredCurrentStatus", timeNow) >= time_limit}
+        self.job_ads_dict = job_ads_dict
+        self.watermark = watermark
+        self.last_update = timeNow
+        tmpLog.debug(f"got {n_new} new completed jobs since {since_timestamp}, dropped {n_all - len(job_ads_dict)}, now {len(job_ads_dict)} jobs in index")
+
+    def get_job_ads(self, schedd, batchIDs_set, refresh_interval, retention, timeout=60):
+        """
+        Get list of job ads of completed jobs among batchIDs_set, updating the index if older than refresh_interval.
+        Only one thread updates the index at a time
+        """
+        tmpLog = core_utils.make_logger(baseLogger, f"submissionHost={self.submissionHost}", method_name="ScheddHistoryIndex.get_job_ads")
+        if time.time() >= self.last_update + refresh_interval:
+            if self.lock.acquire(timeout=timeout):
+                try:
+                    if time.time() >= self.last_update + refresh_interval:
+                        self._update(schedd, retention, tmpLog)
+                finally:
+                    self.lock.release()
+            else:
+                tmpLog.debug(f"timeout ({timeout} seconds) to wait for update by another thread. Use old index")
+        job_ads_dict = self.job_ads_dict
+        return [job_ads_dict[batchid] for batchid in batchIDs_set if batchid in job_ads_dict]
+
+
+# Tailer of HTCondor user job event logs, to get state transitions of jobs without querying schedd
+
+
+class CondorEventLogTailer(six.with_metaclass(SingletonWithID, object)):
+    # map of event code to JobStatus for events of state transitions
+    event_job_status_map = {
+        0: 1,  # submit
+        1: 2,  # execute
+        4: 1,  # evicted
+        5: 4,  # terminated
+        7: 1,  # shadow exception
+        9: 3,  # aborted
+        10: 7,  # suspended
+        11: 2,  # unsuspended
+        12: 5,  # held
+        13: 1,  # released
+    }
+    # header line of event, e.g. "005 (1234.000.000) 2024-03-01 12:34:56 Job terminated."
+    event_header_pattern = re.compile(r"^(\d{3}) \((\d+)\.(\d+)\.\d+\) (\S+ \S+) ")
+    # separator of events
+    event_separator = b"\n...\n"
+
+    def __init__(self, path_patterns, *args, **kwargs):
+        self.path_patterns = list(path_patterns)
+        self.lock = threading.Lock()
+        # dict of path: (inode, offset)
+        self.file_offset_dict = {}
+        # dict of "ClusterId.ProcId": last JobStatus
+        self.job_status_dict = {}
+        # statistics since the instance was made
+        self.stats = {"n_polls": 0, "n_files_read": 0, "n_events": 0, "n_transitions": 0}
+
+    # parse timestamp of event in ISO format or in the old format without year
+    @staticmethod
+    def parse_event_time(time_str):
+        for time_format in ("%Y-%m-%d %H:%M:%S", "%m/%d %H:%M:%S"):
+            try:
+                time_struct = time.strptime(time_str.split(".")[0], time_format)
+            except ValueError:
+                continue
+            if time_struct.tm_year == 1900:
+                time_struct = time.strptime(f"{time.localtime().tm_year}/{time_str}", f"%Y/{time_format}")
+            return time.mktime(time_struct)
+        return time.time()
+
+    # parse complete events in data, and return list of (batchID, JobStatus, timestamp)
+    def parse_events(self, data):
+        transition_list = []
+        for event_str in data.decode(errors="replace").split("\n...\n"):
+            match = self.event_header_pattern.match(event_str.lstrip("\n"))
+            if match is None:
+                continue
+            self.stats["n_events"] += 1
+            event_code, clusterid, procid, time_str = match.groups()
+            job_status = self.event_job_status_map.get(int(event_code))
+            if job_status is None:
+                continue
+            batchid = f"{int(clusterid)}.{int(procid)}"
+            if self.job_status_dict.get(batchid) == job_status:
+                continue
+            # forget jobs in final states
+            if job_status in (3, 4):
+                self.job_status_dict.pop(batchid, None)
+            else:
+                self.job_status_dict[batchid] = job_status
+            transition_list.append((batchid, job_status, self.parse_event_time(time_str)))
+        return transition_list
+
+    # read new complete events of a file since the last offset
+    def _read_file(self, path, stat_result):
+        inode, offset = self.file_offset_dict.get(path, (stat_result.st_ino, 0))
+        if inode != stat_result.st_ino or stat_result.st_size < offset:
+            # rotated or truncated
+            offset = 0
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read(stat_result.st_size - offset)
+        # only complete events
+        end_index = data.rfind(self.event_separator)
+        if end_index < 0:
+            return b""
+        end_index += len(self.event_separator)
+        self.file_offset_dict[path] = (stat_result.st_ino, offset + end_index)
+        return data[:end_index]
+
+    def poll(self, time_window):
+        """
+        Read new events in logs and return list of (batchID, JobStatus, timestamp) of state transitions within time_window.
+        Logs not modified within time_window are skipped without being read
+        """
+        tmpLog = core_utils.make_logger(baseLogger, method_name="CondorEventLogTailer.poll")
+        timeNow = time.time()
+        time_limit = timeNow - time_window
+        transition_list = []
+        with self.lock:
+            self.stats["n_polls"] += 1
+            path_set = set()
+            for path_pattern in self.path_patterns:
+                path_set.update(glob.glob(path_pattern))
+            for path in path_set:
+                try:
+                    stat_result = os.stat(path)
+                    if stat_result.st_mtime < time_limit:
+                        # forget files not modified within time_window as they have no events to report
+                        self.file_offset_dict.pop(path, None)
+                        continue
+                    if self.file_offset_dict.get(path) == (stat_result.st_ino, stat_result.st_size):
+                        continue
+                    data = self._read_file(path, stat_result)
+                except OSError as e:
+                    tmpLog.debug(f"failed to read {path} ; {e.__class__.__name__}: {e}")
+                    continue
+                self.stats["n_files_read"] += 1
+                for batchid, job_status, timestamp in self.parse_events(data):
+                    if timestamp >= time_limit:
+                        transition_list.append((batchid, job_status, timestamp))
+            # forget files gone
+            for path in list(self.file_offset_dict):
+                if path not in path_set:
+                    del self.file_offset_dict[path]
+            self.stats["n_transitions"] += len(transition_list)
+        tmpLog.debug(f"got {len(transition_list)} transitions from {len(path_set)} files")
+        return transition_list
 
 
 # Condor client
@@ -381,7 +715,16 @@ class CondorJobQuery(six.with_metaclass(SingletonWithID, CondorClient)):
 <classads>
 """
 
-    def __init__(self, cacheEnable=False, cacheRefreshInterval=None, useCondorHistory=True, *args, **kwargs):
+    def __init__(
+        self,
+        cacheEnable=False,
+        cacheRefreshInterval=None,
+        useCondorHistory=True,
+        useCondorHistoryIncremental=False,
+        condorHistoryRetention=86400,
+        *args,
+        **kwargs,
+    ):
         self.submissionHost = str(kwargs.get("id"))
         # Make logger
         tmpLog = core_utils.make_logger(
@@ -394,9 +737,12 @@ class CondorJobQuery(six.with_metaclass(SingletonWithID, CondorClient)):
             # For condor_q cache
             self.cacheEnable = cacheEnable
             if self.cacheEnable:
-                self.cache = ([], 0)
                 self.cacheRefreshInterval = cacheRefreshInterval
             self.useCondorHistory = useCondorHistory
+            # For incremental condor_history
+            self.useCondorHistoryIncremental = useCondorHistoryIncremental
+            self.condorHistoryRetention = condorHistoryRetention
+            self.historyRefreshInterval = cacheRefreshInterval if cacheRefreshInterval else harvester_config.monitor.checkInterval
             tmpLog.debug("Initialize done")
 
     def get_all(self, batchIDs_list=[], allJobs=False):
@@ -486,157 +832,44 @@ class CondorJobQuery(six.with_metaclass(SingletonWithID, CondorClient)):
         tmpLog = core_utils.make_logger(baseLogger, f"submissionHost={self.submissionHost}", method_name="CondorJobQuery.query_with_python")
         # Start query
         tmpLog.debug("Start query")
-        cache_fifo = None
         job_ads_all_dict = {}
         # make id sets
         batchIDs_set = set(batchIDs_list)
-        clusterids_set = set([get_job_id_tuple_from_batchid(batchid)[0] for batchid in batchIDs_list])
         # query from cache
+        if self.cacheEnable:
+            query_cache = ScheddQueryCache(id=self.submissionHost)
+            job_ads_cache_dict = query_cache.get_job_ads(self.schedd, self.cacheRefreshInterval)
+            if allJobs:
+                tmpLog.debug("Query method: cache ; allJobs")
+                for batchid, job_ads_dict in job_ads_cache_dict.items():
+                    job_ads_all_dict[f"{self.submissionHost}#{batchid}"] = job_ads_dict
+                return job_ads_all_dict
+            tmpLog.debug(f"Query method: cache ; {len(batchIDs_set)} batchIDs")
+            for batchid in list(batchIDs_set):
+                job_ads_dict = job_ads_cache_dict.get(batchid)
+                if job_ads_dict is not None:
+                    job_ads_all_dict[f"{self.submissionHost}#{batchid}"] = job_ads_dict
+                    batchIDs_set.discard(batchid)
+            if len(batchIDs_set) == 0:
+                return job_ads_all_dict
 
-        def cache_query(constraint=None, projection=CONDOR_JOB_ADS_LIST, timeout=60):
-            # query from condor xquery and update cache to fifo
-            def update_cache(lockInterval=90):
-                tmpLog.debug("update_cache")
-                # acquire lock with score timestamp
-                score = time.time() - self.cacheRefreshInterval + lockInterval
-                lock_key = cache_fifo.lock(score=score)
-                if lock_key is not None:
-                    # acquired lock, update from condor schedd
-                    tmpLog.debug("got lock, updating cache")
-                    jobs_iter_orig = self.schedd.xquery(constraint=constraint, projection=projection)
-                    jobs_iter = []
-                    for job in jobs_iter_orig:
-                        try:
-                            jobs_iter.append(dict(job))
-                        except Exception as e:
-                            tmpLog.error(f"In updating cache schedd xquery; got exception {e.__class__.__name__}: {e} ; {repr(job)}")
-                    timeNow = time.time()
-                    cache_fifo.put(jobs_iter, timeNow)
-                    self.cache = (jobs_iter, timeNow)
-                    # release lock
-                    retVal = cache_fifo.unlock(key=lock_key)
-                    if retVal:
-                        tmpLog.debug("done update cache and unlock")
-                    else:
-                        tmpLog.warning("cannot unlock... Maybe something wrong")
-                    return jobs_iter
-                else:
-                    tmpLog.debug("cache fifo locked by other thread. Skipped")
-                    return None
-
-            # remove invalid or outdated caches from fifo
-
-            def cleanup_cache(timeout=60):
-                tmpLog.debug("cleanup_cache")
-                id_list = list()
-                attempt_timestamp = time.time()
-                n_cleanup = 0
-                while True:
-                    if time.time() > attempt_timestamp + timeout:
-                        tmpLog.debug("time is up when cleanup cache. Skipped")
-                        break
-                    peeked_tuple = cache_fifo.peek(skip_item=True)
-                    if peeked_tuple is None:
-                        tmpLog.debug("empty cache fifo")
-                        break
-                    elif peeked_tuple.score is not None and time.time() <= peeked_tuple.score + self.cacheRefreshInterval:
-                        tmpLog.debug("nothing expired")
-                        break
-                    elif peeked_tuple.id is not None:
-                        retVal = cache_fifo.delete([peeked_tuple.id])
-                        if isinstance(retVal, int):
-                            n_cleanup += retVal
-                    else:
-                        # problematic
-                        tmpLog.warning("got nothing when cleanup cache, maybe problematic. Skipped")
-                        break
-                tmpLog.debug(f"cleaned up {n_cleanup} objects in cache fifo")
-
-            # start
-            jobs_iter = tuple()
-            try:
-                attempt_timestamp = time.time()
-                while True:
-                    if time.time() > attempt_timestamp + timeout:
-                        # skip cache_query if too long
-                        tmpLog.debug(f"cache_query got timeout ({timeout} seconds). Skipped ")
-                        break
-                    # get latest cache
-                    peeked_tuple = cache_fifo.peeklast(skip_item=True)
-                    if peeked_tuple is not None and peeked_tuple.score is not None:
-                        # got something
-                        if peeked_tuple.id == cache_fifo.global_lock_id:
-                            if time.time() <= peeked_tuple.score + self.cacheRefreshInterval:
-                                # lock
-                                tmpLog.debug("got fifo locked. Wait and retry...")
-                                time.sleep(random.uniform(1, 5))
-                                continue
-                            else:
-                                # expired lock
-                                tmpLog.debug("got lock expired. Clean up and retry...")
-                                cleanup_cache()
-                                continue
-                        elif time.time() <= peeked_tuple.score + self.cacheRefreshInterval:
-                            # got valid cache
-                            _obj, _last_update = self.cache
-                            if _last_update >= peeked_tuple.score:
-                                # valid local cache
-                                tmpLog.debug("valid local cache")
-                                jobs_iter = _obj
-                            else:
-                                # valid fifo cache
-                                tmpLog.debug("update local cache from fifo")
-                                peeked_tuple_with_item = cache_fifo.peeklast()
-                                if (
-                                    peeked_tuple_with_item is not None
-                                    and peeked_tuple.id != cache_fifo.global_lock_id
-                                    and peeked_tuple_with_item.item is not None
-                                ):
-                                    jobs_iter = cache_fifo.decode(peeked_tuple_with_item.item)
-                                    self.cache = (jobs_iter, peeked_tuple_with_item.score)
-                                else:
-                                    tmpLog.debug("peeked invalid cache fifo object. Wait and retry...")
-                                    time.sleep(random.uniform(1, 5))
-                                    continue
-                        else:
-                            # cache expired
-                            tmpLog.debug("update cache in fifo")
-                            retVal = update_cache()
-                            if retVal is not None:
-                                jobs_iter = retVal
-                            cleanup_cache()
-                        break
-                    else:
-                        # no cache in fifo, check with size again
-                        if cache_fifo.size() == 0:
-                            if time.time() > attempt_timestamp + random.uniform(10, 30):
-                                # have waited for long enough, update cache
-                                tmpLog.debug("waited enough, update cache in fifo")
-                                retVal = update_cache()
-                                if retVal is not None:
-                                    jobs_iter = retVal
-                                break
-                            else:
-                                # still nothing, wait
-                                time.sleep(2)
-                        continue
-            except Exception as _e:
-                tb_str = traceback.format_exc()
-                tmpLog.error(f"Error querying from cache fifo; {_e} ; {tb_str}")
-            return jobs_iter
+        # query from index of completed jobs, which is updated incrementally
+        def history_index_query(constraint=None, projection=CONDOR_JOB_ADS_LIST):
+            history_index = ScheddHistoryIndex(id=self.submissionHost)
+            return history_index.get_job_ads(self.schedd, batchIDs_set, self.historyRefreshInterval, self.condorHistoryRetention)
 
         # query method options
         query_method_list = [self.schedd.xquery]
-        if self.cacheEnable:
-            cache_fifo = CondorQCacheFifo(target=self.submissionHost, id=f"{self.submissionHost},{get_ident()}")
-            query_method_list.insert(0, cache_query)
         if self.useCondorHistory:
+            if self.useCondorHistoryIncremental:
+                query_method_list.append(history_index_query)
             query_method_list.append(self.schedd.history)
         # Go
         for query_method in query_method_list:
-            # Make constraint
+            # Make constraint with remaining batch jobs
+            clusterids_set = set([get_job_id_tuple_from_batchid(batchid)[0] for batchid in batchIDs_set])
             clusterids_str = ",".join(list(clusterids_set))
-            if query_method is cache_query or allJobs:
+            if allJobs:
                 constraint = f'harvesterID =?= "{harvesterID}"'
             else:
                 constraint = f"member(ClusterID, {{{clusterids_str}}})"
@@ -5,11 +5,13 @@ from concurrent.futures import ThreadPoolExecutor as Pool
 import six
 from pandaharvester.harvesterconfig import harvester_config
 from pandaharvester.harvestercore import core_utils
+from pandaharvester.harvestercore.db_proxy_pool import DBProxyPool as DBProxy
 from pandaharvester.harvestercore.pilot_errors import PilotErrors
 from pandaharvester.harvestercore.plugin_base import PluginBase
 from pandaharvester.harvestercore.work_spec import WorkSpec
 from pandaharvester.harvestercore.worker_errors import WorkerErrors
 from pandaharvester.harvestermisc.htcondor_utils import (
+    CondorEventLogTailer,
     CondorJobManage,
     CondorJobQuery,
     condor_job_id_from_workspec,
@@ -225,10 +227,24 @@ class HTCondorMonitor(PluginBase):
             self.useCondorHistory
         except AttributeError:
             self.useCondorHistory = True
+        try:
+            self.useCondorHistoryIncremental
+        except AttributeError:
+            self.useCondorHistoryIncremental = False
+        try:
+            self.condorHistoryRetention
+        except AttributeError:
+            self.condorHistoryRetention = 86400
         try:
             self.submissionHost_list
         except AttributeError:
             self.submissionHost_list = []
+        # glob patterns of user job event logs to tail instead of querying schedd in report_updated_workers.
+        # a list for a single schedd, or a dict of submissionHost and glob patterns of the logs of each schedd
+        try:
+            self.eventLogPaths
+        except AttributeError:
+            self.eventLogPaths = []
         try:
             self.condorHostConfig_list
         except AttributeError:
@@ -245,7 +261,12 @@ class HTCondorMonitor(PluginBase):
             # Record batch job query result to this dict, with key = batchID
             try:
                 job_query = CondorJobQuery(
-                    cacheEnable=self.cacheEnable, cacheRefreshInterval=self.cacheRefreshInterval, useCondorHistory=self.useCondorHistory, id=submissionHost
+                    cacheEnable=self.cacheEnable,
+                    cacheRefreshInterval=self.cacheRefreshInterval,
+                    useCondorHistory=self.useCondorHistory,
+                    useCondorHistoryIncremental=self.useCondorHistoryIncremental,
+                    condorHistoryRetention=self.condorHistoryRetention,
+                    id=submissionHost,
                 )
                 host_job_ads_dict = job_query.get_all(batchIDs_list=batchIDs_list)
             except Exception as e:
@@ -267,6 +288,8 @@ class HTCondorMonitor(PluginBase):
         # Make logger for batch job query
         tmpLog = self.make_logger(baseLogger, method_name="report_updated_workers")
         tmpLog.debug("start")
+        if self.eventLogPaths:
+            return self.report_updated_workers_from_event_logs(time_window)
         # Get now timestamp
         timeNow = time.time()
         # Set of submission hosts
@@ -290,7 +313,12 @@ class HTCondorMonitor(PluginBase):
         for submissionHost in submission_host_set:
             try:
                 job_query = CondorJobQuery(
-                    cacheEnable=self.cacheEnable, cacheRefreshInterval=self.cacheRefreshInterval, useCondorHistory=self.useCondorHistory, id=submissionHost
+                    cacheEnable=self.cacheEnable,
+                    cacheRefreshInterval=self.cacheRefreshInterval,
+                    useCondorHistory=self.useCondorHistory,
+                    useCondorHistoryIncremental=self.useCondorHistoryIncremental,
+                    condorHistoryRetention=self.condorHistoryRetention,
+                    id=submissionHost,
                 )
                 job_ads_all_dict.update(job_query.get_all(allJobs=True))
                 tmpLog.debug(f"got information of condor jobs on {submissionHost}")
@@ -313,3 +341,40 @@ class HTCondorMonitor(PluginBase):
         tmpLog.debug(f"got {len(workers_to_check_list)} workers")
         tmpLog.debug("done")
         return workers_to_check_list
+
+    # report workers with state transitions in user job event logs
+    def report_updated_workers_from_event_logs(self, time_window):
+        tmpLog = self.make_logger(baseLogger, method_name="report_updated_workers_from_event_logs")
+        tmpLog.debug("start")
+        # logs of each schedd are matched with workers submitted to the schedd, since ClusterId.ProcId is unique only in a schedd
+        if isinstance(self.eventLogPaths, dict):
+            host_patterns_map = self.eventLogPaths
+        else:
+            host_patterns_map = {None: self.eventLogPaths}
+        workers_to_check_list = []
+        n_tracked = 0
+        stats = {"n_polls": 0, "n_events": 0, "n_transitions": 0}
+        for submission_host, path_patterns in host_patterns_map.items():
+            if isinstance(path_patterns, str):
+                path_patterns = [path_patterns]
+            tailer = CondorEventLogTailer(path_patterns, id=",".join(path_patterns))
+            transition_list = tailer.poll(time_window)
+            # latest transition per batch job
+            batchid_timestamp_dict = {}
+            for batchid, job_status, timestamp in transition_list:
+                batchid_timestamp_dict[batchid] = max(timestamp, batchid_timestamp_dict.get(batchid, 0))
+            if batchid_timestamp_dict:
+                batchid_workerids_dict = DBProxy().get_worker_ids_with_batch_ids(batchid_timestamp_dict.keys(), submission_host=submission_host)
+                for batchid, workerid_list in batchid_workerids_dict.items():
+                    for workerid in workerid_list:
+                        workers_to_check_list.append((workerid, batchid_timestamp_dict[batchid]))
+            n_tracked += len(tailer.job_status_dict)
+            for key in stats:
+                stats[key] += tailer.stats[key]
+        # only workers with state transitions are checked, while all jobs tracked would be queried from schedd without event logs
+        tmpLog.info(
+            f"got {len(workers_to_check_list)} workers to check out of {n_tracked} jobs tracked without schedd query; "
+            f"total {stats['n_events']} events and {stats['n_transitions']} transitions in {stats['n_polls']} polls"
+        )
+        tmpLog.debug("done")
+        return workers_to_check_list
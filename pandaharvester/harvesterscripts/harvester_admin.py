@@ -1,4 +1,5 @@
 import argparse
+import datetime
 import json
 import logging
 import os
@@ -11,6 +12,7 @@ from pandaharvester.harvesterconfig import harvester_config
 from pandaharvester.harvestercore import core_utils
 from pandaharvester.harvestercore import fifos as harvesterFifos
 from pandaharvester.harvestercore.db_proxy_pool import DBProxyPool as DBProxy
+from pandaharvester.harvestercore.job_spec import JobSpec
 from pandaharvester.harvestercore.work_spec import WorkSpec
 from pandaharvester.harvestermisc.selfcheck import harvesterPackageInfo
 
@@ -123,6 +125,8 @@ def get(arguments):
 def fifo_benchmark(arguments):
     n_object = arguments.n_object
     n_thread = arguments.n_thread
+    chunk_size = arguments.chunk_size
+    n_payload_items = 20
     mq = harvesterFifos.BenchmarkFIFO()
     sw = core_utils.get_stopwatch()
     sum_dict = {
@@ -175,6 +179,44 @@ def fifo_benchmark(arguments):
         print("Cleared fifo" + sw.get_elapsed_time())
         print(f"Now fifo size is {mq.size()}")
 
+    def payload_test():
+        # monitor fifo object with a chunk of workers similar to those populated from DB
+        time_now = datetime.datetime.utcnow()
+        workspec_list = []
+        for i_worker in range(chunk_size):
+            workspec = WorkSpec()
+            workspec.workerID = i_worker + 1
+            workspec.batchID = f"{1000000 + i_worker}.0"
+            workspec.computingSite = "BENCHMARK_QUEUE"
+            workspec.status = WorkSpec.ST_running
+            workspec.submissionHost = "submit.example.com,submit.example.com:9618"
+            workspec.accessPoint = f"/data/harvester/workers/{i_worker + 1}"
+            workspec.submitTime = time_now
+            workspec.modificationTime = time_now
+            workspec.workParams = {"lastCheckAt": time.time()}
+            workspec.workAttributes = {"batchLog": f"https://submit.example.com/logs/{i_worker}.log", "random": random.random()}
+            jobspec = JobSpec()
+            jobspec.PandaID = 5000000000 + i_worker
+            jobspec.jobParams = {"jobName": f"job_{i_worker}", "transformation": "runGen", "jobPars": "x" * 200}
+            workspec.set_jobspec_list([jobspec])
+            workspec.pandaid_list = [jobspec.PandaID]
+            workspec_list.append([workspec])
+        item = ("BENCHMARK_QUEUE", workspec_list)
+        for payload_format, encode_func, decode_func in [
+            ("pickle", mq.encode, mq.decode),
+            ("compact", harvesterFifos.encode_monitor_payload, harvesterFifos.decode_monitor_payload),
+        ]:
+            sw.reset()
+            for _ in range(n_payload_items):
+                item_serialized = encode_func(item)
+            encode_time = sw.get_elapsed_time_in_sec(True)
+            sw.reset()
+            for _ in range(n_payload_items):
+                decode_func(item_serialized)
+            decode_time = sw.get_elapsed_time_in_sec(True)
+            sum_dict[f"payload_{payload_format}"] = (len(item_serialized), encode_time, decode_time)
+            print(f"Encoded and decoded {n_payload_items} {payload_format} objects with {chunk_size} workers")
+
     # Benchmark
     print("Start fifo benchmark ...")
     mq.fifo.clear()
@@ -185,6 +227,7 @@ def fifo_benchmark(arguments):
     get_protective_test()
     put_test()
     clear_test()
+    payload_test()
     print("Finished fifo benchmark")
     # summary
     print("Summary:")
@@ -194,6 +237,13 @@ def fifo_benchmark(arguments):
     print(f"Get            : {1000.0 * sum_dict['get_time'] / n_object:.3f} ms / obj")
     print(f"Get protective : {1000.0 * sum_dict['get_protective_time'] / n_object:.3f} ms / obj")
     print(f"Clear          : {1000.0 * sum_dict['clear_time'] / n_object:.3f} ms / obj")
+    print(f"Payload of monitor fifo objects with {chunk_size} workers (decode of compact payload excludes reloading workers from DB)")
+    for payload_format in ["pickle", "compact"]:
+        n_bytes, encode_time, decode_time = sum_dict[f"payload_{payload_format}"]
+        print(
+            f"{payload_format:15}: {n_bytes} bytes / obj ({n_bytes / chunk_size:.1f} bytes / worker), "
+            f"encode {n_payload_items / max(encode_time, 1e-9):.1f} obj / s, decode {n_payload_items / max(decode_time, 1e-9):.1f} obj / s"
+        )
 
 
 def fifo_repopulate(arguments):
@@ -203,6 +253,57 @@ def fifo_repopulate(arguments):
         repopulate_fifos(*arguments.name_list)
 
 
+def fifo_stats(arguments):
+    dbProxy = DBProxy()
+    last_update = datetime.datetime.utcnow() - datetime.timedelta(minutes=arguments.minutes)
+    service_metrics_list = dbProxy.get_service_metrics(last_update)
+    # merge metrics of FIFOs in time order
+    stats_dict = {}
+    for _, _, metrics_json in sorted(service_metrics_list, key=lambda x: str(x[0])):
+        fifo_metrics = json.loads(metrics_json).get("fifo", {})
+        for fifo_name, metrics in fifo_metrics.items():
+            stats = stats_dict.setdefault(fifo_name, {"backend": None, "n_put": 0, "n_get": 0, "n_get_empty": 0, "n_delete": 0, "n_requeued": 0, "size": []})
+            stats["backend"] = metrics.get("backend", stats["backend"])
+            for counter in ["n_put", "n_get", "n_get_empty", "n_delete", "n_requeued"]:
+                stats[counter] += metrics.get(counter, 0)
+            if "size" in metrics:
+                stats["size"].append(metrics["size"])
+            for metric in ["put_time", "get_time", "get_wait_time", "peek_time", "delete_time", "overhead_time"]:
+                if metric not in metrics:
+                    continue
+                histogram = core_utils.Histogram.from_dict(metrics[metric])
+                if metric in stats:
+                    stats[metric].merge(histogram)
+                else:
+                    stats[metric] = histogram
+    if arguments.json:
+        json_print(
+            {fifo_name: {k: (v.to_dict() if isinstance(v, core_utils.Histogram) else v) for k, v in stats.items()} for fifo_name, stats in stats_dict.items()}
+        )
+        return
+    empty_histogram = core_utils.Histogram()
+    period = arguments.minutes * 60
+    print(f"Metrics of FIFOs in the last {arguments.minutes} minutes (rate in /sec, time in sec)")
+    print(
+        f"{'fifo':24} {'backend':12} {'put_rate':>9} {'get_rate':>9} {'size':>7} {'size_min':>8} {'size_max':>8} "
+        f"{'put_avg':>9} {'put_p95':>9} {'get_avg':>9} {'get_p95':>9} {'wait_avg':>9} {'wait_p95':>9} {'ovh_avg':>9} {'ovh_p95':>9} {'ovh_max':>9}"
+    )
+    for fifo_name, stats in sorted(stats_dict.items()):
+        put_time = stats.get("put_time", empty_histogram)
+        get_time = stats.get("get_time", empty_histogram)
+        get_wait_time = stats.get("get_wait_time", empty_histogram)
+        overhead_time = stats.get("overhead_time", empty_histogram)
+        size_list = stats["size"] or [0]
+        print(
+            f"{fifo_name:24} {str(stats['backend']):12} {stats['n_put'] / period:9.3f} {stats['n_get'] / period:9.3f} "
+            f"{size_list[-1]:7d} {min(size_list):8d} {max(size_list):8d} "
+            f"{put_time.sum / max(sum(put_time.counts), 1):9.4f} {put_time.percentile(95) or 0:9.4f} "
+            f"{get_time.sum / max(sum(get_time.counts), 1):9.4f} {get_time.percentile(95) or 0:9.4f} "
+            f"{get_wait_time.sum / max(sum(get_wait_time.counts), 1):9.3f} {get_wait_time.percentile(95) or 0:9.3f} "
+            f"{overhead_time.sum / max(sum(overhead_time.counts), 1):9.3f} {overhead_time.percentile(95) or 0:9.3f} {overhead_time.max:9.3f}"
+        )
+
+
 def cacher_refresh(arguments):
     from pandaharvester.harvesterbody.cacher import Cacher
     from pandaharvester.harvestercore.communicator_pool import CommunicatorPool
@@ -307,6 +408,77 @@ def query_workers(arguments):
         raise
 
 
+def query_dbpool(arguments):
+    dbProxy = DBProxy()
+    last_update = datetime.datetime.utcnow() - datetime.timedelta(minutes=arguments.minutes)
+    service_metrics_list = dbProxy.get_service_metrics(last_update)
+    # merge metrics of DB connection pool
+    stats_dict = {}
+    for _, _, metrics_json in service_metrics_list:
+        db_pool_metrics = json.loads(metrics_json).get("db_pool", {})
+        for method_name, metrics in db_pool_metrics.items():
+            stats = stats_dict.setdefault(method_name, {"n_calls": 0, "n_replica_calls": 0})
+            stats["n_calls"] += metrics.get("n_calls", 0)
+            stats["n_replica_calls"] += metrics.get("n_replica_calls", 0)
+            for metric in ["wait_time", "exec_time"]:
+                if metric not in metrics:
+                    continue
+                histogram = core_utils.Histogram.from_dict(metrics[metric])
+                if metric in stats:
+                    stats[metric].merge(histogram)
+                else:
+                    stats[metric] = histogram
+    if arguments.json:
+        json_print(
+            {
+                method_name: {k: (v.to_dict() if isinstance(v, core_utils.Histogram) else v) for k, v in stats.items()}
+                for method_name, stats in stats_dict.items()
+            }
+        )
+        return
+    # sort by total waiting time
+    empty_histogram = core_utils.Histogram()
+
+    def _total_wait(item):
+        return item[1].get("wait_time", empty_histogram).sum
+
+    print(f"Metrics of DB connection pool in the last {arguments.minutes} minutes (time in sec)")
+    print(f"{'method':40} {'n_calls':>8} {'replica':>8} {'wait_avg':>9} {'wait_p95':>9} {'wait_max':>9} {'exec_avg':>9} {'exec_p95':>9} {'exec_max':>9}")
+    for method_name, stats in sorted(stats_dict.items(), key=_total_wait, reverse=True):
+        wait_time = stats.get("wait_time", empty_histogram)
+        exec_time = stats.get("exec_time", empty_histogram)
+        n_calls = max(stats["n_calls"], 1)
+        print(
+            f"{method_name:40} {stats['n_calls']:8d} {stats['n_replica_calls']:8d} {wait_time.sum / n_calls:9.3f} {wait_time.percentile(95) or 0:9.3f} {wait_time.max:9.3f} "
+            f"{exec_time.sum / n_calls:9.3f} {exec_time.percentile(95) or 0:9.3f} {exec_time.max:9.3f}"
+        )
+
+
+def db_index(arguments):
+    from pandaharvester.harvestercore.index_advisor import IndexAdvisor
+
+    advisor = IndexAdvisor()
+    if arguments.migrate:
+        if not advisor.migrate():
+            mainLogger.critical("Failed to migrate schema. See panda-db_proxy.log")
+            return 1
+    report = advisor.make_report()
+    if arguments.json:
+        json_print(report)
+        return
+    print(f"Query plans of hot statements on {report['engine']} with schema version {report['schema_version']}")
+    for item in report["statements"]:
+        print(f"\n[{item['method']}] {item['sql']}")
+        for step in item["plan"]:
+            print(f"  {step['scan']:16} table={step['table']} index={step['index']} : {step['detail']}")
+    print(f"\n{len(report['full_scans'])} full table scans")
+    for item in report["full_scans"]:
+        print(f"  {item['method']:30} {item['table']}")
+    print(f"{len(report['missing_indexes'])} declared composite indexes missing")
+    for item in report["missing_indexes"]:
+        print(f"  {item['index']} on {item['table']}({','.join(item['columns'])})")
+
+
 # === Command map =======================================================
 
 
@@ -318,6 +490,7 @@ commandMap = {
     # fifo commands
     "fifo_benchmark": fifo_benchmark,
     "fifo_repopulate": fifo_repopulate,
+    "fifo_stats": fifo_stats,
     # cacher commands
     "cacher_refresh": cacher_refresh,
     # qconf commands
@@ -329,6 +502,9 @@ commandMap = {
     "kill_workers": kill_workers,
     # query commands
     "query_workers": query_workers,
+    "query_dbpool": query_dbpool,
+    # db commands
+    "db_index": db_index,
 }
 
 # === Main ======================================================
@@ -357,6 +533,16 @@ def main():
     fifo_benchmark_parser.set_defaults(which="fifo_benchmark")
     fifo_benchmark_parser.add_argument("-n", type=int, dest="n_object", action="store", default=500, metavar="<N>", help="Benchmark with N objects")
     fifo_benchmark_parser.add_argument("-t", type=int, dest="n_thread", action="store", default=1, metavar="<N>", help="Benchmark with N threads")
+    fifo_benchmark_parser.add_argument(
+        "-c", type=int, dest="chunk_size", action="store", default=500, metavar="<N>", help="Benchmark payload of monitor fifo objects with N workers"
+    )
+    # fifo stats command
+    fifo_stats_parser = fifo_subparsers.add_parser("stats", help="Show enqueue/dequeue rates, depth, latency, and overhead time of FIFOs")
+    fifo_stats_parser.set_defaults(which="fifo_stats")
+    fifo_stats_parser.add_argument(
+        "-m", "--minutes", dest="minutes", type=int, action="store", default=60, metavar="<N>", help="Use metrics in the last N minutes"
+    )
+    fifo_stats_parser.add_argument("-J", "--json", dest="json", action="store_true", help="Show results in JSON format")
     # fifo repopuate command
     fifo_repopulate_parser = fifo_subparsers.add_parser("repopulate", help="Repopulate agent fifo")
     fifo_repopulate_parser.set_defaults(which="fifo_repopulate")
@@ -435,6 +621,22 @@ def main():
     query_workers_parser.set_defaults(which="query_workers")
     query_workers_parser.add_argument("-a", "--all", dest="all", action="store_true", help="Show results of all queues")
     query_workers_parser.add_argument("queue_list", nargs="*", type=str, action="store", metavar="<queue_name>", help="Name of active queue")
+    # query dbpool command
+    query_dbpool_parser = query_subparsers.add_parser("dbpool", help="Query waiting and execution time of DB connection pool per method")
+    query_dbpool_parser.set_defaults(which="query_dbpool")
+    query_dbpool_parser.add_argument(
+        "-m", "--minutes", dest="minutes", type=int, action="store", default=60, metavar="<N>", help="Use metrics in the last N minutes"
+    )
+    query_dbpool_parser.add_argument("-J", "--json", dest="json", action="store_true", help="Show results in JSON format")
+
+    # db parser
+    db_parser = subparsers.add_parser("db", help="database related")
+    db_subparsers = db_parser.add_subparsers()
+    # db index command
+    db_index_parser = db_subparsers.add_parser("index", help="Show query plans of hot statements and missing composite indexes")
+    db_index_parser.set_defaults(which="db_index")
+    db_index_parser.add_argument("-J", "--json", dest="json", action="store_true", help="Show results in JSON format")
+    db_index_parser.add_argument("--migrate", dest="migrate", action="store_true", help="Make declared composite indexes through schema migration")
 
     # start parsing
     if len(sys.argv) == 1:
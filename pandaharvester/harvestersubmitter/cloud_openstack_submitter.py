@@ -38,7 +38,9 @@ def _make_init_script(workspec, template_str):
 
     # make init tempfile
     tmpFile = tempfile.NamedTemporaryFile(mode="w", delete=False, suffix="_init.sh", dir=workspec.get_access_point())
-    new_template_str = _init_script_replace(template_str, **workspec.__dict__)
+    # attributes of the worker and other fields of WorkSpec which used to be in __dict__ before slots
+    macro_kwarg = {attr: getattr(workspec, attr) for attr in workspec.attributes + workspec.extraAttrs}
+    new_template_str = _init_script_replace(template_str, **macro_kwarg)
     tmpFile.write(new_template_str)
     tmpFile.close()
     tmpLog.debug("done")
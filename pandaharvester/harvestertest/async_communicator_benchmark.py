@@ -0,0 +1,141 @@
+"""
+benchmark of CommunicatorPool with PandaCommunicator and AsyncPandaCommunicator against a local mock PanDA server with simulated latency,
+where many threads call update_workers concurrently like agents. PandaCommunicator is run with the default number of connections
+and with more connections, i.e. more instances, while AsyncPandaCommunicator shares one instance with a connection pool
+
+usage: python async_communicator_benchmark.py [n_threads] [n_requests_per_thread] [latency_sec] [n_connections]
+
+"""
+
+import json
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from pandaharvester.harvesterconfig import harvester_config
+from pandaharvester.harvestercore.communicator_pool import CommunicatorPool
+from pandaharvester.harvestercore.work_spec import WorkSpec
+
+nThreads = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+nRequestsPerThread = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.2
+nConnections = int(sys.argv[4]) if len(sys.argv) > 4 else 50
+
+tmpDir = tempfile.mkdtemp()
+
+# max number of requests in flight at the server
+serverStats = {"inFlight": 0, "maxInFlight": 0}
+serverStatsLock = threading.Lock()
+
+
+# make self-signed certificate and key
+def make_cert(name):
+    cert_file = os.path.join(tmpDir, f"{name}.crt")
+    key_file = os.path.join(tmpDir, f"{name}.key")
+    subprocess.check_call(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost"]
+        + ["-keyout", key_file, "-out", cert_file],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return cert_file, key_file
+
+
+# handler emulating updateWorkers of the panda server with latency
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        data = parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode())
+        with serverStatsLock:
+            serverStats["inFlight"] += 1
+            serverStats["maxInFlight"] = max(serverStats["maxInFlight"], serverStats["inFlight"])
+        time.sleep(latency)
+        with serverStatsLock:
+            serverStats["inFlight"] -= 1
+        body = json.dumps([True, [True for _ in json.loads(data["workers"][0])]]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+# server accepting many connections at once
+class Server(ThreadingHTTPServer):
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+# start server
+serverCert, serverKey = make_cert("server")
+clientCert, clientKey = make_cert("client")
+context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+context.load_cert_chain(serverCert, serverKey)
+context.load_verify_locations(clientCert)
+context.verify_mode = ssl.CERT_REQUIRED
+server = Server(("localhost", 0), Handler)
+server.socket = context.wrap_socket(server.socket, server_side=True)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+harvester_config.pandacon.pandaURLSSL = f"https://localhost:{server.server_address[1]}/server/panda"
+harvester_config.pandacon.ca_cert = serverCert
+harvester_config.pandacon.cert_file = clientCert
+harvester_config.pandacon.key_file = clientKey
+harvester_config.pandacon.auth_type = "x509"
+harvester_config.pandacon.verbose = False
+harvester_config.communicator.nInFlightRequests = nThreads
+
+
+# call update_workers from threads through CommunicatorPool and return requests/s, number of OK, max requests in flight, and number of instances
+def run(module_name, class_name, n_connections):
+    harvester_config.communicator.moduleName = module_name
+    harvester_config.communicator.className = class_name
+    harvester_config.communicator.nConnections = n_connections
+    harvester_config.pandacon.asyncConnectionPoolSize = n_connections
+    communicator = CommunicatorPool()
+    nInstances = len(set(id(con) for con in communicator.pool.queue))
+    serverStats["maxInFlight"] = 0
+
+    def _update_workers(i_thread):
+        nOK = 0
+        for i_request in range(nRequestsPerThread):
+            workSpec = WorkSpec()
+            workSpec.workerID = i_thread * nRequestsPerThread + i_request
+            workSpec.status = "running"
+            retList, _ = communicator.update_workers([workSpec])
+            nOK += retList == [True]
+        return nOK
+
+    with ThreadPoolExecutor(nThreads) as pool:
+        timeStart = time.monotonic()
+        nOK = sum(pool.map(_update_workers, range(nThreads)))
+        elapsed = time.monotonic() - timeStart
+    return nThreads * nRequestsPerThread / elapsed, nOK, serverStats["maxInFlight"], nInstances
+
+
+print(f"update_workers by {nThreads} threads x {nRequestsPerThread} requests with {latency} sec latency")
+allOK = True
+for label, module_name, class_name, n_connections in [
+    ("PandaCommunicator", "pandaharvester.harvestercommunicator.panda_communicator", "PandaCommunicator", 5),
+    ("PandaCommunicator", "pandaharvester.harvestercommunicator.panda_communicator", "PandaCommunicator", nConnections),
+    ("AsyncPandaCommunicator", "pandaharvester.harvestercommunicator.async_panda_communicator", "AsyncPandaCommunicator", nConnections),
+]:
+    rate, nOK, maxInFlight, nInstances = run(module_name, class_name, n_connections)
+    allOK = allOK and nOK == nThreads * nRequestsPerThread
+    print(
+        f"{label:22} {n_connections:3d} connections: {rate:7.1f} requests/s, {nOK}/{nThreads * nRequestsPerThread} succeeded, "
+        f"max {maxInFlight:3d} requests in flight at the server, {nInstances:3d} instances"
+    )
+server.shutdown()
+sys.exit(0 if allOK else 1)
@@ -0,0 +1,145 @@
+"""
+benchmark of aggregate query throughput of monitor/submitter/propagator-like threads
+with the global connection lock and with concurrent reads on sqlite
+
+usage: python db_concurrency_benchmark.py [n_workers] [n_threads_per_agent] [duration_sec]
+
+"""
+
+import datetime
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from pandaharvester.harvesterconfig import harvester_config
+from pandaharvester.harvestercore import db_proxy
+from pandaharvester.harvestercore.event_spec import EventSpec
+from pandaharvester.harvestercore.file_spec import FileSpec
+from pandaharvester.harvestercore.job_spec import JobSpec
+from pandaharvester.harvestercore.job_worker_relation_spec import JobWorkerRelationSpec
+from pandaharvester.harvestercore.panda_queue_spec import PandaQueueSpec
+from pandaharvester.harvestercore.work_spec import WorkSpec
+
+nWorkers = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+nThreads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+duration = float(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+# use scratch databases
+tmpDir = tempfile.mkdtemp()
+harvester_config.db.engine = "sqlite"
+harvester_config.db.verbose = False
+
+
+# fill tables
+def fill_tables():
+    proxy = db_proxy.DBProxy()
+    proxy.make_table(WorkSpec, db_proxy.workTableName)
+    proxy.make_table(JobSpec, db_proxy.jobTableName)
+    proxy.make_table(FileSpec, db_proxy.fileTableName)
+    proxy.make_table(EventSpec, db_proxy.eventTableName)
+    proxy.make_table(JobWorkerRelationSpec, db_proxy.jobWorkerTableName)
+    proxy.make_table(PandaQueueSpec, db_proxy.pandaQueueTableName)
+    timeNow = datetime.datetime.utcnow()
+    workSpecs = []
+    jobSpecs = []
+    relSpecs = []
+    for i in range(nWorkers):
+        workSpec = WorkSpec()
+        workSpec.workerID = i + 1
+        workSpec.computingSite = f"SITE_{i % 20}"
+        workSpec.status = [WorkSpec.ST_submitted, WorkSpec.ST_running, WorkSpec.ST_finished][i % 3]
+        workSpec.modificationTime = timeNow - datetime.timedelta(hours=1)
+        workSpec.mapType = WorkSpec.MT_OneToOne
+        workSpec.resourceType = "SCORE"
+        workSpec.jobType = "managed"
+        workSpec.hasJob = 1
+        workSpec.nJobs = 1
+        workSpecs.append(workSpec.values_list())
+        jobSpec = JobSpec()
+        jobSpec.PandaID = i + 1
+        jobSpec.computingSite = workSpec.computingSite
+        jobSpec.status = "running"
+        jobSpec.subStatus = "running"
+        jobSpec.modificationTime = workSpec.modificationTime
+        jobSpec.propagatorTime = workSpec.modificationTime
+        jobSpecs.append(jobSpec.values_list())
+        relSpec = JobWorkerRelationSpec()
+        relSpec.PandaID = jobSpec.PandaID
+        relSpec.workerID = workSpec.workerID
+        relSpecs.append(relSpec.values_list())
+    sql = f"INSERT INTO {db_proxy.workTableName} ({WorkSpec.column_names()}) {WorkSpec.bind_values_expression()}"
+    proxy.executemany(sql, workSpecs)
+    sql = f"INSERT INTO {db_proxy.jobTableName} ({JobSpec.column_names()}) {JobSpec.bind_values_expression()}"
+    proxy.executemany(sql, jobSpecs)
+    sql = f"INSERT INTO {db_proxy.jobWorkerTableName} ({JobWorkerRelationSpec.column_names()}) {JobWorkerRelationSpec.bind_values_expression()}"
+    proxy.executemany(sql, relSpecs)
+    proxy.commit()
+
+
+# agent-like query mixes
+def monitor_cycle(proxy, i_loop):
+    proxy.get_workers_to_update(20, 0, 600, f"monitor-{threading.get_ident()}")
+    for workerID in range(i_loop % nWorkers + 1, min(i_loop % nWorkers + 21, nWorkers + 1)):
+        proxy.get_worker_with_id(workerID)
+    return 21
+
+
+def submitter_cycle(proxy, i_loop):
+    proxy.get_worker_stats_full()
+    proxy.get_worker_stats(f"SITE_{i_loop % 20}")
+    return 2
+
+
+def propagator_cycle(proxy, i_loop):
+    proxy.get_workers_to_propagate(50, 0)
+    proxy.get_jobs_to_propagate(50, 600, 0, f"propagator-{threading.get_ident()}")
+    return 2
+
+
+# run benchmark in a mode
+def run_benchmark(concurrent_read):
+    harvester_config.db.sqliteConcurrentRead = concurrent_read
+    harvester_config.db.database_filename = os.path.join(tmpDir, f"benchmark_{concurrent_read}.db")
+    print(f"Filling {nWorkers} workers in {harvester_config.db.database_filename}")
+    fill_tables()
+    counts = {}
+    stopTime = time.time() + duration
+
+    def _run(name, func):
+        proxy = db_proxy.DBProxy(thr_name=name)
+        nCalls = 0
+        iLoop = 0
+        while time.time() < stopTime:
+            nCalls += func(proxy, iLoop)
+            iLoop += 1
+        counts[name] = nCalls
+
+    thrList = []
+    for agentName, func in [("monitor", monitor_cycle), ("submitter", submitter_cycle), ("propagator", propagator_cycle)]:
+        for iThr in range(nThreads):
+            thr = threading.Thread(target=_run, args=(f"{agentName}-{iThr}", func))
+            thrList.append(thr)
+    for thr in thrList:
+        thr.start()
+    for thr in thrList:
+        thr.join()
+    return counts
+
+
+results = {}
+for concurrentRead in [False, True]:
+    label = "concurrent read" if concurrentRead else "global lock"
+    counts = run_benchmark(concurrentRead)
+    results[label] = counts
+print(f"Benchmark with {nThreads} threads per agent for {duration} sec")
+print(f"{'mode':20} {'monitor':>10} {'submitter':>10} {'propagator':>10} {'total/s':>10}")
+for label, counts in results.items():
+    sums = {}
+    for name, nCalls in counts.items():
+        agentName = name.split("-")[0]
+        sums.setdefault(agentName, 0)
+        sums[agentName] += nCalls
+    total = sum(sums.values()) / duration
+    print(f"{label:20} {sums['monitor']:10d} {sums['submitter']:10d} {sums['propagator']:10d} {total:10.1f}")
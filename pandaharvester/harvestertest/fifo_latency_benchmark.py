@@ -0,0 +1,68 @@
+"""
+benchmark of latency between put and get of the sqlite fifo with the polling dequeue and the blocking dequeue,
+with a putter in the same process and in another process
+
+usage: python fifo_latency_benchmark.py [n_objects] [max_put_interval_sec]
+
+"""
+
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from pandaharvester.harvesterfifo.sqlite_fifo import SqliteFifo
+
+nObjects = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+maxPutInterval = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+
+tmpDir = tempfile.mkdtemp()
+
+
+# make fifo
+def make_fifo(title_name, blocking_dequeue=True):
+    return SqliteFifo(titleName=title_name, database_filename=os.path.join(tmpDir, f"{title_name}.db"), blockingDequeue=blocking_dequeue)
+
+
+# put objects with timestamps at random intervals
+def put_objects(title_name):
+    fifo = make_fifo(title_name)
+    for _ in range(nObjects):
+        time.sleep(random.uniform(0, maxPutInterval))
+        fifo.put(struct.pack("!d", time.time()), time.time())
+
+
+# get objects and measure latency
+def run(title_name, blocking_dequeue, other_process):
+    fifo = make_fifo(title_name, blocking_dequeue)
+    if other_process:
+        putter = multiprocessing.Process(target=put_objects, args=(title_name,))
+    else:
+        putter = threading.Thread(target=put_objects, args=(title_name,))
+    putter.start()
+    latencies = []
+    nEmptyPolls = 0
+    while len(latencies) < nObjects:
+        obj = fifo.get(timeout=10)
+        if obj is None:
+            nEmptyPolls += 1
+            continue
+        latencies.append(time.time() - struct.unpack("!d", obj[1])[0])
+    putter.join()
+    latencies.sort()
+    return sum(latencies) / len(latencies), latencies[int(0.95 * (len(latencies) - 1))], latencies[-1]
+
+
+print(f"Latency of {nObjects} objects put at random intervals up to {maxPutInterval} sec")
+print(f"{'dequeue':10} {'putter':15} {'avg':>9} {'p95':>9} {'max':>9}")
+for blockingDequeue in [False, True]:
+    for otherProcess in [False, True]:
+        titleName = f"latency_{blockingDequeue}_{otherProcess}"
+        latencyAvg, latencyP95, latencyMax = run(titleName, blockingDequeue, otherProcess)
+        label = "blocking" if blockingDequeue else "polling"
+        putterLabel = "other process" if otherProcess else "same process"
+        print(f"{label:10} {putterLabel:15} {1000 * latencyAvg:6.1f} ms {1000 * latencyP95:6.1f} ms {1000 * latencyMax:6.1f} ms")
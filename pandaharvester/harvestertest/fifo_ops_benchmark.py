@@ -0,0 +1,77 @@
+"""
+benchmark of ops/s of fifo plugins for put, peek, protective get with delete, and putmany/getmany.
+redis_fifo is skipped if redis is not available
+
+usage: python fifo_ops_benchmark.py [n_objects] [item_size]
+
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+from pandaharvester.harvesterfifo.memory_fifo import MemoryFifo
+from pandaharvester.harvesterfifo.sqlite_fifo import SqliteFifo
+
+nObjects = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+itemSize = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+tmpDir = tempfile.mkdtemp()
+item = os.urandom(itemSize)
+
+
+# make fifos to compare
+def make_fifos():
+    fifoList = [
+        ("memory_fifo", MemoryFifo(titleName="ops_benchmark")),
+        ("sqlite_fifo", SqliteFifo(titleName="ops_benchmark", database_filename=os.path.join(tmpDir, "ops_benchmark.db"))),
+    ]
+    try:
+        from pandaharvester.harvesterfifo.redis_fifo import RedisFifo
+
+        fifo = RedisFifo(titleName="ops_benchmark")
+        fifo.clear()
+        fifoList.append(("redis_fifo", fifo))
+    except Exception as e:
+        print(f"skipped redis_fifo : {e.__class__.__name__} {e}")
+    return fifoList
+
+
+# run operations and return ops/s
+def run(fifo):
+    scores = [random.uniform(0, 1000) for _ in range(nObjects)]
+    results = []
+    # put
+    timeStart = time.monotonic()
+    for score in scores:
+        fifo.put(item, score)
+    results.append(nObjects / (time.monotonic() - timeStart))
+    # peek
+    timeStart = time.monotonic()
+    for _ in range(nObjects):
+        fifo.peek(skip_item=True)
+    results.append(nObjects / (time.monotonic() - timeStart))
+    # protective get and delete like the monitor
+    timeStart = time.monotonic()
+    for _ in range(nObjects):
+        id, _, _ = fifo.get(timeout=1, protective=True)
+        fifo.delete([id])
+    results.append(nObjects / (time.monotonic() - timeStart))
+    # putmany and getmany in chunks
+    chunkSize = 100
+    timeStart = time.monotonic()
+    for i in range(0, nObjects, chunkSize):
+        fifo.putmany([(item, score) for score in scores[i : i + chunkSize]])
+    while fifo.getmany(count=chunkSize):
+        pass
+    results.append(2 * nObjects / (time.monotonic() - timeStart))
+    return results
+
+
+print(f"ops/s of fifo plugins with {nObjects} objects of {itemSize} bytes")
+print(f"{'plugin':12} {'put':>10} {'peek':>10} {'get+delete':>10} {'putmany+getmany':>16}")
+for name, fifo in make_fifos():
+    putRate, peekRate, getRate, manyRate = run(fifo)
+    print(f"{name:12} {putRate:10.0f} {peekRate:10.0f} {getRate:10.0f} {manyRate:16.0f}")
@@ -0,0 +1,95 @@
+"""
+replay recorded HTCondor user job event logs in htcondor_event_logs/ to check state transitions got by CondorEventLogTailer,
+and compare the number of workers checked with event logs and the number of jobs queried from schedd by polling
+
+usage: python htcondor_event_log_tailer_test.py [cycle_in_sec]
+
+"""
+
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from pandaharvester.harvestermisc.htcondor_utils import CondorEventLogTailer
+
+cycleTime = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+
+fixtureDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "htcondor_event_logs")
+tmpDir = tempfile.mkdtemp()
+
+# expected final JobStatus of jobs in fixtures
+expectedStatusMap = {
+    "1001.0": 4,
+    "1002.0": 2,
+    "1003.0": 2,
+    "1003.1": 3,
+}
+
+# split fixtures into events with timestamps
+eventList = []
+for fixturePath in sorted(glob.glob(os.path.join(fixtureDir, "*.log"))):
+    with open(fixturePath, "rb") as f:
+        data = f.read()
+    for eventData in data.split(CondorEventLogTailer.event_separator):
+        if not eventData.strip():
+            continue
+        eventData += CondorEventLogTailer.event_separator
+        timeStr = " ".join(eventData.decode().split()[2:4])
+        eventList.append((CondorEventLogTailer.parse_event_time(timeStr), os.path.basename(fixturePath), eventData))
+eventList.sort(key=lambda x: x[0])
+
+# append events to logs cycle by cycle as the schedd writes them, and poll
+tailer = CondorEventLogTailer([os.path.join(tmpDir, "*.log")], id=tmpDir)
+timeWindow = 10 * 365 * 24 * 3600
+lastStatusMap = {}
+nChecked = 0
+nQueried = 0
+cycleEnd = eventList[0][0] + cycleTime
+iEvent = 0
+print(f"{'cycle':>5} {'events':>6} {'transitions':>11} {'checked':>7} {'queried':>7}")
+iCycle = 0
+while iEvent < len(eventList):
+    nEvents = 0
+    while iEvent < len(eventList) and eventList[iEvent][0] < cycleEnd:
+        _, fileName, eventData = eventList[iEvent]
+        with open(os.path.join(tmpDir, fileName), "ab") as f:
+            f.write(eventData)
+        iEvent += 1
+        nEvents += 1
+    # jobs to query from schedd by polling are all jobs not in final states
+    nQueried += len([batchid for batchid, status in lastStatusMap.items() if status not in (3, 4)])
+    transitionList = tailer.poll(timeWindow)
+    checkedSet = set()
+    for batchid, status, timestamp in transitionList:
+        lastStatusMap[batchid] = status
+        checkedSet.add(batchid)
+    nChecked += len(checkedSet)
+    print(f"{iCycle:5d} {nEvents:6d} {len(transitionList):11d} {len(checkedSet):7d} {nQueried:7d}")
+    cycleEnd += cycleTime
+    iCycle += 1
+
+# check timestamp in the old format without year
+oldFormatOK = time.localtime(CondorEventLogTailer.parse_event_time("03/01 10:02:00"))[:5] == (time.localtime().tm_year, 3, 1, 10, 2)
+
+# check with a partial event which should not be read until completed
+with open(os.path.join(tmpDir, "grid.1002.0.log"), "ab") as f:
+    f.write(b"005 (1002.000.000) 2024-03-01 11:30:00 Job terminated.\n")
+partialOK = tailer.poll(timeWindow) == []
+with open(os.path.join(tmpDir, "grid.1002.0.log"), "ab") as f:
+    f.write(b"\t(1) Normal termination (return value 0)\n...\n")
+transitionList = tailer.poll(timeWindow)
+partialOK = partialOK and [(batchid, status) for batchid, status, _ in transitionList] == [("1002.0", 4)]
+shutil.rmtree(tmpDir)
+
+print(f"\nworkers checked with event logs: {nChecked} ; jobs queried from schedd by polling: {nQueried}")
+if nQueried > 0:
+    print(f"reduction of queried jobs: {100 * (1 - nChecked / nQueried):.1f} %")
+print(f"stats: {tailer.stats}")
+statusOK = lastStatusMap == expectedStatusMap
+print(f"final job status : {'OK' if statusOK else 'NG'} {lastStatusMap}")
+print(f"partial event    : {'OK' if partialOK else 'NG'}")
+print(f"old time format  : {'OK' if oldFormatOK else 'NG'}")
+sys.exit(0 if statusOK and partialOK and oldFormatOK else 1)
@@ -0,0 +1,202 @@
+"""
+benchmark of a JobFetcher cycle for many queues, with getJob against a local mock PanDA server with simulated latency
+and insert_jobs into a scratch sqlite database, comparing the per-queue serial path and the bulk path with concurrent getJob
+and one insert_jobs per cycle
+
+usage: python job_fetcher_benchmark.py [n_queues] [n_jobs_per_queue] [latency_sec] [max_concurrent_requests]
+
+"""
+
+import json
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from pandaharvester.harvestercommunicator.panda_communicator import PandaCommunicator
+from pandaharvester.harvesterconfig import harvester_config
+from pandaharvester.harvestercore import db_proxy
+from pandaharvester.harvestercore.event_spec import EventSpec
+from pandaharvester.harvestercore.file_spec import FileSpec
+from pandaharvester.harvestercore.job_spec import JobSpec
+from pandaharvester.harvestercore.job_worker_relation_spec import JobWorkerRelationSpec
+
+nQueues = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+nJobsPerQueue = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.2
+maxConcurrentRequests = int(sys.argv[4]) if len(sys.argv) > 4 else 8
+
+tmpDir = tempfile.mkdtemp()
+harvester_config.db.engine = "sqlite"
+harvester_config.db.verbose = False
+
+# PandaIDs given by the mock server
+pandaIDs = {"next": 1}
+pandaIDsLock = threading.Lock()
+
+
+# make self-signed certificate and key
+def make_cert(name):
+    cert_file = os.path.join(tmpDir, f"{name}.crt")
+    key_file = os.path.join(tmpDir, f"{name}.key")
+    subprocess.check_call(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost"]
+        + ["-keyout", key_file, "-out", cert_file],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return cert_file, key_file
+
+
+# make job JSON like the panda server
+def make_job(panda_id, site_name):
+    return {
+        "PandaID": panda_id,
+        "taskID": 1000,
+        "attemptNr": 1,
+        "jobsetID": "NULL",
+        "currentPriority": 1000,
+        "prodSourceLabel": "managed",
+        "computingSite": site_name,
+        "inFiles": f"EVNT.{panda_id}._000001.pool.root.1",
+        "GUID": f"{panda_id:032X}",
+        "fsize": "1000000",
+        "checksum": "ad:12345678",
+        "scopeIn": "mc23",
+        "realDatasetsIn": "mc23.EVNT",
+        "ddmEndPointIn": "SITE_DATADISK",
+        "outFiles": f"HITS.{panda_id}._000001.pool.root.1,log.{panda_id}.tgz",
+        "scopeOut": "mc23",
+        "scopeLog": "mc23",
+        "realDatasets": "mc23.HITS,mc23.log",
+        "ddmEndPointOut": "SITE_DATADISK,SITE_DATADISK",
+        "logFile": f"log.{panda_id}.tgz",
+        "logGUID": f"{panda_id + 1:032X}",
+        "destinationblockToken": "NULL,NULL",
+        "fileDestinationSE": "SITE,SITE",
+        "prodDBlockToken": "NULL",
+        "jobPars": "--maxEvents=100 " * 20,
+    }
+
+
+# handler emulating getJob of the panda server with latency
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        data = parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode())
+        time.sleep(latency)
+        n_jobs = int(data["nJobs"][0])
+        with pandaIDsLock:
+            first_id = pandaIDs["next"]
+            pandaIDs["next"] += n_jobs
+        jobs = [make_job(panda_id, data["siteName"][0]) for panda_id in range(first_id, first_id + n_jobs)]
+        body = json.dumps({"StatusCode": 0, "jobs": jobs}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+# start server
+serverCert, serverKey = make_cert("server")
+clientCert, clientKey = make_cert("client")
+context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+context.load_cert_chain(serverCert, serverKey)
+context.load_verify_locations(clientCert)
+context.verify_mode = ssl.CERT_REQUIRED
+server = ThreadingHTTPServer(("localhost", 0), Handler)
+server.daemon_threads = True
+server.socket = context.wrap_socket(server.socket, server_side=True)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+harvester_config.pandacon.pandaURLSSL = f"https://localhost:{server.server_address[1]}/server/panda"
+harvester_config.pandacon.ca_cert = serverCert
+harvester_config.pandacon.cert_file = clientCert
+harvester_config.pandacon.key_file = clientKey
+harvester_config.pandacon.auth_type = "x509"
+harvester_config.pandacon.verbose = False
+
+
+# convert job JSONs to JobSpecs with input files as JobFetcher
+def convert_jobs(jobs, queue_name):
+    jobSpecs = []
+    for job in jobs:
+        jobSpec = JobSpec()
+        jobSpec.convert_job_json(job)
+        jobSpec.computingSite = queue_name
+        jobSpec.status = "starting"
+        jobSpec.subStatus = "fetched"
+        for tmpLFN, fileAttrs in jobSpec.get_input_file_attributes().items():
+            fileSpec = FileSpec()
+            fileSpec.PandaID = jobSpec.PandaID
+            fileSpec.taskID = jobSpec.taskID
+            fileSpec.lfn = tmpLFN
+            fileSpec.scope = fileAttrs["scope"]
+            fileSpec.fileType = "input"
+            fileSpec.status = "to_prepare"
+            jobSpec.add_in_file(fileSpec)
+        jobSpecs.append(jobSpec)
+    return jobSpecs
+
+
+# run a cycle and return time for getJob, time for insert_jobs, and number of jobs in DB
+def run(bulk):
+    harvester_config.pandacon.maxConcurrentRequests = maxConcurrentRequests if bulk else 1
+    harvester_config.db.database_filename = os.path.join(tmpDir, f"benchmark_{bulk}.db")
+    proxy = db_proxy.DBProxy()
+    for cls, table_name in [
+        (JobSpec, db_proxy.jobTableName),
+        (FileSpec, db_proxy.fileTableName),
+        (EventSpec, db_proxy.eventTableName),
+        (JobWorkerRelationSpec, db_proxy.jobWorkerTableName),
+    ]:
+        proxy.make_table(cls, table_name)
+    communicator = PandaCommunicator()
+    queueNames = [f"QUEUE_{i_queue:03d}" for i_queue in range(nQueues)]
+    argsList = [(queueName, "node", "managed", "node", nJobsPerQueue, None) for queueName in queueNames]
+    fetchTime = 0
+    insertTime = 0
+    if bulk:
+        # concurrent getJob and one insert_jobs
+        timeStart = time.monotonic()
+        jobsList = communicator.get_jobs_for_queues(argsList)
+        fetchTime += time.monotonic() - timeStart
+        jobSpecs = []
+        for queueName, (jobs, errStr) in zip(queueNames, jobsList):
+            jobSpecs += convert_jobs(jobs, queueName)
+        timeStart = time.monotonic()
+        proxy.insert_jobs(jobSpecs)
+        insertTime += time.monotonic() - timeStart
+    else:
+        # getJob and insert_jobs per queue
+        for queueName, args in zip(queueNames, argsList):
+            timeStart = time.monotonic()
+            jobs, errStr = communicator.get_jobs(*args)
+            fetchTime += time.monotonic() - timeStart
+            jobSpecs = convert_jobs(jobs, queueName)
+            timeStart = time.monotonic()
+            proxy.insert_jobs(jobSpecs)
+            insertTime += time.monotonic() - timeStart
+    proxy.execute(f"SELECT COUNT(*) FROM {db_proxy.jobTableName}")
+    (nJobsInDB,) = proxy.cur.fetchone()
+    return fetchTime, insertTime, nJobsInDB
+
+
+print(f"JobFetcher cycle for {nQueues} queues x {nJobsPerQueue} jobs with {latency} sec latency")
+allOK = True
+for label, bulk in [("per-queue serial", False), (f"bulk ({maxConcurrentRequests} concurrent)", True)]:
+    fetchTime, insertTime, nJobsInDB = run(bulk)
+    allOK = allOK and nJobsInDB == nQueues * nJobsPerQueue
+    print(f"{label:24} getJob {fetchTime:6.2f} sec, insert_jobs {insertTime:6.3f} sec, {nJobsInDB} jobs in DB")
+server.shutdown()
+sys.exit(0 if allOK else 1)
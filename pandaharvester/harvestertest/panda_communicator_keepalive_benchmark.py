@@ -0,0 +1,118 @@
+"""
+benchmark of requests/s of PandaCommunicator.post_ssl against a local HTTPS server requiring client certificates,
+with a new connection every call and with kept-alive sessions
+
+usage: python panda_communicator_keepalive_benchmark.py [n_requests] [n_threads]
+
+"""
+
+import json
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pandaharvester.harvestercommunicator.panda_communicator import PandaCommunicator
+from pandaharvester.harvesterconfig import harvester_config
+
+nRequests = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+nThreads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+tmpDir = tempfile.mkdtemp()
+
+
+# make self-signed certificate and key
+def make_cert(name):
+    cert_file = os.path.join(tmpDir, f"{name}.crt")
+    key_file = os.path.join(tmpDir, f"{name}.key")
+    subprocess.check_call(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=localhost",
+            "-addext",
+            "subjectAltName=DNS:localhost",
+            "-keyout",
+            key_file,
+            "-out",
+            cert_file,
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return cert_file, key_file
+
+
+# handler returning a small JSON like the panda server
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # avoid delayed ACK stall with headers and body written separately on kept-alive connections
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps({"StatusCode": 0}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+# start server
+serverCert, serverKey = make_cert("server")
+clientCert, clientKey = make_cert("client")
+context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+context.load_cert_chain(serverCert, serverKey)
+context.load_verify_locations(clientCert)
+context.verify_mode = ssl.CERT_REQUIRED
+server = ThreadingHTTPServer(("localhost", 0), Handler)
+server.daemon_threads = True
+server.socket = context.wrap_socket(server.socket, server_side=True)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+baseURL = f"https://localhost:{server.server_address[1]}/server/panda"
+harvester_config.pandacon.ca_cert = serverCert
+harvester_config.pandacon.verbose = False
+
+
+# run requests with communicators by threads as in CommunicatorPool and return requests/s
+def run(keep_alive):
+    communicator_list = []
+    for _ in range(nThreads):
+        communicator = PandaCommunicator()
+        communicator.keepAlive = keep_alive
+        communicator_list.append(communicator)
+
+    def _post(i_request):
+        tmpStat, tmpRes = communicator_list[i_request % nThreads].post_ssl("isAlive", {"id": i_request}, cert=(clientCert, clientKey), base_url=baseURL)
+        return tmpStat
+
+    with ThreadPoolExecutor(nThreads) as pool:
+        # one thread per communicator like CommunicatorPool
+        timeStart = time.monotonic()
+        results = list(pool.map(lambda i_thread: [_post(i) for i in range(i_thread, nRequests, nThreads)], range(nThreads)))
+        elapsed = time.monotonic() - timeStart
+    nOK = sum(sum(result) for result in results)
+    return nOK, nRequests / elapsed
+
+
+print(f"requests/s of post_ssl with {nRequests} requests by {nThreads} threads")
+for label, keepAlive in [("connection per call", False), ("kept-alive sessions", True)]:
+    nOK, rate = run(keepAlive)
+    print(f"{label:20} {rate:8.1f} requests/s ({nOK}/{nRequests} succeeded)")
+server.shutdown()
@@ -0,0 +1,218 @@
+"""
+measure bytes on the wire and end-to-end latency of a propagator cycle, i.e. update_jobs for finished jobs with job reports
+and output file reports, update of event ranges, and update_workers, against a local HTTPS server with simulated RTT and bandwidth,
+without and with compression of request bodies. fallback is checked with a server which does not accept compressed bodies
+
+usage: python panda_compression_benchmark.py [n_jobs] [rtt_sec] [bandwidth_in_MB_per_sec]
+
+"""
+
+import gzip
+import json
+import os
+import random
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from pandaharvester.harvestercommunicator import panda_communicator
+from pandaharvester.harvestercommunicator.panda_communicator import PandaCommunicator
+from pandaharvester.harvesterconfig import harvester_config
+from pandaharvester.harvestercore.event_spec import EventSpec
+from pandaharvester.harvestercore.job_spec import JobSpec
+from pandaharvester.harvestercore.work_spec import WorkSpec
+
+nJobs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+rtt = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+bandwidth = float(sys.argv[3]) if len(sys.argv) > 3 else 10.0
+nEventJobs = 2
+nEvents = 10000
+
+tmpDir = tempfile.mkdtemp()
+
+# bytes of bodies on the wire
+wireStats = {"sent": 0, "received": 0}
+wireStatsLock = threading.Lock()
+
+
+# make self-signed certificate and key
+def make_cert(name):
+    cert_file = os.path.join(tmpDir, f"{name}.crt")
+    key_file = os.path.join(tmpDir, f"{name}.key")
+    subprocess.check_call(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost"]
+        + ["-keyout", key_file, "-out", cert_file],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return cert_file, key_file
+
+
+# handler emulating updateJobsInBulk, updateEventRanges, and updateWorkers of the panda server after RTT and transfer time
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    # False to emulate a server which does not accept compressed request bodies
+    accept_compressed = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        request_bytes = len(body)
+        content_encoding = self.headers.get("Content-Encoding")
+        if content_encoding is not None and not self.accept_compressed:
+            self.send_body(415, b"unsupported Content-Encoding", request_bytes)
+            return
+        if content_encoding == "gzip":
+            body = gzip.decompress(body)
+        elif content_encoding == "zstd":
+            body = panda_communicator.zstandard.ZstdDecompressor().decompress(body)
+        data = parse_qs(body.decode())
+        if self.path.endswith("updateEventRanges"):
+            event_ranges = json.loads(data["eventRanges"][0])
+            ret = {"StatusCode": 0, "Returns": [True for item in event_ranges for _ in item["eventRanges"]]}
+        elif self.path.endswith("updateWorkers"):
+            ret = [True, [True for _ in json.loads(data["workers"][0])]]
+        else:
+            job_list = json.loads(data["jobList"][0])
+            ret = [True, [{"content": json.dumps({"StatusCode": 0, "PandaID": job["jobId"], "command": "NULL"})} for job in job_list]]
+        self.send_body(200, json.dumps(ret).encode(), request_bytes)
+
+    def send_body(self, code, body, request_bytes):
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        if len(body) > 1024 and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        with wireStatsLock:
+            wireStats["sent"] += request_bytes
+            wireStats["received"] += len(body)
+        time.sleep(rtt + (request_bytes + len(body)) / (bandwidth * 1024 * 1024))
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+# start server
+serverCert, serverKey = make_cert("server")
+clientCert, clientKey = make_cert("client")
+context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+context.load_cert_chain(serverCert, serverKey)
+context.load_verify_locations(clientCert)
+context.verify_mode = ssl.CERT_REQUIRED
+server = ThreadingHTTPServer(("localhost", 0), Handler)
+server.daemon_threads = True
+server.socket = context.wrap_socket(server.socket, server_side=True)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+harvester_config.pandacon.pandaURLSSL = f"https://localhost:{server.server_address[1]}/server/panda"
+harvester_config.pandacon.ca_cert = serverCert
+harvester_config.pandacon.cert_file = clientCert
+harvester_config.pandacon.key_file = clientKey
+harvester_config.pandacon.auth_type = "x509"
+harvester_config.pandacon.verbose = False
+
+
+# make finished jobs with job reports like the pilot and jobs with event ranges
+def make_jobs():
+    rand = random.Random(0)
+    jobspec_list = []
+    for i_job in range(nJobs + nEventJobs):
+        jobSpec = JobSpec()
+        jobSpec.PandaID = 1000000 + i_job
+        jobSpec.computingSite = "BENCHMARK_QUEUE"
+        jobSpec.attemptNr = 1
+        jobSpec.jobParams = {}
+        jobSpec.jobAttributes = {"node": f"node{i_job:04d}.example.com", "cpuConsumptionTime": rand.randint(1000, 100000), "transExitCode": 0}
+        if i_job < nJobs:
+            jobSpec.status = "finished"
+            jobSpec.metaData = {
+                "reportVersion": "1.0.0",
+                "executor": [
+                    {
+                        "name": f"step{i_step}",
+                        "statusOK": True,
+                        "resource": {
+                            "cpuTime": rand.randint(100, 10000),
+                            "wallTime": rand.randint(100, 10000),
+                            "memory": {"Max": rand.randint(10**6, 10**7)},
+                        },
+                        "logfileReport": {"countSummary": {"INFO": rand.randint(0, 1000), "WARNING": rand.randint(0, 100)}},
+                    }
+                    for i_step in range(20)
+                ],
+                "files": {
+                    "output": [
+                        {"name": f"EVNT.{i_file:06d}.pool.root.1", "file_guid": f"{rand.getrandbits(128):032X}", "nentries": 1000} for i_file in range(50)
+                    ]
+                },
+            }
+            jobSpec.outputFilesToReport = "".join(
+                f'<File ID="{rand.getrandbits(128):032X}"><logical><lfn name="EVNT.{i_file:06d}.pool.root.1"/></logical>'
+                f'<metadata att_name="fsize" att_value="{rand.randint(10**6, 10**9)}"/><metadata att_name="adler32" att_value="{rand.getrandbits(32):08x}"/></File>'
+                for i_file in range(50)
+            )
+        else:
+            jobSpec.status = "running"
+            for i_event in range(nEvents):
+                eventSpec = EventSpec()
+                eventSpec.eventRangeID = f"{jobSpec.PandaID}-1-1-{i_event}-1"
+                eventSpec.eventStatus = "finished"
+                eventSpec.subStatus = "finished"
+                jobSpec.add_event(eventSpec, None)
+        jobspec_list.append(jobSpec)
+    return jobspec_list
+
+
+# make workers
+def make_workers():
+    workspec_list = []
+    for i_worker in range(nJobs):
+        workSpec = WorkSpec()
+        workSpec.workerID = i_worker
+        workSpec.batchID = f"{10000 + i_worker}.0"
+        workSpec.status = "finished"
+        workSpec.computingSite = "BENCHMARK_QUEUE"
+        workSpec.nCore = 8
+        workSpec.pandaid_list = [1000000 + i_worker]
+        workspec_list.append(workSpec)
+    return workspec_list
+
+
+# run a propagator cycle and return bytes sent and received, elapsed time, and whether the results are OK
+def run(request_compression, accept_compressed):
+    harvester_config.pandacon.requestCompression = request_compression
+    Handler.accept_compressed = accept_compressed
+    communicator = PandaCommunicator()
+    jobspec_list = make_jobs()
+    workspec_list = make_workers()
+    with wireStatsLock:
+        wireStats["sent"] = wireStats["received"] = 0
+    timeStart = time.monotonic()
+    retList = communicator.update_jobs(jobspec_list, "benchmark")
+    workerRetList, _ = communicator.update_workers(workspec_list)
+    elapsed = time.monotonic() - timeStart
+    isOK = [retMap.get("PandaID") for retMap in retList] == [jobSpec.PandaID for jobSpec in jobspec_list]
+    isOK = isOK and all(eventSpec.subStatus == "done" for jobSpec in jobspec_list for eventSpec in jobSpec.events)
+    isOK = isOK and workerRetList == [True] * len(workspec_list)
+    return wireStats["sent"], wireStats["received"], elapsed, isOK
+
+
+print(f"propagator cycle of {nJobs} finished jobs, {nEventJobs} jobs with {nEvents} events, and {nJobs} workers with RTT {rtt} sec and {bandwidth} MB/s")
+caseList = [("no compression", None, True), ("gzip", "gzip", True)]
+if panda_communicator.zstandard is not None:
+    caseList.append(("zstd", "zstd", True))
+caseList.append(("gzip w/o support", "gzip", False))
+allOK = True
+for label, requestCompression, acceptCompressed in caseList:
+    nSent, nReceived, elapsed, isOK = run(requestCompression, acceptCompressed)
+    allOK = allOK and isOK
+    print(f"{label:17} sent {nSent / 1024:9.1f} kB, received {nReceived / 1024:7.1f} kB, {elapsed:6.2f} sec, results: {'OK' if isOK else 'NG'}")
+server.shutdown()
+sys.exit(0 if allOK else 1)
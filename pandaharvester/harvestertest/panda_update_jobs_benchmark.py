@@ -0,0 +1,126 @@
+"""
+benchmark of PandaCommunicator.update_jobs for event service jobs against a local HTTPS server with simulated RTT,
+sequentially and with concurrent requests. results of jobs are checked to be in the same order
+
+usage: python panda_update_jobs_benchmark.py [n_jobs] [rtt_sec] [max_concurrent_requests]
+
+"""
+
+import json
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from pandaharvester.harvestercommunicator.panda_communicator import PandaCommunicator
+from pandaharvester.harvesterconfig import harvester_config
+from pandaharvester.harvestercore.event_spec import EventSpec
+from pandaharvester.harvestercore.job_spec import JobSpec
+
+nJobs = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+rtt = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+maxConcurrentRequests = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+
+tmpDir = tempfile.mkdtemp()
+
+
+# make self-signed certificate and key
+def make_cert(name):
+    cert_file = os.path.join(tmpDir, f"{name}.crt")
+    key_file = os.path.join(tmpDir, f"{name}.key")
+    subprocess.check_call(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost"]
+        + ["-keyout", key_file, "-out", cert_file],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return cert_file, key_file
+
+
+# handler emulating updateEventRanges and updateJobsInBulk of the panda server after RTT
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        data = parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode())
+        time.sleep(rtt)
+        if self.path.endswith("updateEventRanges"):
+            event_ranges = json.loads(data["eventRanges"][0])
+            ret = {"StatusCode": 0, "Returns": [True for item in event_ranges for _ in item["eventRanges"]]}
+        else:
+            job_list = json.loads(data["jobList"][0])
+            ret = [True, [{"content": json.dumps({"StatusCode": 0, "PandaID": job["jobId"]})} for job in job_list]]
+        body = json.dumps(ret).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+# start server
+serverCert, serverKey = make_cert("server")
+clientCert, clientKey = make_cert("client")
+context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+context.load_cert_chain(serverCert, serverKey)
+context.load_verify_locations(clientCert)
+context.verify_mode = ssl.CERT_REQUIRED
+server = ThreadingHTTPServer(("localhost", 0), Handler)
+server.daemon_threads = True
+server.socket = context.wrap_socket(server.socket, server_side=True)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+harvester_config.pandacon.pandaURLSSL = f"https://localhost:{server.server_address[1]}/server/panda"
+harvester_config.pandacon.ca_cert = serverCert
+harvester_config.pandacon.cert_file = clientCert
+harvester_config.pandacon.key_file = clientKey
+harvester_config.pandacon.auth_type = "x509"
+harvester_config.pandacon.verbose = False
+
+
+# make event service jobs with events to update
+def make_jobs():
+    jobspec_list = []
+    for i_job in range(nJobs):
+        jobSpec = JobSpec()
+        jobSpec.PandaID = 1000000 + i_job
+        jobSpec.computingSite = "BENCHMARK_QUEUE"
+        jobSpec.status = "running"
+        jobSpec.attemptNr = 1
+        jobSpec.jobParams = {}
+        for i_event in range(10):
+            eventSpec = EventSpec()
+            eventSpec.eventRangeID = f"{jobSpec.PandaID}-1-1-{i_event}-1"
+            eventSpec.eventStatus = "finished"
+            eventSpec.subStatus = "finished"
+            jobSpec.add_event(eventSpec, None)
+        jobspec_list.append(jobSpec)
+    return jobspec_list
+
+
+# run update_jobs and return elapsed time and PandaIDs in results
+def run(max_concurrent_requests):
+    harvester_config.pandacon.maxConcurrentRequests = max_concurrent_requests
+    communicator = PandaCommunicator()
+    jobspec_list = make_jobs()
+    timeStart = time.monotonic()
+    retList = communicator.update_jobs(jobspec_list, "benchmark")
+    elapsed = time.monotonic() - timeStart
+    nDone = sum(1 for jobSpec in jobspec_list for eventSpec in jobSpec.events if eventSpec.subStatus == "done")
+    return elapsed, [retMap.get("PandaID") for retMap in retList], nDone
+
+
+print(f"update_jobs of {nJobs} event service jobs with RTT {rtt} sec")
+expectedIDs = [1000000 + i_job for i_job in range(nJobs)]
+for label, maxConcurrent in [("sequential", 1), (f"concurrent ({maxConcurrentRequests})", maxConcurrentRequests)]:
+    elapsed, pandaIDs, nDone = run(maxConcurrent)
+    print(f"{label:16} {elapsed:7.2f} sec, {nDone} events done, results in order: {'OK' if pandaIDs == expectedIDs else 'NG'}")
+server.shutdown()
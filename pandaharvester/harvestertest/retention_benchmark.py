@@ -0,0 +1,135 @@
+"""
+benchmark of rows/s reclaimed from job_table by the legacy per-row deletion and by chunked range deletes
+with each retention mode, and of the change of live table size
+
+usage: python retention_benchmark.py [n_jobs] [chunk_size]
+
+"""
+
+import datetime
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+
+from pandaharvester.harvesterconfig import harvester_config
+from pandaharvester.harvestercore import db_proxy
+from pandaharvester.harvestercore.event_spec import EventSpec
+from pandaharvester.harvestercore.file_spec import FileSpec
+from pandaharvester.harvestercore.job_spec import JobSpec
+from pandaharvester.harvestercore.job_worker_relation_spec import JobWorkerRelationSpec
+from pandaharvester.harvestercore.work_spec import WorkSpec
+
+nJobs = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+chunkSize = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+# use scratch databases
+tmpDir = tempfile.mkdtemp()
+harvester_config.db.engine = "sqlite"
+harvester_config.db.verbose = False
+
+
+# fill tables with old done jobs and a few active jobs
+def fill_tables(proxy):
+    for cls, table_name in [
+        (JobSpec, db_proxy.jobTableName),
+        (FileSpec, db_proxy.fileTableName),
+        (EventSpec, db_proxy.eventTableName),
+        (JobWorkerRelationSpec, db_proxy.jobWorkerTableName),
+        (WorkSpec, db_proxy.workTableName),
+        (JobSpec, db_proxy.jobArchiveTableName),
+    ]:
+        proxy.make_table(cls, table_name)
+    timeOld = datetime.datetime.utcnow() - datetime.timedelta(days=10)
+    jobs = []
+    files = []
+    rels = []
+    for i in range(nJobs):
+        jobSpec = JobSpec()
+        jobSpec.PandaID = i + 1
+        jobSpec.computingSite = "SITE"
+        jobSpec.status = "finished"
+        # keep every 10th job active
+        jobSpec.subStatus = "running" if i % 10 == 0 else "done"
+        jobSpec.modificationTime = timeOld
+        jobSpec.jobParams = {"param": "x" * 200}
+        jobs.append(jobSpec.values_list())
+        fileSpec = FileSpec()
+        fileSpec.fileID = i + 1
+        fileSpec.PandaID = jobSpec.PandaID
+        fileSpec.lfn = f"file_{i}"
+        files.append(fileSpec.values_list())
+        relSpec = JobWorkerRelationSpec()
+        relSpec.PandaID = jobSpec.PandaID
+        relSpec.workerID = i + 1
+        rels.append(relSpec.values_list())
+    for cls, table_name, varMaps in [
+        (JobSpec, db_proxy.jobTableName, jobs),
+        (FileSpec, db_proxy.fileTableName, files),
+        (JobWorkerRelationSpec, db_proxy.jobWorkerTableName, rels),
+    ]:
+        proxy.executemany(f"INSERT INTO {table_name} ({cls.column_names()}) {cls.bind_values_expression()}", varMaps)
+    proxy.commit()
+
+
+# delete old jobs in the old way for comparison
+def legacy_delete(proxy, timeout):
+    sqlGJ = f"SELECT PandaID FROM {db_proxy.jobTableName} "
+    sqlGJ += "WHERE subStatus=:subStatus AND propagatorTime IS NULL "
+    sqlGJ += "AND ((modificationTime IS NOT NULL AND modificationTime<:timeLimit1) "
+    sqlGJ += "OR (modificationTime IS NULL AND creationTime<:timeLimit2)) "
+    varMap = dict()
+    varMap[":subStatus"] = "done"
+    varMap[":timeLimit1"] = datetime.datetime.utcnow() - datetime.timedelta(hours=timeout)
+    varMap[":timeLimit2"] = datetime.datetime.utcnow() - datetime.timedelta(hours=timeout * 2)
+    proxy.execute(sqlGJ, varMap)
+    nDel = 0
+    for (pandaID,) in proxy.cur.fetchall():
+        varMap = {":PandaID": pandaID}
+        proxy.execute(f"DELETE FROM {db_proxy.jobTableName} WHERE PandaID=:PandaID ", varMap)
+        nDel += proxy.cur.rowcount
+        for table_name in [db_proxy.fileTableName, db_proxy.eventTableName, db_proxy.jobWorkerTableName]:
+            proxy.execute(f"DELETE FROM {table_name} WHERE PandaID=:PandaID ", varMap)
+        proxy.commit()
+    return nDel
+
+
+# run a mode
+def run(mode):
+    harvester_config.db.database_filename = os.path.join(tmpDir, f"benchmark_{mode}.db")
+    proxy = db_proxy.DBProxy()
+    fill_tables(proxy)
+    statsBefore = proxy.get_table_stats(db_proxy.jobTableName)
+    timeStart = time.monotonic()
+    if mode == "legacy":
+        nRows = legacy_delete(proxy, 24)
+    else:
+        nRows = 0
+        lastKey = None
+        while True:
+            keyList, specList, lastKey = proxy.get_rows_to_archive(db_proxy.jobTableName, 24, chunkSize, mode == "file", lastKey)
+            if mode == "file":
+                with gzip.open(os.path.join(tmpDir, f"{db_proxy.jobTableName}_{nRows}.jsonl.gz"), "wt") as f:
+                    for spec in specList:
+                        f.write(json.dumps({attr[1:]: val for attr, val in spec.values_map().items()}, default=str) + "\n")
+            if len(keyList) > 0:
+                nRows += proxy.archive_rows(db_proxy.jobTableName, 24, keyList, mode)
+            if lastKey is None:
+                break
+    duration = time.monotonic() - timeStart
+    statsAfter = proxy.get_table_stats(db_proxy.jobTableName)
+    # check results
+    proxy.execute(f"SELECT COUNT(*) FROM {db_proxy.fileTableName}")
+    assert proxy.cur.fetchone()[0] == statsAfter["n_rows"]
+    proxy.execute(f"SELECT COUNT(*) FROM {db_proxy.jobArchiveTableName}")
+    assert proxy.cur.fetchone()[0] == (nRows if mode == "table" else 0)
+    return nRows, duration, statsBefore["n_rows"], statsAfter["n_rows"]
+
+
+print(f"Retiring old jobs from {nJobs} jobs in chunks of {chunkSize}")
+print(f"{'mode':10} {'rows':>8} {'time':>9} {'rows/s':>10} {'live rows':>20}")
+for mode in ["legacy", "delete", "table", "file"]:
+    nRows, duration, nBefore, nAfter = run(mode)
+    print(f"{mode:10} {nRows:8d} {duration:7.2f} s {nRows / duration:10.1f} {nBefore:9d} -> {nAfter:7d}")
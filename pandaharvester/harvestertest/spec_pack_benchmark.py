@@ -0,0 +1,105 @@
+"""
+benchmark of CPU time and peak memory to load WorkSpecs from a result set
+with the per-attribute pack and the precompiled unpacker of SpecBase
+
+usage: python spec_pack_benchmark.py [n_workers]
+
+"""
+
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from pandaharvester.harvesterconfig import harvester_config
+from pandaharvester.harvestercore import db_proxy
+from pandaharvester.harvestercore.spec_base import JSONDecodeError, as_python_object
+from pandaharvester.harvestercore.work_spec import WorkSpec
+
+nWorkers = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+# use a scratch database
+harvester_config.db.engine = "sqlite"
+harvester_config.db.verbose = False
+harvester_config.db.database_filename = os.path.join(tempfile.mkdtemp(), "benchmark.db")
+
+
+# pack in the old way for comparison
+def legacy_pack(spec, values, slim=False):
+    if hasattr(values, "_asdict"):
+        values = values._asdict()
+    for attr in spec.attributes:
+        if slim and attr in spec.skipAttrsToSlim:
+            val = None
+        else:
+            val = values[attr]
+            if attr in spec.serializedAttrs and val is not None:
+                try:
+                    val = json.loads(val, object_hook=as_python_object)
+                except JSONDecodeError:
+                    pass
+        object.__setattr__(spec, attr, val)
+
+
+# fill table
+proxy = db_proxy.DBProxy()
+proxy.make_table(WorkSpec, db_proxy.workTableName)
+timeNow = datetime.datetime.utcnow()
+varMaps = []
+for i in range(nWorkers):
+    workSpec = WorkSpec()
+    workSpec.workerID = i + 1
+    workSpec.batchID = f"{i}.0"
+    workSpec.computingSite = f"SITE_{i % 20}"
+    workSpec.status = WorkSpec.ST_running
+    workSpec.modificationTime = timeNow
+    workSpec.workParams = {"param": "x" * 100}
+    workSpec.workAttributes = {str(i): {"attr": "y" * 200, "list": list(range(20))}}
+    varMaps.append(workSpec.values_list())
+sql = f"INSERT INTO {db_proxy.workTableName} ({WorkSpec.column_names()}) {WorkSpec.bind_values_expression()}"
+proxy.executemany(sql, varMaps)
+proxy.commit()
+del varMaps
+
+# read all
+sql = f"SELECT {WorkSpec.column_names()} FROM {db_proxy.workTableName} "
+proxy.execute(sql)
+rows = proxy.cur.fetchall()
+print(f"Loading {len(rows)} workers")
+
+
+# load workers with a pack function
+def load(pack_func):
+    workSpecs = []
+    for row in rows:
+        workSpec = WorkSpec()
+        pack_func(workSpec, row)
+        workSpecs.append(workSpec)
+    return workSpecs
+
+
+# measure CPU time and then peak memory separately since tracing memory slows down execution
+def measure(pack_func):
+    timeStart = time.process_time()
+    load(pack_func)
+    cpuTime = time.process_time() - timeStart
+    tracemalloc.start()
+    workSpecs = load(pack_func)
+    _, peakMemory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return workSpecs, cpuTime, peakMemory
+
+
+legacySpecs, legacyTime, legacyMemory = measure(legacy_pack)
+del legacySpecs
+newSpecs, newTime, newMemory = measure(WorkSpec.pack)
+# check consistency
+workSpec = WorkSpec()
+legacy_pack(workSpec, rows[-1])
+assert workSpec.values_list() == newSpecs[-1].values_list()
+print(f"{'pack':12} {'cpu time':>10} {'peak memory':>14}")
+print(f"{'legacy':12} {legacyTime:8.2f} s {legacyMemory / 2**20:10.1f} MiB")
+print(f"{'unpacker':12} {newTime:8.2f} s {newMemory / 2**20:10.1f} MiB")
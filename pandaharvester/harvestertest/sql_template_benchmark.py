@@ -0,0 +1,93 @@
+"""
+microbenchmark of DBProxy.convert_params with and without the SQL template cache
+using SQL statements extracted from db_proxy.py
+
+usage: python sql_template_benchmark.py [n_loops]
+
+"""
+
+import ast
+import inspect
+import sys
+import time
+
+from pandaharvester.harvesterconfig import harvester_config
+from pandaharvester.harvestercore import db_proxy
+
+nLoops = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+
+# evaluate a piece of SQL with module globals, using a dummy value for local variables
+def eval_sql_piece(node):
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.JoinedStr):
+        ret = ""
+        for value in node.values:
+            if isinstance(value, ast.Constant):
+                ret += value.value
+            else:
+                try:
+                    ret += str(eval(compile(ast.Expression(value.value), "<sql>", "eval"), vars(db_proxy)))
+                except Exception:
+                    ret += "1"
+        return ret
+    try:
+        return str(eval(compile(ast.Expression(node), "<sql>", "eval"), vars(db_proxy)))
+    except Exception:
+        return None
+
+
+# collect SQL statements built in methods of DBProxy
+def collect_statements():
+    tree = ast.parse(inspect.getsource(db_proxy))
+    statements = set()
+    for funcNode in ast.walk(tree):
+        if not isinstance(funcNode, ast.FunctionDef):
+            continue
+        sqlMap = dict()
+        for node in ast.walk(funcNode):
+            if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+                name = node.targets[0].id
+                if name.lower().startswith("sql"):
+                    piece = eval_sql_piece(node.value)
+                    if piece is not None:
+                        sqlMap[name] = piece
+            elif isinstance(node, ast.AugAssign) and isinstance(node.target, ast.Name) and node.target.id in sqlMap:
+                piece = eval_sql_piece(node.value)
+                if piece is not None:
+                    sqlMap[node.target.id] += piece
+        for sql in sqlMap.values():
+            if sql.split(" ")[0].upper() in ["SELECT", "INSERT", "UPDATE", "DELETE"]:
+                statements.add(sql)
+    return sorted(statements)
+
+
+# run conversion of all statements
+def run(proxy, statements, varmaps, use_cache):
+    timeStart = time.monotonic()
+    for _ in range(nLoops):
+        for sql, varMap in zip(statements, varmaps):
+            if not use_cache:
+                db_proxy.sqlTemplateCache.clear()
+            proxy.convert_params(sql, varMap)
+    return time.monotonic() - timeStart
+
+
+statements = collect_statements()
+proxy = db_proxy.DBProxy()
+# no lock to measure only conversion
+proxy.usingAppLock = False
+print(f"Collected {len(statements)} SQL statements from db_proxy.py")
+print(f"{'engine':10} {'no cache':>12} {'cache':>12} {'speedup':>8}")
+for engine in ["sqlite", "mariadb"]:
+    harvester_config.db.engine = engine
+    db_proxy.sqlTemplateCache.clear()
+    varmaps = []
+    for sql in statements:
+        varMap = {name: 1 for name in proxy._make_sql_template(sql)[1]}
+        varmaps.append(varMap)
+    timeNoCache = run(proxy, statements, varmaps, False)
+    timeCache = run(proxy, statements, varmaps, True)
+    nCalls = nLoops * len(statements)
+    print(f"{engine:10} {1e6 * timeNoCache / nCalls:9.2f} us {1e6 * timeCache / nCalls:9.2f} us {timeNoCache / timeCache:7.1f}x")
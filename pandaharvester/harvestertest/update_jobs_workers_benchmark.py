@@ -0,0 +1,129 @@
+"""
+count DB round trips of DBProxy.update_jobs_workers for a monitor chunk with and without batching.
+round trips on MariaDB are estimated from statements on sqlite, where executemany of INSERT is sent
+as a multi-row INSERT while executemany of other statements is sent row by row by the connectors
+
+usage: python update_jobs_workers_benchmark.py [n_workers]
+
+"""
+
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+from pandaharvester.harvesterconfig import harvester_config
+from pandaharvester.harvestercore import db_proxy
+from pandaharvester.harvestercore.event_spec import EventSpec
+from pandaharvester.harvestercore.file_spec import FileSpec
+from pandaharvester.harvestercore.job_spec import JobSpec
+from pandaharvester.harvestercore.job_worker_relation_spec import JobWorkerRelationSpec
+from pandaharvester.harvestercore.work_spec import WorkSpec
+
+nWorkers = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+# use scratch databases
+tmpDir = tempfile.mkdtemp()
+harvester_config.db.engine = "sqlite"
+harvester_config.db.verbose = False
+
+
+# cursor wrapper to count round trips
+class CountingCursor(object):
+    def __init__(self, cur, counter):
+        self.cur = cur
+        self.counter = counter
+
+    def execute(self, sql, params=()):
+        self.counter["statements"] += 1
+        self.counter["round_trips"] += 1
+        return self.cur.execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self.counter["statements"] += 1
+        if sql.split()[0].upper() == "INSERT":
+            self.counter["round_trips"] += 1
+        else:
+            self.counter["round_trips"] += len(param_list)
+        return self.cur.executemany(sql, param_list)
+
+    def __getattr__(self, name):
+        return getattr(self.cur, name)
+
+    def __iter__(self):
+        return iter(self.cur)
+
+
+# make a chunk of workers for a job like the monitor does for jobs with multiple workers
+def make_chunk(proxy):
+    timeNow = datetime.datetime.utcnow()
+    jobSpec = JobSpec()
+    jobSpec.PandaID = 1
+    jobSpec.status = "running"
+    jobSpec.subStatus = "running"
+    jobSpec.modificationTime = timeNow
+    proxy.execute(f"INSERT INTO {db_proxy.jobTableName} ({JobSpec.column_names()}) {JobSpec.bind_values_expression()}", jobSpec.values_list())
+    workSpecs = []
+    for i in range(nWorkers):
+        workSpec = WorkSpec()
+        workSpec.workerID = i + 1
+        workSpec.mapType = WorkSpec.MT_MultiWorkers
+        workSpec.status = WorkSpec.ST_submitted
+        workSpec.lockedBy = "monitor"
+        workSpec.modificationTime = timeNow
+        proxy.execute(f"INSERT INTO {db_proxy.workTableName} ({WorkSpec.column_names()}) {WorkSpec.bind_values_expression()}", workSpec.values_list())
+        workSpecs.append(workSpec)
+    proxy.commit()
+    # changes by the monitor
+    for i, workSpec in enumerate(workSpecs):
+        workSpec.reset_changed_list()
+        workSpec.set_status(WorkSpec.ST_running)
+        workSpec.set_work_attributes({"workerID": workSpec.workerID})
+        if i % 2 == 0:
+            workSpec.checkTime = timeNow
+    jobSpec.reset_changed_list()
+    jobSpec.subStatus = "running"
+    jobSpec.set_attributes({1: {"nEvents": 10}})
+    return [jobSpec], workSpecs, [[jobSpec.PandaID] for _ in workSpecs]
+
+
+# run update_jobs_workers in a mode
+def run(use_batch):
+    harvester_config.db.batchUpdateJobsWorkers = use_batch
+    harvester_config.db.database_filename = os.path.join(tmpDir, f"benchmark_{use_batch}.db")
+    proxy = db_proxy.DBProxy()
+    proxy.make_table(WorkSpec, db_proxy.workTableName)
+    proxy.make_table(JobSpec, db_proxy.jobTableName)
+    proxy.make_table(FileSpec, db_proxy.fileTableName)
+    proxy.make_table(EventSpec, db_proxy.eventTableName)
+    proxy.make_table(JobWorkerRelationSpec, db_proxy.jobWorkerTableName)
+    jobSpecs, workSpecs, pandaIDsList = make_chunk(proxy)
+    counter = {"statements": 0, "round_trips": 0, "commits": 0}
+    proxy.cur = CountingCursor(proxy.cur, counter)
+    origCommit = proxy.commit
+
+    def commit():
+        counter["commits"] += 1
+        counter["round_trips"] += 1
+        origCommit()
+
+    proxy.commit = commit
+    timeStart = time.monotonic()
+    retVal = proxy.update_jobs_workers(jobSpecs, workSpecs, "monitor", pandaIDsList)
+    counter["time"] = time.monotonic() - timeStart
+    assert retVal is True
+    # check results
+    proxy.execute(f"SELECT COUNT(*) FROM {db_proxy.workTableName} WHERE status=:status AND lockedBy IS NULL", {":status": WorkSpec.ST_running})
+    assert proxy.cur.fetchone()[0] == nWorkers
+    proxy.execute(f"SELECT COUNT(*) FROM {db_proxy.jobWorkerTableName}")
+    assert proxy.cur.fetchone()[0] == nWorkers
+    return counter
+
+
+print(f"update_jobs_workers for a chunk of {nWorkers} workers with one job")
+print(f"{'mode':10} {'statements':>10} {'commits':>8} {'MariaDB round trips':>20} {'sqlite time':>12}")
+for useBatch in [False, True]:
+    counter = run(useBatch)
+    label = "batched" if useBatch else "per row"
+    print(f"{label:10} {counter['statements']:10d} {counter['commits']:8d} {counter['round_trips']:20d} {counter['time']:10.3f} s")
@@ -45,6 +45,7 @@ setup(
     extras_require={
         "kubernetes": ["kubernetes", "pyyaml"],
         "mysql": ["mysqlclient"],
+        "async": ["aiohttp"],
         "atlasgrid": ["uWSGI >= 2.0.20", "htcondor >= 10.3.0", "mysqlclient >= 2.1.1"],
     },
     data_files=[